@@ -22,6 +22,10 @@ def create_app(config_name=None):
     from app.utils.database import init_db
     init_db(app)
 
+    # Статика с долгим кэшированием и сжатыми копиями
+    from app.utils.static_assets import init_static_assets
+    init_static_assets(app)
+
     # Register blueprints
     from app.routes.auth import auth_bp
     from app.routes.main import main_bp
@@ -33,10 +37,15 @@ def create_app(config_name=None):
     app.register_blueprint(user_bp)
     app.register_blueprint(admin_bp)
 
+    # Обработчик загрузок сразу подбирает задания, оставшиеся после перезапуска
+    if not app.config.get('TESTING'):
+        from app.services.upload_service import get_upload_processor
+        get_upload_processor(app)
+
     # Запускаем планировщик в отдельном потоке (только в production)
     if config_name == 'production':
         from app.tasks.scheduler import run_scheduler
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+        scheduler_thread = threading.Thread(target=run_scheduler, args=(app,), daemon=True)
         scheduler_thread.start()
 
     @app.context_processor
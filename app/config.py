@@ -19,12 +19,116 @@ class Config:
     DB_PASSWORD = os.getenv('DB_PASSWORD', '123456')
     DB_SCHEMA = os.getenv('DB_SCHEMA', 'lombard')
 
+    # Встроенный режим (DB_TYPE=sqlite): файл базы и ожидание блокировки записи, сек
+    SQLITE_PATH = os.getenv('SQLITE_PATH', os.path.join(os.path.dirname(__file__), '..', 'lombard.db'))
+    SQLITE_TIMEOUT = float(os.getenv('SQLITE_TIMEOUT', '30'))
+
+    # Пул соединений с БД
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # ожидание свободного соединения, сек
+    DB_POOL_CHECK_INTERVAL = float(os.getenv('DB_POOL_CHECK_INTERVAL', '30'))  # проверка простаивавших соединений, сек
+    DB_ITERSIZE = int(os.getenv('DB_ITERSIZE', '2000'))  # строк за одно чтение серверного курсора в iter_query
+    DB_PREPARED_CACHE_SIZE = int(os.getenv('DB_PREPARED_CACHE_SIZE', '64'))  # подготовленных операторов на соединение, 0 - отключить
+    DB_PREPARE_THRESHOLD = int(os.getenv('DB_PREPARE_THRESHOLD', '5'))  # выполнений запроса до его подготовки
+
+    # Реплики для чтения (URL через запятую): SELECT из query_db/iter_query идут на них.
+    # Выбор реплики - round_robin или least_connections; реплика, отстающая больше
+    # DB_REPLICA_MAX_LAG сек, пропускается (отставание проверяется раз в
+    # DB_REPLICA_LAG_CHECK_INTERVAL сек). После записи пользователь читает
+    # из основной базы до конца запроса и еще DB_REPLICA_STICKY_SECONDS сек
+    DB_REPLICA_URLS = [url.strip() for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url.strip()]
+    DB_REPLICA_STRATEGY = os.getenv('DB_REPLICA_STRATEGY', 'round_robin')
+    DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+    DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '10'))
+    DB_REPLICA_STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+
+    # Профилирование запросов к БД: порог медленного запроса (мс), доля медленных
+    # SELECT, для которых снимается EXPLAIN ANALYZE, и размер выборки на эндпоинт
+    QUERY_PROFILING = os.getenv('QUERY_PROFILING', 'True').lower() == 'true'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+    SLOW_QUERY_EXPLAIN_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', '0'))
+    QUERY_PROFILE_SAMPLES = int(os.getenv('QUERY_PROFILE_SAMPLES', '1000'))
+    # Кому отдавать заголовок Server-Timing (время в БД и число запросов):
+    # admin - только администраторам, all - всем (нагрузочные прогоны), off - никому
+    SERVER_TIMING = os.getenv('SERVER_TIMING', 'admin').lower()
+
+    # Индекс тарифов в памяти процесса (сбрасывается по NOTIFY, TTL - страховка)
+    TARIFF_CACHE_TTL = int(os.getenv('TARIFF_CACHE_TTL', '300'))
+
+    # Кэш филиалов администраторов (сбрасывается по NOTIFY, TTL - страховка), сек
+    BRANCH_SCOPE_TTL = int(os.getenv('BRANCH_SCOPE_TTL', '300'))
+
+    # Кэш записей пользователей для get_current_user (сбрасывается по NOTIFY), сек; 0 - отключен
+    CURRENT_USER_TTL = int(os.getenv('CURRENT_USER_TTL', '60'))
+
+    # Кэш справочников: филиалы, категории, роли (сбрасывается по NOTIFY, TTL - страховка), сек
+    REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL', '600'))
+
+    # Размер пачки при автоматическом переводе просроченных талонов
+    EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv('EXPIRY_SWEEP_BATCH_SIZE', '1000'))
+    # Минимальный интервал между обходами, запускаемыми со страниц, сек
+    EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', '300'))
+
+    # Журнал аудита: размер страницы, режим подсчета (exact/capped/estimated)
+    # и период полной перезагрузки списков для фильтров, сек
+    AUDIT_PAGE_SIZE = int(os.getenv('AUDIT_PAGE_SIZE', '20'))
+    AUDIT_COUNT_MODE = os.getenv('AUDIT_COUNT_MODE', 'capped')
+    AUDIT_COUNT_CAP = int(os.getenv('AUDIT_COUNT_CAP', '10000'))
+    AUDIT_FILTERS_REFRESH = int(os.getenv('AUDIT_FILTERS_REFRESH', '3600'))
+
+    # Фоновая запись аудита пачками: размер очереди, пачки и период сброса, сек
+    AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', 'True').lower() == 'true'
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0'))
+
+    # Секции audit_logs (при AUDIT_PARTITIONING=true в init_db.py): запас
+    # секций вперед, срок хранения и каталог для архивов старых секций
+    AUDIT_PARTITION_MONTHS_AHEAD = int(os.getenv('AUDIT_PARTITION_MONTHS_AHEAD', '3'))
+    AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', '24'))
+    AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR',
+                                  os.path.join(os.path.dirname(__file__), '..', 'archive', 'audit_logs'))
+
+    # Через сколько секунд после освобождения последней ссылки удалять файл вложения
+    UPLOAD_PURGE_GRACE = int(os.getenv('UPLOAD_PURGE_GRACE', '3600'))
+
+    # Сколько заявок можно одобрить или отклонить одной массовой операцией
+    BULK_REQUESTS_MAX = int(os.getenv('BULK_REQUESTS_MAX', '200'))
+
+    # Размер страницы списков заявок и талонов пользователя и число
+    # последних заявок/талонов в личном кабинете
+    USER_PAGE_SIZE = int(os.getenv('USER_PAGE_SIZE', '20'))
+    USER_DASHBOARD_ITEMS = int(os.getenv('USER_DASHBOARD_ITEMS', '5'))
+
+    # Выгрузки CSV/XLSX: строк за одно чтение серверного курсора и разделитель CSV
+    EXPORT_ITERSIZE = int(os.getenv('EXPORT_ITERSIZE', '2000'))
+    EXPORT_CSV_DELIMITER = os.getenv('EXPORT_CSV_DELIMITER', ';')
+
+    # Фоновая обработка загруженных фотографий (см. app/services/upload_service.py):
+    # временный каталог, число потоков, размер порции, число попыток, пауза перед
+    # повтором (секунды, удваивается с каждой попыткой), через сколько секунд задание
+    # считается зависшим и команда антивируса (путь к файлу добавляется в конец)
+    UPLOAD_STAGING_DIR = os.getenv('UPLOAD_STAGING_DIR',
+                                   os.path.join(os.path.dirname(__file__), '..', 'instance', 'upload_staging'))
+    UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))
+    UPLOAD_JOB_BATCH = int(os.getenv('UPLOAD_JOB_BATCH', '20'))
+    UPLOAD_JOB_MAX_ATTEMPTS = int(os.getenv('UPLOAD_JOB_MAX_ATTEMPTS', '3'))
+    UPLOAD_JOB_RETRY_DELAY = int(os.getenv('UPLOAD_JOB_RETRY_DELAY', '60'))
+    UPLOAD_JOB_STALE_AFTER = int(os.getenv('UPLOAD_JOB_STALE_AFTER', '600'))
+    UPLOAD_SCAN_COMMAND = os.getenv('UPLOAD_SCAN_COMMAND', '')
+
+    # Срок кэширования загрузок и ресурсов с отпечатком (они не меняются по одному URL)
+    # и подготовка сжатых копий css/js при запуске
+    STATIC_IMMUTABLE_MAX_AGE = int(os.getenv('STATIC_IMMUTABLE_MAX_AGE', '31536000'))
+    PRECOMPRESS_STATIC = os.getenv('PRECOMPRESS_STATIC', 'True').lower() == 'true'
+
     # Вычисляем DATABASE_URL при создании экземпляра
     def __init__(self):
         if self.DB_TYPE == 'postgresql':
             self.DATABASE_URL = f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
         elif self.DB_TYPE == 'sqlite':
-            self.DATABASE_URL = f"sqlite:///{os.path.join(os.path.dirname(__file__), '..', 'lombard.db')}"
+            self.DATABASE_URL = f"sqlite:///{self.SQLITE_PATH}"
         else:
             raise ValueError(f"Unsupported database type: {self.DB_TYPE}")
 
@@ -3,7 +3,7 @@ from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, TextAreaField, SelectField, DecimalField, SubmitField
 from wtforms.fields.simple import MultipleFileField
 from wtforms.validators import DataRequired, Length, NumberRange, Email, Regexp
-from app.utils.database import query_db
+from app.services.reference_service import get_branches, get_categories
 
 
 class LoginForm(FlaskForm):
@@ -50,12 +50,9 @@ class RegistrationForm(FlaskForm):
 class RequestForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super(RequestForm, self).__init__(*args, **kwargs)
-        # Динамически заполняем выбор филиалов и категорий
-        branches = query_db('SELECT branch_id, name FROM branches ORDER BY name')
-        categories = query_db('SELECT category_id, name FROM item_categories ORDER BY name')
-
-        self.branch_id.choices = [(b['branch_id'], b['name']) for b in branches]
-        self.category_id.choices = [(c['category_id'], c['name']) for c in categories]
+        # Динамически заполняем выбор филиалов и категорий (из кэша справочников)
+        self.branch_id.choices = [(b['branch_id'], b['name']) for b in get_branches()]
+        self.category_id.choices = [(c['category_id'], c['name']) for c in get_categories()]
 
     branch_id = SelectField('Филиал', coerce=int, validators=[
         DataRequired(message='Выберите филиал')
@@ -1,22 +1,36 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from app.utils.auth import get_current_user
-from app.utils.database import get_db, query_db
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, jsonify,
+                   current_app, g, abort, Response, stream_with_context)
+from app.utils.auth import get_current_user, get_admin_branches
+from app.utils.database import (get_db, is_sqlite, query_db, get_pool_stats, get_endpoint_stats, get_prepared_stats,
+                                get_replica_stats)
 from app.services.tariff_service import find_tariff
+from app.utils.image_utils import generate_derivatives
+from app.services.audit_service import audit, get_audit_filter_options, get_audit_writer_stats
+from app.services.upload_service import get_upload_job_stats
+from app.services.export_service import EXPORTS, FORMATS as EXPORT_FORMATS, build_export_query, stream_export
 from datetime import datetime, timedelta
-from app.services.ticket_service import update_expired_tickets
+from app.services.ticket_service import sweep_expired_tickets_if_due
+from app.services.request_service import approve_requests, reject_requests
+from app.utils.pagination import keyset_page
 from decimal import Decimal
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 
 def admin_required(f):
-    """Декоратор для проверки прав администратора"""
+    """Декоратор для проверки прав администратора.
+
+    Кладет в g.admin_branches филиалы администратора (из кэша),
+    а в g.branch_ids - их идентификаторы.
+    """
     from functools import wraps
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not session.get('user_id') or session.get('user_role') != 1:
             flash('Доступ запрещен. Требуются права администратора.', 'error')
             return redirect(url_for('main.index'))
+        g.admin_branches = get_admin_branches(session['user_id'])
+        g.branch_ids = [b['branch_id'] for b in g.admin_branches]
         return f(*args, **kwargs)
 
     return decorated_function
@@ -25,24 +39,15 @@ def admin_required(f):
 @admin_bp.route('/dashboard')
 @admin_required
 def dashboard():
-    # Получаем филиалы, к которым привязан администратор
-    user_branches = query_db('''
-        SELECT b.* FROM user_branches ub
-        JOIN branches b ON ub.branch_id = b.branch_id
-        WHERE ub.user_id = %s
-    ''', [session['user_id']])
-
-    branch_ids = [b['branch_id'] for b in user_branches]
-
-    # Статистика по заявкам
-    pending_requests = query_db('''
-        SELECT COUNT(*) as count FROM requests 
-        WHERE status = 'submitted' AND branch_id = ANY(%s)
-    ''', [branch_ids], one=True)
-
-    active_tickets = query_db('''
-        SELECT COUNT(*) as count FROM pawn_tickets 
-        WHERE status = 'issued' AND branch_id = ANY(%s)
+    branch_ids = g.branch_ids
+
+    # Статистика по заявкам и талонам из сводной таблицы branch_stats
+    stats = query_db('''
+        SELECT
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'request' AND status = 'submitted'), 0) as pending_requests,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'ticket' AND status = 'issued'), 0) as active_tickets
+        FROM branch_stats
+        WHERE branch_id = ANY(%s)
     ''', [branch_ids], one=True)
 
     # Последние заявки
@@ -58,23 +63,16 @@ def dashboard():
     ''', [branch_ids])
 
     return render_template('admin/dashboard.html',
-                           pending_requests=pending_requests['count'],
-                           active_tickets=active_tickets['count'],
+                           pending_requests=stats['pending_requests'],
+                           active_tickets=stats['active_tickets'],
                            recent_requests=recent_requests,
-                           branches=user_branches)
+                           branches=g.admin_branches)
 
 
 @admin_bp.route('/requests')
 @admin_required
 def requests():
-    # Получаем филиалы администратора
-    user_branches = query_db('''
-        SELECT b.branch_id FROM user_branches ub
-        JOIN branches b ON ub.branch_id = b.branch_id
-        WHERE ub.user_id = %s
-    ''', [session['user_id']])
-
-    branch_ids = [b['branch_id'] for b in user_branches]
+    branch_ids = g.branch_ids
 
     status_filter = request.args.get('status', 'submitted')
 
@@ -112,12 +110,7 @@ def request_detail(request_id):
         return redirect(url_for('admin.requests'))
 
     # Проверяем, что заявка принадлежит филиалу администратора
-    user_branches = query_db('''
-        SELECT branch_id FROM user_branches WHERE user_id = %s
-    ''', [session['user_id']])
-
-    branch_ids = [b['branch_id'] for b in user_branches]
-    if request_data['branch_id'] not in branch_ids:
+    if request_data['branch_id'] not in g.branch_ids:
         flash('У вас нет доступа к этой заявке', 'error')
         return redirect(url_for('admin.requests'))
 
@@ -129,13 +122,23 @@ def request_detail(request_id):
         ORDER BY uploaded_at
     ''', [request_id])
 
+    # Превью вместо оригиналов (для старых вложений создаются при первом просмотре)
+    attachments = [dict(a, derivatives=generate_derivatives(a['file_path'])) for a in attachments]
+
+    # Фотографии, которые еще обрабатываются в фоне
+    pending_uploads = query_db('''
+        SELECT COUNT(*) AS count FROM upload_jobs
+        WHERE request_id = %s AND status IN ('pending', 'processing')
+    ''', [request_id], one=True)['count']
+
     # Ищем подходящий тариф
     tariff = find_tariff(request_data['category_id'], request_data['branch_id'], request_data['estimated_cost'])
 
     return render_template('admin/request_detail.html',
                            request=request_data,
                            tariff=tariff,
-                           attachments=attachments)
+                           attachments=attachments,
+                           pending_uploads=pending_uploads)
 
 
 @admin_bp.route('/request/<int:request_id>/approve', methods=['POST'])
@@ -224,22 +227,14 @@ def approve_request(request_id):
         cur.execute('UPDATE requests SET status = %s WHERE request_id = %s',
                     ('approved', request_id))
 
-        # Логируем действие
-        import json
-        cur.execute('''
-            INSERT INTO audit_logs (user_id, action_key, payload)
-            VALUES (%s, %s, %s)
-        ''', (
-            session['user_id'],
-            'approve_request',
-            json.dumps({
-                'request_id': request_id,
-                'ticket_number': ticket_number,
-                'loan_amount': float(loan_amount),
-                'ransom_amount': float(ransom_amount),
-                'loan_days': loan_days
-            })
-        ))
+        # Логируем действие в той же транзакции - выдача займа
+        audit('approve_request', {
+            'request_id': request_id,
+            'ticket_number': ticket_number,
+            'loan_amount': float(loan_amount),
+            'ransom_amount': float(ransom_amount),
+            'loan_days': loan_days
+        }, user_id=session['user_id'], sync=True, cur=cur)
 
         conn.commit()
         flash(f'Заявка одобрена! Талон успешно создан на {loan_days} дней.', 'success')
@@ -260,18 +255,10 @@ def reject_request(request_id):
     try:
         cur.execute('UPDATE requests SET status = %s WHERE request_id = %s',
                     ('rejected', request_id))
+        conn.commit()
 
         # Логируем действие
-        import json
-        cur.execute('''
-            INSERT INTO audit_logs (user_id, action_key, payload)
-            VALUES (%s, %s, %s)
-        ''', (
-            session['user_id'],
-            'reject_request',
-            json.dumps({'request_id': request_id})
-        ))
-        conn.commit()
+        audit('reject_request', {'request_id': request_id}, user_id=session['user_id'])
         flash('Заявка отклонена', 'success')
 
     except Exception as e:
@@ -281,30 +268,108 @@ def reject_request(request_id):
     return redirect(url_for('admin.requests'))
 
 
+def _parse_bulk_form():
+    """Действие, сроки займа по заявкам и признак JSON-ответа из тела запроса.
+
+    Форма: action, request_ids (несколько), loan_days - общий срок и loan_days_<id> -
+    срок отдельной заявки. JSON: {"action", "request_ids", "loan_days",
+    "loan_terms": {"<id>": дни}}.
+    """
+    data = request.get_json(silent=True)
+    if data is not None:
+        loan_days = data.get('loan_days', 30)
+        loan_terms = {int(k): v for k, v in (data.get('loan_terms') or {}).items()}
+        for request_id in data.get('request_ids') or []:
+            loan_terms.setdefault(int(request_id), loan_days)
+        return data.get('action'), {k: int(v) for k, v in loan_terms.items()}, True
+
+    loan_days = request.form.get('loan_days', 30, type=int)
+    loan_terms = {}
+    for request_id in request.form.getlist('request_ids', type=int):
+        loan_terms[request_id] = request.form.get(f'loan_days_{request_id}', loan_days, type=int)
+    return request.form.get('action'), loan_terms, False
+
+
+@admin_bp.route('/requests/bulk', methods=['POST'])
+@admin_required
+def bulk_requests():
+    """Массовое одобрение или отклонение заявок одной транзакцией"""
+    try:
+        action, loan_terms, as_json = _parse_bulk_form()
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'Некорректные данные'}), 400
+
+    error = None
+    if action not in ('approve', 'reject'):
+        error = 'Неизвестное действие'
+    elif not loan_terms:
+        error = 'Не выбрано ни одной заявки'
+    elif len(loan_terms) > current_app.config.get('BULK_REQUESTS_MAX', 200):
+        error = f"Можно обработать не больше {current_app.config.get('BULK_REQUESTS_MAX', 200)} заявок за раз"
+
+    if error:
+        if as_json:
+            return jsonify({'error': error}), 400
+        flash(error, 'error')
+        return redirect(url_for('admin.requests'))
+
+    if action == 'approve':
+        results = approve_requests(loan_terms, session['user_id'], g.branch_ids)
+    else:
+        results = reject_requests(list(loan_terms), session['user_id'], g.branch_ids)
+
+    succeeded = sum(1 for result in results.values() if result['ok'])
+    if as_json:
+        return jsonify({
+            'action': action,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': [dict(result, request_id=request_id) for request_id, result in results.items()],
+        })
+
+    if succeeded:
+        flash(f"{'Одобрено' if action == 'approve' else 'Отклонено'} заявок: {succeeded}", 'success')
+    for request_id, result in results.items():
+        if not result['ok']:
+            flash(f"Заявка #{request_id}: {result['error']}", 'error')
+    return redirect(url_for('admin.requests'))
+
+
+def _ticket_status_condition(status_filter):
+    """Условие отбора талонов по статусу и его параметры.
+
+    Талоны с истекшим сроком считаем просроченными, даже если обход их еще не обновил.
+    """
+    if status_filter == 'issued':
+        return "pt.status = 'issued' AND pt.end_date >= CURRENT_DATE", []
+    if status_filter == 'defaulted':
+        return "(pt.status = 'defaulted' OR (pt.status = 'issued' AND pt.end_date < CURRENT_DATE))", []
+    return "pt.status = %s", [status_filter]
+
+
 @admin_bp.route('/tickets')
 @admin_required
 def tickets():
-    # Обновляем статусы просроченных талонов перед показом
-    expired_count = update_expired_tickets()
+    # Обход просроченных талонов выполняется не чаще раза в интервал,
+    # в выборке просрочка определяется по end_date
+    expired_count = sweep_expired_tickets_if_due()
     if expired_count > 0:
         flash(f'Обновлено {expired_count} просроченных талонов', 'info')
 
-    # Остальной код остается без изменений...
-    user_branches = query_db('''
-        SELECT b.branch_id FROM user_branches ub
-        JOIN branches b ON ub.branch_id = b.branch_id
-        WHERE ub.user_id = %s
-    ''', [session['user_id']])
-
-    branch_ids = [b['branch_id'] for b in user_branches]
+    branch_ids = g.branch_ids
 
     status_filter = request.args.get('status', 'issued')
 
+    status_condition, params = _ticket_status_condition(status_filter)
+    params.append(branch_ids)
+
     tickets = query_db('''
         SELECT pt.*, u.first_name, u.last_name, u.phone,
                b.name as branch_name, i.name as item_name,
                ic.name as category_name,
+               (pt.status = 'issued' AND pt.end_date < CURRENT_DATE) as is_expired,
                CASE 
+                   WHEN pt.status = 'issued' AND pt.end_date < CURRENT_DATE THEN 'Просрочен'
                    WHEN pt.status = 'issued' THEN 'Активен'
                    WHEN pt.status = 'redeemed' THEN 'Выкуплен'
                    WHEN pt.status = 'defaulted' THEN 'Просрочен'
@@ -315,9 +380,9 @@ def tickets():
         JOIN branches b ON pt.branch_id = b.branch_id
         JOIN items i ON pt.item_id = i.item_id
         JOIN item_categories ic ON i.category_id = ic.category_id
-        WHERE pt.status = %s AND pt.branch_id = ANY(%s)
+        WHERE ''' + status_condition + ''' AND pt.branch_id = ANY(%s)
         ORDER BY pt.end_date ASC
-    ''', [status_filter, branch_ids])
+    ''', params)
 
     return render_template('admin/tickets.html', tickets=tickets, status_filter=status_filter)
 
@@ -341,16 +406,8 @@ def redeem_ticket(ticket_id):
             WHERE ticket_id = %s
         ''', (session['user_id'], ticket_id))
 
-        # Логируем действие
-        import json
-        cur.execute('''
-            INSERT INTO audit_logs (user_id, action_key, payload)
-            VALUES (%s, %s, %s)
-        ''', (
-            session['user_id'],
-            'redeem_ticket',
-            json.dumps({'ticket_id': ticket_id})
-        ))
+        # Логируем действие в той же транзакции - прием платежа
+        audit('redeem_ticket', {'ticket_id': ticket_id}, user_id=session['user_id'], sync=True, cur=cur)
 
         conn.commit()
         flash('Талон успешно выкуплен!', 'success')
@@ -365,15 +422,17 @@ def redeem_ticket(ticket_id):
 @admin_bp.route('/branches')
 @admin_required
 def branches():
-    # Получаем филиалы администратора с статистикой
+    # Получаем филиалы администратора со статистикой из branch_stats
     user_branches = query_db('''
         SELECT b.*, ub.is_primary,
-               (SELECT COUNT(*) FROM requests r WHERE r.branch_id = b.branch_id AND r.status = 'submitted') as pending_requests,
-               (SELECT COUNT(*) FROM pawn_tickets pt WHERE pt.branch_id = b.branch_id AND pt.status = 'issued') as active_tickets,
-               (SELECT COALESCE(SUM(loan_amount), 0) FROM pawn_tickets pt WHERE pt.branch_id = b.branch_id AND pt.status = 'issued') as total_loans
+               COALESCE(SUM(bs.item_count) FILTER (WHERE bs.entity = 'request' AND bs.status = 'submitted'), 0) as pending_requests,
+               COALESCE(SUM(bs.item_count) FILTER (WHERE bs.entity = 'ticket' AND bs.status = 'issued'), 0) as active_tickets,
+               COALESCE(SUM(bs.loan_total) FILTER (WHERE bs.entity = 'ticket' AND bs.status = 'issued'), 0) as total_loans
         FROM user_branches ub
         JOIN branches b ON ub.branch_id = b.branch_id
+        LEFT JOIN branch_stats bs ON bs.branch_id = b.branch_id
         WHERE ub.user_id = %s
+        GROUP BY b.branch_id, ub.is_primary
         ORDER BY ub.is_primary DESC, b.name
     ''', [session['user_id']])
 
@@ -383,38 +442,39 @@ def branches():
 @admin_bp.route('/reports')
 @admin_required
 def reports():
-    # Получаем филиалы администратора
-    user_branches = query_db('''
-        SELECT b.branch_id FROM user_branches ub
-        JOIN branches b ON ub.branch_id = b.branch_id
-        WHERE ub.user_id = %s
-    ''', [session['user_id']])
-
-    branch_ids = [b['branch_id'] for b in user_branches]
+    branch_ids = g.branch_ids
 
-    # Статистика по заявкам
-    requests_stats = query_db('''
+    # Статистика по заявкам и талонам из сводной таблицы branch_stats
+    stats = query_db('''
         SELECT 
-            COUNT(*) as total,
-            COUNT(*) FILTER (WHERE status = 'submitted') as pending,
-            COUNT(*) FILTER (WHERE status = 'approved') as approved,
-            COUNT(*) FILTER (WHERE status = 'rejected') as rejected
-        FROM requests 
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'request'), 0) as requests_total,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'request' AND status = 'submitted'), 0) as requests_pending,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'request' AND status = 'approved'), 0) as requests_approved,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'request' AND status = 'rejected'), 0) as requests_rejected,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'ticket'), 0) as tickets_total,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'ticket' AND status = 'issued'), 0) as tickets_active,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'ticket' AND status = 'redeemed'), 0) as tickets_redeemed,
+            COALESCE(SUM(item_count) FILTER (WHERE entity = 'ticket' AND status = 'defaulted'), 0) as tickets_defaulted,
+            COALESCE(SUM(loan_total) FILTER (WHERE entity = 'ticket'), 0) as tickets_total_loans,
+            COALESCE(SUM(ransom_total) FILTER (WHERE entity = 'ticket'), 0) as tickets_total_ransom
+        FROM branch_stats 
         WHERE branch_id = ANY(%s)
     ''', [branch_ids], one=True)
 
-    # Статистика по талонам
-    tickets_stats = query_db('''
-        SELECT 
-            COUNT(*) as total,
-            COUNT(*) FILTER (WHERE status = 'issued') as active,
-            COUNT(*) FILTER (WHERE status = 'redeemed') as redeemed,
-            COUNT(*) FILTER (WHERE status = 'defaulted') as defaulted,
-            COALESCE(SUM(loan_amount), 0) as total_loans,
-            COALESCE(SUM(ransom_amount), 0) as total_ransom
-        FROM pawn_tickets 
-        WHERE branch_id = ANY(%s)
-    ''', [branch_ids], one=True)
+    requests_stats = {
+        'total': stats['requests_total'],
+        'pending': stats['requests_pending'],
+        'approved': stats['requests_approved'],
+        'rejected': stats['requests_rejected'],
+    }
+    tickets_stats = {
+        'total': stats['tickets_total'],
+        'active': stats['tickets_active'],
+        'redeemed': stats['tickets_redeemed'],
+        'defaulted': stats['tickets_defaulted'],
+        'total_loans': stats['tickets_total_loans'],
+        'total_ransom': stats['tickets_total_ransom'],
+    }
 
     # Самые активные пользователи
     top_users = query_db('''
@@ -434,104 +494,210 @@ def reports():
                            tickets_stats=tickets_stats,
                            top_users=top_users)
 
+def _parse_date(value):
+    """Разбирает дату из фильтра (YYYY-MM-DD), некорректные значения игнорируются"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _date_range_conditions(column, date_from, date_to):
+    """Условия ' AND ...' для периода по колонке времени (диапазоном, чтобы работал индекс)"""
+    conditions = ''
+    params = []
+    day_from = _parse_date(date_from)
+    day_to = _parse_date(date_to)
+    if day_from:
+        conditions += f' AND {column} >= %s'
+        params.append(day_from)
+    if day_to:
+        conditions += f' AND {column} < %s'
+        params.append(day_to + timedelta(days=1))
+    return conditions, params
+
+
+def _count_audit_logs(conditions, params):
+    """Подсчитывает записи журнала в режиме AUDIT_COUNT_MODE.
+
+    exact - точный COUNT(*); capped - считает не больше AUDIT_COUNT_CAP строк;
+    estimated - без фильтров берет оценку из статистики планировщика,
+    с фильтрами (и в режиме sqlite, где такой статистики нет) работает как capped. Возвращает (количество, вид подсчета):
+    'exact', 'capped' (достигнут предел) или 'estimated'.
+    """
+    mode = current_app.config.get('AUDIT_COUNT_MODE', 'capped')
+    cap = current_app.config.get('AUDIT_COUNT_CAP', 10000)
+
+    if mode == 'exact':
+        row = query_db('SELECT COUNT(*) as total FROM audit_logs al WHERE 1=1' + conditions,
+                       params, one=True)
+        return row['total'], 'exact'
+
+    if mode == 'estimated' and not conditions and not is_sqlite():
+        row = query_db('''
+            SELECT GREATEST(SUM(c.reltuples), 0)::bigint as total
+            FROM pg_class c
+            WHERE c.oid = 'audit_logs'::regclass
+               OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'audit_logs'::regclass)
+        ''', one=True)
+        return row['total'], 'estimated'
+
+    row = query_db('''
+        SELECT COUNT(*) as total FROM (
+            SELECT 1 FROM audit_logs al WHERE 1=1''' + conditions + ''' LIMIT %s
+        ) limited
+    ''', list(params) + [cap + 1], one=True)
+    if row['total'] > cap:
+        return cap, 'capped'
+    return row['total'], 'exact'
+
+
 @admin_bp.route('/audit-logs')
 @admin_required
 def audit_logs():
-    # Получаем филиалы администратора
-    user_branches = query_db('''
-        SELECT b.branch_id FROM user_branches ub
-        JOIN branches b ON ub.branch_id = b.branch_id
-        WHERE ub.user_id = %s
-    ''', [session['user_id']])
-
-    branch_ids = [b['branch_id'] for b in user_branches]
-
     # Параметры пагинации и фильтрации
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    offset = (page - 1) * per_page
+    per_page = current_app.config.get('AUDIT_PAGE_SIZE', 20)
+    cursor = request.args.get('cursor')
+    direction = request.args.get('dir', 'next')
 
     user_filter = request.args.get('user_id', type=int)
     action_filter = request.args.get('action_key', '')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
 
-    # Базовый запрос с JOIN для получения информации о пользователе
-    query = '''
-        SELECT al.*, u.first_name, u.last_name, u.email
-        FROM audit_logs al
-        LEFT JOIN users u ON al.user_id = u.user_id
-        WHERE 1=1
-    '''
+    # Условия фильтрации общие для выборки и подсчета
+    conditions = ''
     params = []
 
     # Фильтр по пользователю
     if user_filter:
-        query += ' AND al.user_id = %s'
+        conditions += ' AND al.user_id = %s'
         params.append(user_filter)
 
     # Фильтр по действию
     if action_filter:
-        query += ' AND al.action_key = %s'
+        conditions += ' AND al.action_key = %s'
         params.append(action_filter)
 
-    # Фильтр по дате
-    if date_from:
-        query += ' AND DATE(al.action_time) >= %s'
-        params.append(date_from)
-    if date_to:
-        query += ' AND DATE(al.action_time) <= %s'
-        params.append(date_to)
-
-    # Сортировка и пагинация
-    query += ' ORDER BY al.action_time DESC LIMIT %s OFFSET %s'
-    params.extend([per_page, offset])
+    # Фильтр по дате: диапазон по action_time, чтобы работал индекс
+    date_conditions, date_params = _date_range_conditions('al.action_time', date_from, date_to)
+    conditions += date_conditions
+    params.extend(date_params)
 
-    # Получаем записи аудита
-    logs = query_db(query, params)
-
-    # Общее количество записей для пагинации
-    count_query = 'SELECT COUNT(*) as total FROM audit_logs al WHERE 1=1'
-    count_params = []
-
-    if user_filter:
-        count_query += ' AND al.user_id = %s'
-        count_params.append(user_filter)
-    if action_filter:
-        count_query += ' AND al.action_key = %s'
-        count_params.append(action_filter)
-    if date_from:
-        count_query += ' AND DATE(al.action_time) >= %s'
-        count_params.append(date_from)
-    if date_to:
-        count_query += ' AND DATE(al.action_time) <= %s'
-        count_params.append(date_to)
-
-    total_count = query_db(count_query, count_params, one=True)['total']
-
-    # Получаем список пользователей для фильтра
-    users = query_db('''
-        SELECT DISTINCT u.user_id, u.first_name, u.last_name, u.email
+    # Пагинация по ключу (action_time, log_id) вместо OFFSET
+    logs, prev_cursor, next_cursor = keyset_page('''
+        SELECT al.*, u.first_name, u.last_name, u.email
         FROM audit_logs al
-        JOIN users u ON al.user_id = u.user_id
-        ORDER BY u.first_name, u.last_name
-    ''')
+        LEFT JOIN users u ON al.user_id = u.user_id
+        WHERE 1=1
+    ''' + conditions, params, 'al.action_time', 'al.log_id', per_page, cursor, direction)
 
-    # Получаем список уникальных действий для фильтра
-    actions = query_db('''
-        SELECT DISTINCT action_key 
-        FROM audit_logs 
-        ORDER BY action_key
-    ''')
+    total_count, count_kind = _count_audit_logs(conditions, params)
+
+    # Списки для фильтров поддерживаются инкрементально
+    users, actions = get_audit_filter_options()
 
     return render_template('admin/audit_logs.html',
                            logs=logs,
-                           page=page,
                            per_page=per_page,
                            total_count=total_count,
+                           count_kind=count_kind,
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor,
                            users=users,
                            actions=actions,
                            user_filter=user_filter,
                            action_filter=action_filter,
                            date_from=date_from,
-                           date_to=date_to)
\ No newline at end of file
+                           date_to=date_to)
+
+
+@admin_bp.route('/db-pool')
+@admin_required
+def db_pool_stats():
+    """Статистика пула соединений с БД, реплик и кэша подготовленных операторов"""
+    stats = get_pool_stats() or {}
+    stats['prepared_statements'] = get_prepared_stats()
+    stats['replicas'] = get_replica_stats()
+    return jsonify(stats)
+
+
+@admin_bp.route('/audit-queue')
+@admin_required
+def audit_queue_stats():
+    """Статистика очереди фоновой записи аудита"""
+    return jsonify(get_audit_writer_stats() or {})
+
+
+@admin_bp.route('/query-stats')
+@admin_required
+def query_stats():
+    """Сводка профилировщика запросов по эндпоинтам"""
+    return jsonify(get_endpoint_stats())
+
+
+@admin_bp.route('/upload-jobs')
+@admin_required
+def upload_jobs_stats():
+    """Состояние журнала фоновой обработки загрузок"""
+    statuses = query_db('''
+        SELECT status, COUNT(*) AS count, MIN(created_at) AS oldest_created_at
+        FROM upload_jobs GROUP BY status
+    ''')
+    return jsonify({
+        'jobs': {s['status']: {'count': s['count'], 'oldest': s['oldest_created_at'].isoformat()}
+                 for s in statuses},
+        'processed': get_upload_job_stats(),
+    })
+
+
+@admin_bp.route('/export/<name>.<fmt>')
+@admin_required
+def export(name, fmt):
+    """Выгрузка талонов, заявок, платежей или журнала аудита в CSV/XLSX.
+
+    Строки читаются серверным курсором и отдаются по мере чтения,
+    поэтому память не зависит от размера выгрузки.
+    Фильтры: date_from, date_to; status (талоны, заявки); user_id, action_key (журнал).
+    """
+    if name not in EXPORTS or fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    conditions, params = _date_range_conditions(
+        EXPORTS[name]['date_column'], request.args.get('date_from', ''), request.args.get('date_to', '')
+    )
+
+    status_filter = request.args.get('status')
+    if name == 'tickets' and status_filter:
+        status_condition, status_params = _ticket_status_condition(status_filter)
+        conditions += ' AND ' + status_condition
+        params.extend(status_params)
+    elif name == 'requests' and status_filter:
+        conditions += ' AND r.status = %s'
+        params.append(status_filter)
+    elif name == 'audit_logs':
+        if request.args.get('user_id', type=int):
+            conditions += ' AND al.user_id = %s'
+            params.append(request.args.get('user_id', type=int))
+        if request.args.get('action_key'):
+            conditions += ' AND al.action_key = %s'
+            params.append(request.args['action_key'])
+
+    query, query_params = build_export_query(name, g.branch_ids, conditions, params)
+
+    audit('export_data', {
+        'export': name,
+        'format': fmt,
+        'filters': request.args.to_dict()
+    }, user_id=session['user_id'])
+
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+    return Response(
+        stream_with_context(stream_export(name, fmt, query, query_params)),
+        content_type=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Не буферизовать ответ в nginx
+            'X-Accel-Buffering': 'no',
+        },
+    )
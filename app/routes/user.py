@@ -1,13 +1,61 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 from app.utils.auth import get_current_user
-from app.utils.database import get_db, query_db
+from app.utils.database import get_db, query_db, read_only
 from app.forms import RequestForm
 from datetime import datetime
-from app.services.ticket_service import update_expired_tickets
-from app.utils.file_utils import save_uploaded_files
+from app.services.ticket_service import sweep_expired_tickets_if_due
+from app.utils.file_utils import stage_uploaded_files, discard_staged_files
+from app.services.audit_service import audit
+from app.services.upload_service import enqueue_upload_jobs, get_upload_processor
+from app.utils.pagination import keyset_page
 
 user_bp = Blueprint('user', __name__, url_prefix='/user')
 
+# Сводка личного кабинета: по строке на каждую из последних заявок и активных
+# талонов (kind = 'request' / 'ticket'), в каждой строке - общие счетчики.
+# Если строк нет, оба счетчика равны нулю. Запрос начинается с WITH, поэтому
+# выполняется в блоке read_only (см. dashboard).
+DASHBOARD_SUMMARY = '''
+    WITH counts AS (
+        SELECT
+            (SELECT COUNT(*) FROM requests WHERE user_id = %s) AS requests_count,
+            (SELECT COUNT(*) FROM pawn_tickets
+             WHERE user_id = %s AND status = 'issued' AND end_date >= CURRENT_DATE) AS tickets_count
+    ),
+    recent_requests AS (
+        SELECT r.request_id AS id, r.created_at, r.item_name, b.name AS branch_name,
+               ic.name AS category_name, r.estimated_cost, r.status
+        FROM requests r
+        JOIN branches b ON r.branch_id = b.branch_id
+        JOIN item_categories ic ON r.category_id = ic.category_id
+        WHERE r.user_id = %s
+        ORDER BY r.created_at DESC, r.request_id DESC
+        LIMIT %s
+    ),
+    active_tickets AS (
+        SELECT pt.ticket_id AS id, pt.created_at, i.name AS item_name, b.name AS branch_name,
+               pt.loan_amount, pt.ransom_amount, pt.end_date
+        FROM pawn_tickets pt
+        JOIN branches b ON pt.branch_id = b.branch_id
+        JOIN items i ON pt.item_id = i.item_id
+        WHERE pt.user_id = %s AND pt.status = 'issued' AND pt.end_date >= CURRENT_DATE
+        ORDER BY pt.created_at DESC, pt.ticket_id DESC
+        LIMIT %s
+    )
+    SELECT 'request' AS kind, rr.id, rr.created_at, rr.item_name, rr.branch_name,
+           rr.category_name, rr.estimated_cost, rr.status,
+           NULL::numeric AS loan_amount, NULL::numeric AS ransom_amount, NULL::date AS end_date,
+           c.requests_count, c.tickets_count
+    FROM recent_requests rr CROSS JOIN counts c
+    UNION ALL
+    SELECT 'ticket', tk.id, tk.created_at, tk.item_name, tk.branch_name,
+           NULL, NULL, NULL,
+           tk.loan_amount, tk.ransom_amount, tk.end_date,
+           c.requests_count, c.tickets_count
+    FROM active_tickets tk CROSS JOIN counts c
+    ORDER BY kind, created_at DESC, id DESC
+'''
+
 
 @user_bp.route('/dashboard')
 def dashboard():
@@ -16,30 +64,22 @@ def dashboard():
         flash('Пожалуйста, войдите в систему', 'error')
         return redirect(url_for('auth.login'))
 
-    # Обновляем статусы просроченных талонов
-    update_expired_tickets()
+    # Обход просроченных талонов выполняется не чаще раза в интервал,
+    # просрочку для отображения определяем по end_date
+    sweep_expired_tickets_if_due()
 
-    # Получаем заявки пользователя
-    requests = query_db('''
-        SELECT r.*, b.name as branch_name, ic.name as category_name 
-        FROM requests r 
-        JOIN branches b ON r.branch_id = b.branch_id 
-        JOIN item_categories ic ON r.category_id = ic.category_id 
-        WHERE r.user_id = %s 
-        ORDER BY r.created_at DESC
-    ''', [user['user_id']])
+    # Счетчики и первые страницы заявок и активных талонов одним запросом
+    per_page = current_app.config.get('USER_DASHBOARD_ITEMS', 5)
+    with read_only():
+        rows = query_db(DASHBOARD_SUMMARY, [user['user_id']] * 3 + [per_page, user['user_id'], per_page])
 
-    # Получаем активные талоны
-    tickets = query_db('''
-        SELECT pt.*, b.name as branch_name, i.name as item_name
-        FROM pawn_tickets pt
-        JOIN branches b ON pt.branch_id = b.branch_id
-        JOIN items i ON pt.item_id = i.item_id
-        WHERE pt.user_id = %s AND pt.status = 'issued'
-        ORDER BY pt.created_at DESC
-    ''', [user['user_id']])
+    summary = {'requests_count': 0, 'tickets_count': 0}
+    requests, tickets = [], []
+    for row in rows:
+        summary = {'requests_count': row['requests_count'], 'tickets_count': row['tickets_count']}
+        (requests if row['kind'] == 'request' else tickets).append(row)
 
-    return render_template('user/dashboard.html', requests=requests, tickets=tickets)
+    return render_template('user/dashboard.html', requests=requests, tickets=tickets, **summary)
 
 
 @user_bp.route('/request/new', methods=['GET', 'POST'])
@@ -52,6 +92,12 @@ def new_request():
     form = RequestForm()
 
     if form.validate_on_submit():
+        # Фотографии только переносятся во временный каталог до начала транзакции,
+        # проверка и сохранение выполняются в фоне (см. upload_service)
+        staged_files = []
+        if form.photos.data and form.photos.data[0].filename:  # Проверяем, что файлы были загружены
+            staged_files = stage_uploaded_files(form.photos.data)
+
         conn = get_db()
         cur = conn.cursor()
 
@@ -76,43 +122,28 @@ def new_request():
 
             request_id = cur.fetchone()['request_id']
 
-            # Обрабатываем загруженные фотографии
-            if form.photos.data and form.photos.data[0].filename:  # Проверяем, что файлы были загружены
-                saved_files = save_uploaded_files(form.photos.data, 'requests')
-
-                for file_info in saved_files:
-                    cur.execute('''
-                        INSERT INTO attachments (request_id, file_path, file_name, uploaded_by)
-                        VALUES (%s, %s, %s, %s)
-                    ''', (
-                        request_id,
-                        file_info['file_path'],
-                        file_info['file_name'],
-                        user['user_id']
-                    ))
+            # Задания на обработку фотографий фиксируются вместе с заявкой
+            enqueue_upload_jobs(cur, request_id, user['user_id'], staged_files)
+
+            conn.commit()
+
+            if staged_files:
+                get_upload_processor().kick()
 
             # Логируем действие
-            import json
-            cur.execute('''
-                INSERT INTO audit_logs (user_id, action_key, payload)
-                VALUES (%s, %s, %s)
-            ''', (
-                user['user_id'],
-                'create_request',
-                json.dumps({
-                    'request_number': request_number,
-                    'item_name': form.item_name.data,
-                    'estimated_cost': float(form.estimated_cost.data),
-                    'photos_count': len(saved_files) if 'saved_files' in locals() else 0
-                })
-            ))
+            audit('create_request', {
+                'request_number': request_number,
+                'item_name': form.item_name.data,
+                'estimated_cost': float(form.estimated_cost.data),
+                'photos_count': len(staged_files)
+            }, user_id=user['user_id'])
 
-            conn.commit()
             flash('Заявка успешно создана!', 'success')
             return redirect(url_for('user.dashboard'))
 
         except Exception as e:
             conn.rollback()
+            discard_staged_files(staged_files)
             flash(f'Ошибка при создании заявки: {str(e)}', 'error')
 
     return render_template('user/new_request.html', form=form)
@@ -124,11 +155,13 @@ def tickets():
         flash('Пожалуйста, войдите в систему', 'error')
         return redirect(url_for('auth.login'))
 
-    # Получаем активные талоны пользователя
-    tickets = query_db('''
+    # Талоны пользователя постранично (по ключу created_at, ticket_id)
+    tickets, prev_cursor, next_cursor = keyset_page('''
         SELECT pt.*, b.name as branch_name, i.name as item_name,
                i.description as item_description, ic.name as category_name,
+               (pt.status = 'issued' AND pt.end_date < CURRENT_DATE) as is_expired,
                CASE 
+                   WHEN pt.status = 'issued' AND pt.end_date < CURRENT_DATE THEN 'Просрочен'
                    WHEN pt.status = 'issued' THEN 'Активен'
                    WHEN pt.status = 'redeemed' THEN 'Выкуплен'
                    WHEN pt.status = 'defaulted' THEN 'Просрочен'
@@ -139,10 +172,15 @@ def tickets():
         JOIN items i ON pt.item_id = i.item_id
         JOIN item_categories ic ON i.category_id = ic.category_id
         WHERE pt.user_id = %s
-        ORDER BY pt.created_at DESC
-    ''', [user['user_id']])
+    ''', [user['user_id']], 'pt.created_at', 'pt.ticket_id',
+        per_page=current_app.config.get('USER_PAGE_SIZE', 20),
+        cursor=request.args.get('cursor'),
+        direction=request.args.get('dir', 'next'))
 
-    return render_template('user/tickets.html', tickets=tickets)
+    return render_template('user/tickets.html',
+                           tickets=tickets,
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor)
 
 @user_bp.route('/requests')
 def my_requests():
@@ -151,7 +189,8 @@ def my_requests():
         flash('Пожалуйста, войдите в систему', 'error')
         return redirect(url_for('auth.login'))
 
-    requests = query_db('''
+    # Заявки пользователя постранично (по ключу created_at, request_id)
+    requests, prev_cursor, next_cursor = keyset_page('''
         SELECT r.*, b.name as branch_name, ic.name as category_name,
                CASE 
                    WHEN r.status = 'submitted' THEN 'На рассмотрении'
@@ -162,8 +201,13 @@ def my_requests():
         FROM requests r 
         JOIN branches b ON r.branch_id = b.branch_id 
         JOIN item_categories ic ON r.category_id = ic.category_id 
-        WHERE r.user_id = %s 
-        ORDER BY r.created_at DESC
-    ''', [user['user_id']])
-
-    return render_template('user/requests.html', requests=requests)
\ No newline at end of file
+        WHERE r.user_id = %s
+    ''', [user['user_id']], 'r.created_at', 'r.request_id',
+        per_page=current_app.config.get('USER_PAGE_SIZE', 20),
+        cursor=request.args.get('cursor'),
+        direction=request.args.get('dir', 'next'))
+
+    return render_template('user/requests.html',
+                           requests=requests,
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor)
\ No newline at end of file
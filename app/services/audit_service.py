@@ -0,0 +1,281 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app, has_request_context, request
+from psycopg2.extras import execute_values
+from app.utils.database import get_db, get_pool, query_db
+from app.utils.sqlite_backend import SQLiteConnection
+
+AUDIT_INSERT = '''
+    INSERT INTO audit_logs (user_id, action_key, action_time, ip_address, user_agent, payload)
+    VALUES %s
+'''
+
+
+def _insert_audit_rows(cur, rows, page_size=100):
+    """Многострочный INSERT записей аудита (в SQLite - executemany по одной строке)"""
+    if isinstance(cur.connection, SQLiteConnection):
+        cur.executemany(AUDIT_INSERT.replace('%s', '(%s, %s, %s, %s, %s, %s)'), rows)
+    else:
+        execute_values(cur, AUDIT_INSERT, rows, page_size=page_size)
+
+
+# Кэш значений для фильтров журнала аудита (пользователи и действия).
+# Первая загрузка читает весь журнал, дальше дочитываются только записи
+# с log_id больше запомненного.
+_filters_lock = threading.Lock()
+_filters = {
+    'users': {},  # user_id -> {user_id, first_name, last_name, email}
+    'actions': set(),
+    'last_log_id': 0,
+    'loaded_at': None,
+}
+
+
+def _sorted_filters():
+    users = sorted(_filters['users'].values(), key=lambda u: (u['first_name'], u['last_name']))
+    actions = [{'action_key': a} for a in sorted(_filters['actions'])]
+    return users, actions
+
+
+def get_audit_filter_options():
+    """Возвращает списки пользователей и действий для фильтров журнала аудита"""
+    refresh = current_app.config.get('AUDIT_FILTERS_REFRESH', 3600)
+
+    with _filters_lock:
+        loaded_at = _filters['loaded_at']
+        full_reload = loaded_at is None or time.monotonic() - loaded_at >= refresh
+        if full_reload:
+            # Полная перезагрузка, чтобы из списков уходили архивированные записи
+            last_log_id = 0
+            users, actions = {}, set()
+        else:
+            last_log_id = _filters['last_log_id']
+            users, actions = dict(_filters['users']), set(_filters['actions'])
+
+    rows = query_db('''
+        SELECT user_id, action_key, MAX(log_id) as max_log_id
+        FROM audit_logs
+        WHERE log_id > %s
+        GROUP BY user_id, action_key
+    ''', [last_log_id])
+
+    new_user_ids = set()
+    for row in rows:
+        actions.add(row['action_key'])
+        last_log_id = max(last_log_id, row['max_log_id'])
+        if row['user_id'] is not None and row['user_id'] not in users:
+            new_user_ids.add(row['user_id'])
+
+    if new_user_ids:
+        for user in query_db('''
+            SELECT user_id, first_name, last_name, email
+            FROM users WHERE user_id = ANY(%s)
+        ''', [list(new_user_ids)]):
+            users[user['user_id']] = dict(user)
+
+    with _filters_lock:
+        # Параллельный запрос мог уже сохранить более свежее состояние
+        if full_reload or last_log_id >= _filters['last_log_id']:
+            _filters['users'] = users
+            _filters['actions'] = actions
+            _filters['last_log_id'] = last_log_id
+            if full_reload:
+                _filters['loaded_at'] = time.monotonic()
+        return _sorted_filters()
+
+
+class AuditWriter:
+    """Фоновая запись журнала аудита пачками.
+
+    Записи копятся в ограниченной очереди и сбрасываются одним многострочным
+    INSERT раз в flush_interval секунд или по накоплении batch_size записей.
+    Если очередь переполнена, audit() пишет запись синхронно в вызывающем
+    потоке (это и есть обратное давление), поэтому записи не теряются.
+    """
+
+    def __init__(self, pool, queue_size=10000, batch_size=500, flush_interval=1.0):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'overflow_sync_writes': 0,
+            'flush_errors': 0,
+            'dropped': 0,
+            'max_queue_depth': 0,
+            'last_flush_ms': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def submit(self, row):
+        """Ставит запись в очередь; False, если очередь переполнена"""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('overflow_sync_writes')
+            return False
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._queue.qsize())
+        return True
+
+    def write(self, rows):
+        """Записывает строки аудита отдельной транзакцией"""
+        conn = self.pool.getconn()
+        try:
+            cur = conn.cursor()
+            _insert_audit_rows(cur, rows, page_size=self.batch_size)
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+        self._count('written', len(rows))
+
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """Сбрасывает все накопленные записи"""
+        while not self._queue.empty():
+            self._flush_batch(self._drain())
+
+    def _flush_batch(self, batch, retries=3):
+        if not batch:
+            return
+        for attempt in range(retries):
+            started = time.perf_counter()
+            try:
+                self.write(batch)
+                with self._stats_lock:
+                    self._stats['batches'] += 1
+                    self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                return
+            except Exception as e:
+                self._count('flush_errors')
+                print(f"Audit flush error: {e}")
+                time.sleep(min(2 ** attempt, 5))
+        self._count('dropped', len(batch))
+        print(f"Потеряно {len(batch)} записей аудита после {retries} попыток")
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._flush_batch(self._drain(first))
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, queue_depth=self._queue.qsize(), queue_size=self._queue.maxsize)
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    """Возвращает фоновый писатель аудита текущего процесса, запуская его при первом обращении"""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                cfg = current_app.config
+                _writer = AuditWriter(
+                    get_pool(),
+                    queue_size=cfg.get('AUDIT_QUEUE_SIZE', 10000),
+                    batch_size=cfg.get('AUDIT_BATCH_SIZE', 500),
+                    flush_interval=cfg.get('AUDIT_FLUSH_INTERVAL', 1.0),
+                )
+                _writer_pid = os.getpid()
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def get_audit_writer_stats():
+    """Статистика очереди аудита (None, если писатель еще не запускался)"""
+    if _writer is None or _writer_pid != os.getpid():
+        return None
+    return _writer.stats()
+
+
+def _audit_row(action_key, payload, user_id, ip=None, user_agent=None):
+    if has_request_context():
+        if ip is None:
+            ip = request.remote_addr
+        if user_agent is None:
+            user_agent = request.user_agent.string or None
+
+    return (
+        user_id,
+        action_key,
+        datetime.now(timezone.utc),
+        ip,
+        user_agent,
+        json.dumps(payload) if payload is not None else None,
+    )
+
+
+def audit_many(action_key, payloads, user_id=None, cur=None):
+    """Записывает несколько действий одного вида одной инструкцией в транзакции
+    вызывающего кода (как audit с sync=True) - для массовых операций"""
+    rows = [_audit_row(action_key, payload, user_id) for payload in payloads]
+    if not rows:
+        return
+    if cur is None:
+        cur = get_db().cursor()
+    _insert_audit_rows(cur, rows, page_size=len(rows))
+
+
+def audit(action_key, payload=None, user_id=None, ip=None, user_agent=None, sync=False, cur=None):
+    """Записывает действие в журнал аудита.
+
+    По умолчанию запись ставится в очередь и сохраняется фоновым потоком.
+    С sync=True запись выполняется сразу через cur (или курсор соединения
+    текущего запроса) - в той же транзакции, что и само действие. Так пишутся
+    финансово значимые действия, которые не должны потеряться.
+    Асинхронные записи нужно ставить уже после commit основной транзакции.
+    """
+    row = _audit_row(action_key, payload, user_id, ip, user_agent)
+
+    if sync:
+        if cur is None:
+            cur = get_db().cursor()
+        # Фиксируется вместе с транзакцией вызывающего кода
+        _insert_audit_rows(cur, [row])
+        return
+
+    writer = get_audit_writer()
+    if current_app.config.get('AUDIT_ASYNC', True) and writer.submit(row):
+        return
+
+    # Фоновая запись отключена или очередь переполнена - пишем сразу, но отдельным
+    # соединением пула, чтобы не зафиксировать заодно транзакцию запроса
+    try:
+        writer.write([row])
+    except Exception as e:
+        print(f"Audit write error: {e}")
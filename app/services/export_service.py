@@ -0,0 +1,267 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from flask import current_app
+from app.utils.database import iter_query
+
+# Выгрузки: имя -> запрос (с местом {conditions} для условий фильтра), заголовки
+# колонок в порядке полей запроса и колонка даты для фильтра по периоду.
+# Все выгрузки ограничены филиалами администратора: первые branch_params
+# параметров запроса - список их идентификаторов.
+EXPORTS = {
+    'tickets': {
+        'title': 'Талоны',
+        'query': '''
+            SELECT pt.ticket_number, u.last_name || ' ' || u.first_name, u.phone,
+                   b.name, i.name, ic.name, pt.admission_date, pt.end_date,
+                   pt.loan_amount, pt.ransom_amount,
+                   CASE
+                       WHEN pt.status = 'issued' AND pt.end_date < CURRENT_DATE THEN 'defaulted'
+                       ELSE pt.status
+                   END,
+                   pt.created_at
+            FROM pawn_tickets pt
+            JOIN users u ON pt.user_id = u.user_id
+            JOIN branches b ON pt.branch_id = b.branch_id
+            JOIN items i ON pt.item_id = i.item_id
+            JOIN item_categories ic ON i.category_id = ic.category_id
+            WHERE pt.branch_id = ANY(%s) {conditions}
+            ORDER BY pt.created_at, pt.ticket_id
+        ''',
+        'columns': ['№ талона', 'Клиент', 'Телефон', 'Филиал', 'Вещь', 'Категория',
+                    'Дата оформления', 'Дата окончания', 'Сумма займа', 'Сумма выкупа',
+                    'Статус', 'Создан'],
+        'date_column': 'pt.created_at',
+    },
+    'requests': {
+        'title': 'Заявки',
+        'query': '''
+            SELECT r.request_number, u.last_name || ' ' || u.first_name, u.email, u.phone,
+                   b.name, ic.name, r.item_name, r.estimated_cost, r.status, r.created_at
+            FROM requests r
+            JOIN users u ON r.user_id = u.user_id
+            JOIN branches b ON r.branch_id = b.branch_id
+            JOIN item_categories ic ON r.category_id = ic.category_id
+            WHERE r.branch_id = ANY(%s) {conditions}
+            ORDER BY r.created_at, r.request_id
+        ''',
+        'columns': ['№ заявки', 'Клиент', 'Email', 'Телефон', 'Филиал', 'Категория',
+                    'Вещь', 'Оценочная стоимость', 'Статус', 'Дата подачи'],
+        'date_column': 'r.created_at',
+    },
+    'payments': {
+        'title': 'Платежи',
+        'query': '''
+            SELECT p.payment_id, pt.ticket_number, b.name, p.payment_type, p.amount,
+                   p.payment_date, a.last_name || ' ' || a.first_name, p.note
+            FROM payments p
+            JOIN pawn_tickets pt ON p.ticket_id = pt.ticket_id
+            JOIN branches b ON pt.branch_id = b.branch_id
+            LEFT JOIN users a ON p.processed_by = a.user_id
+            WHERE pt.branch_id = ANY(%s) {conditions}
+            ORDER BY p.payment_date, p.payment_id
+        ''',
+        'columns': ['№ платежа', '№ талона', 'Филиал', 'Тип', 'Сумма', 'Дата',
+                    'Принял', 'Примечание'],
+        'date_column': 'p.payment_date',
+    },
+    'audit_logs': {
+        'title': 'Журнал аудита',
+        'query': '''
+            SELECT al.log_id, al.action_time, al.action_key, al.user_id,
+                   u.last_name || ' ' || u.first_name, u.email,
+                   al.ip_address::text, al.user_agent, al.payload::text
+            FROM audit_logs al
+            LEFT JOIN users u ON al.user_id = u.user_id
+            -- Действия сотрудников филиалов и клиентов, подававших в них заявки
+            WHERE (EXISTS (SELECT 1 FROM user_branches ub
+                           WHERE ub.user_id = al.user_id AND ub.branch_id = ANY(%s))
+                   OR EXISTS (SELECT 1 FROM requests r
+                              WHERE r.user_id = al.user_id AND r.branch_id = ANY(%s)))
+                  {conditions}
+            ORDER BY al.action_time, al.log_id
+        ''',
+        'columns': ['ID', 'Время', 'Действие', 'ID пользователя', 'Пользователь', 'Email',
+                    'IP', 'User-Agent', 'Данные'],
+        'date_column': 'al.action_time',
+        'branch_params': 2,
+    },
+}
+
+# Значения content_type ответа
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Размер порции, после которой накопленные данные отдаются клиенту
+FLUSH_BYTES = 64 * 1024
+
+
+def iter_export_rows(query, params):
+    """Построчно читает результат серверным курсором (не больше EXPORT_ITERSIZE строк в памяти)"""
+    yield from iter_query(query, params, itersize=current_app.config.get('EXPORT_ITERSIZE', 2000),
+                          row_type='tuple')
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        # JSONB в режиме sqlite приходит разобранным, а не текстом
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _csv_value(value):
+    value = _format_value(value)
+    # Текст, начинающийся с этих символов, Excel считает формулой
+    # (названия и описания вещей вводят клиенты)
+    if isinstance(value, str) and value.startswith(('=', '+', '-', '@', '\t', '\r')):
+        return "'" + value
+    return value
+
+
+def stream_csv(columns, rows):
+    """CSV по мере чтения строк (с BOM, чтобы Excel распознал UTF-8)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=current_app.config.get('EXPORT_CSV_DELIMITER', ';'))
+
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Поток без перемотки для zipfile: копит записанные байты, пока их не заберут"""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def pending(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_workbook(title):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(title[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append('<c/>')
+        elif isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            cells.append(f'<c t="n"><v>{value}</v></c>')
+        else:
+            # Недопустимые в XML управляющие символы отбрасываем
+            text = ''.join(ch for ch in str(_format_value(value)) if ch >= ' ' or ch in '\t\n\r')
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+
+def stream_xlsx(title, columns, rows):
+    """XLSX по мере чтения строк: лист пишется в zip-архив потоком, без сборки в памяти"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _xlsx_workbook(title))
+        yield sink.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(columns).encode('utf-8'))
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                if sink.pending() >= FLUSH_BYTES:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+def build_export_query(name, branch_ids, conditions='', params=()):
+    """Запрос выгрузки с дополнительными условиями (строка ' AND ...') и их параметрами"""
+    export = EXPORTS[name]
+    query = export['query'].replace('{conditions}', conditions)
+    return query, [branch_ids] * export.get('branch_params', 1) + list(params)
+
+
+def stream_export(name, fmt, query, params):
+    """Генератор содержимого выгрузки в формате fmt ('csv' или 'xlsx')"""
+    export = EXPORTS[name]
+    rows = iter_export_rows(query, params)
+    if fmt == 'xlsx':
+        return stream_xlsx(export['title'], export['columns'], rows)
+    return stream_csv(export['columns'], rows)
@@ -0,0 +1,61 @@
+import threading
+import time
+from flask import current_app
+from app.utils.database import query_db
+from app.utils.notifications import subscribe
+
+# Канал, в который триггеры справочников шлют имя измененной таблицы (см. init_db.py)
+REFERENCE_CHANNEL = 'reference_data_changed'
+
+# Справочники: имя -> запрос. Строки отдаются в порядке запроса
+REFERENCE_QUERIES = {
+    'branches': 'SELECT branch_id, name, address, phone FROM branches ORDER BY name',
+    'item_categories': 'SELECT category_id, name, description FROM item_categories ORDER BY name',
+}
+
+_cache_lock = threading.Lock()
+_cache = {}  # имя -> (версия, время загрузки, строки)
+_versions = {name: 0 for name in REFERENCE_QUERIES}  # увеличиваются при изменениях
+_listener_started = False
+
+
+def invalidate_reference_data(name=None):
+    """Помечает справочник (или все справочники) устаревшим"""
+    with _cache_lock:
+        for key in ([name] if name else list(_versions)):
+            if key in _versions:
+                _versions[key] += 1
+
+
+def _start_listener():
+    global _listener_started
+    if _listener_started:
+        return
+    _listener_started = True
+    subscribe(REFERENCE_CHANNEL, invalidate_reference_data)
+
+
+def get_reference_data(name):
+    """Возвращает строки справочника из кэша процесса, перечитывая его при изменениях или по TTL"""
+    _start_listener()
+    ttl = current_app.config.get('REFERENCE_CACHE_TTL', 600)
+
+    with _cache_lock:
+        version = _versions[name]
+        cached = _cache.get(name)
+        if cached and cached[0] == version and time.monotonic() - cached[1] < ttl:
+            return cached[2]
+
+    rows = tuple(dict(row) for row in query_db(REFERENCE_QUERIES[name]))
+
+    with _cache_lock:
+        _cache[name] = (version, time.monotonic(), rows)
+    return rows
+
+
+def get_branches():
+    return get_reference_data('branches')
+
+
+def get_categories():
+    return get_reference_data('item_categories')
@@ -0,0 +1,210 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from psycopg2.extras import execute_values
+from app.utils.database import get_db, is_sqlite
+from app.services.audit_service import audit_many
+from app.services.tariff_service import find_tariff
+from app.services.ticket_service import calculate_loan_amount, calculate_ransom_amount
+
+MIN_LOAN_DAYS = 1
+MAX_LOAN_DAYS = 365
+
+
+def _lock_requests(cur, request_ids):
+    """Читает и блокирует заявки до конца транзакции (в порядке id, чтобы
+    параллельные массовые операции не блокировали друг друга взаимно)"""
+    cur.execute('''
+        SELECT request_id, user_id, branch_id, category_id, item_name, item_description,
+               estimated_cost, status
+        FROM requests
+        WHERE request_id = ANY(%s)
+        ORDER BY request_id
+        FOR UPDATE
+    ''', (list(request_ids),))
+    return {row['request_id']: row for row in cur.fetchall()}
+
+
+def _check_request(request_data, branch_ids):
+    """Причина, по которой заявку нельзя обработать, или None"""
+    if request_data is None:
+        return 'Заявка не найдена'
+    if request_data['branch_id'] not in branch_ids:
+        return 'Нет доступа к заявке'
+    if request_data['status'] != 'submitted':
+        return 'Заявка уже обработана'
+    return None
+
+
+def _insert_items(cur, rows):
+    """Создает вещи и возвращает их id в порядке rows"""
+    if is_sqlite():
+        item_ids = []
+        for row in rows:
+            cur.execute('''
+                INSERT INTO items (owner_user_id, branch_id, category_id, name, description, estimated_cost)
+                VALUES (%s, %s, %s, %s, %s, %s) RETURNING item_id
+            ''', row)
+            item_ids.append(cur.fetchone()['item_id'])
+        return item_ids
+
+    # Порядок строк RETURNING не гарантирован, поэтому id выделяем заранее
+    cur.execute('''
+        SELECT nextval(pg_get_serial_sequence('items', 'item_id')) AS item_id
+        FROM generate_series(1, %s)
+    ''', (len(rows),))
+    item_ids = [row['item_id'] for row in cur.fetchall()]
+    execute_values(cur, '''
+        INSERT INTO items (item_id, owner_user_id, branch_id, category_id, name, description, estimated_cost)
+        OVERRIDING SYSTEM VALUE VALUES %s
+    ''', [(item_id,) + tuple(row) for item_id, row in zip(item_ids, rows)], page_size=len(rows))
+    return item_ids
+
+
+def _insert_tickets(cur, rows):
+    if is_sqlite():
+        cur.executemany('''
+            INSERT INTO pawn_tickets
+            (ticket_number, request_id, user_id, item_id, branch_id, admission_date, end_date,
+             loan_amount, ransom_amount, tariff_id, status, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ''', rows)
+        return
+
+    execute_values(cur, '''
+        INSERT INTO pawn_tickets
+        (ticket_number, request_id, user_id, item_id, branch_id, admission_date, end_date,
+         loan_amount, ransom_amount, tariff_id, status, created_by)
+        VALUES %s
+    ''', rows, page_size=len(rows))
+
+
+def _failed(request_ids, error):
+    return {request_id: {'ok': False, 'error': error} for request_id in request_ids}
+
+
+def approve_requests(loan_terms, admin_id, branch_ids):
+    """Одобряет заявки одной транзакцией.
+
+    loan_terms - {request_id: срок займа в днях}. Тарифы подбираются по индексу
+    в памяти, а вещи, талоны, статусы заявок и записи аудита создаются
+    несколькими множественными инструкциями независимо от числа заявок.
+    Заявки, которые одобрить нельзя, пропускаются с указанием причины.
+    Возвращает {request_id: {'ok': True, 'ticket_number', 'loan_amount', 'ransom_amount'}
+    или {'ok': False, 'error'}}.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    results = {}
+    approved = []
+
+    try:
+        requests = _lock_requests(cur, loan_terms)
+        admission_date = datetime.now().date()
+
+        for request_id, loan_days in sorted(loan_terms.items()):
+            request_data = requests.get(request_id)
+            error = _check_request(request_data, branch_ids)
+            if error is None and not MIN_LOAN_DAYS <= loan_days <= MAX_LOAN_DAYS:
+                error = f'Срок займа должен быть от {MIN_LOAN_DAYS} до {MAX_LOAN_DAYS} дней'
+
+            tariff = None
+            if error is None:
+                tariff = find_tariff(request_data['category_id'], request_data['branch_id'],
+                                     request_data['estimated_cost'])
+                if not tariff:
+                    error = 'Не найден подходящий тариф'
+
+            if error:
+                results[request_id] = {'ok': False, 'error': error}
+                continue
+
+            loan_amount = calculate_loan_amount(Decimal(str(request_data['estimated_cost'])), tariff)
+            ransom_amount = calculate_ransom_amount(loan_amount, tariff['interest_rate'], loan_days)
+            approved.append({
+                'request': request_data,
+                'tariff_id': tariff['tariff_id'],
+                'loan_days': loan_days,
+                'ticket_number': f"TKT-{datetime.now().strftime('%Y%m%d')}-{request_id}",
+                'loan_amount': float(loan_amount),
+                'ransom_amount': float(ransom_amount),
+            })
+
+        if approved:
+            item_ids = _insert_items(cur, [
+                (r['user_id'], r['branch_id'], r['category_id'], r['item_name'],
+                 r['item_description'], r['estimated_cost'])
+                for r in (a['request'] for a in approved)
+            ])
+
+            _insert_tickets(cur, [
+                (a['ticket_number'], a['request']['request_id'], a['request']['user_id'], item_id,
+                 a['request']['branch_id'], admission_date, admission_date + timedelta(days=a['loan_days']),
+                 a['loan_amount'], a['ransom_amount'], a['tariff_id'], 'issued', admin_id)
+                for a, item_id in zip(approved, item_ids)
+            ])
+
+            cur.execute("UPDATE requests SET status = 'approved' WHERE request_id = ANY(%s)",
+                        ([a['request']['request_id'] for a in approved],))
+
+            # Выдача займов - аудит в той же транзакции
+            audit_many('approve_request', [{
+                'request_id': a['request']['request_id'],
+                'ticket_number': a['ticket_number'],
+                'loan_amount': a['loan_amount'],
+                'ransom_amount': a['ransom_amount'],
+                'loan_days': a['loan_days'],
+                'bulk': True,
+            } for a in approved], user_id=admin_id, cur=cur)
+
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при массовом одобрении заявок: {str(e)}")
+        # Транзакция отменена целиком - не одобрена ни одна заявка
+        return _failed(sorted(loan_terms), f'Ошибка при обработке заявок: {str(e)}')
+    finally:
+        cur.close()
+
+    for a in approved:
+        results[a['request']['request_id']] = {
+            'ok': True,
+            'ticket_number': a['ticket_number'],
+            'loan_amount': a['loan_amount'],
+            'ransom_amount': a['ransom_amount'],
+        }
+    return dict(sorted(results.items()))
+
+
+def reject_requests(request_ids, admin_id, branch_ids):
+    """Отклоняет заявки одной транзакцией; результат - как у approve_requests"""
+    conn = get_db()
+    cur = conn.cursor()
+    results = {}
+    rejected = []
+
+    try:
+        requests = _lock_requests(cur, request_ids)
+        for request_id in sorted(request_ids):
+            error = _check_request(requests.get(request_id), branch_ids)
+            if error:
+                results[request_id] = {'ok': False, 'error': error}
+            else:
+                rejected.append(request_id)
+
+        if rejected:
+            cur.execute("UPDATE requests SET status = 'rejected' WHERE request_id = ANY(%s)", (rejected,))
+            audit_many('reject_request', [{'request_id': request_id, 'bulk': True} for request_id in rejected],
+                       user_id=admin_id, cur=cur)
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при массовом отклонении заявок: {str(e)}")
+        return _failed(sorted(request_ids), f'Ошибка при отклонении заявок: {str(e)}')
+    finally:
+        cur.close()
+
+    for request_id in rejected:
+        results[request_id] = {'ok': True}
+    return dict(sorted(results.items()))
@@ -1,4 +1,84 @@
+import threading
+import time
+from datetime import date
+from flask import current_app
 from app.utils.database import query_db
+from app.utils.notifications import subscribe
+
+# Канал, в который триггер на таблице tariffs шлет уведомления (см. init_db.py)
+TARIFFS_CHANNEL = 'tariffs_changed'
+
+# Порядок приоритета ключей индекса: категория+филиал -> категория -> филиал -> общий
+_PRIORITY = (
+    lambda c, b: (c, b),
+    lambda c, b: (c, None),
+    lambda c, b: (None, b),
+    lambda c, b: (None, None),
+)
+
+_index_lock = threading.Lock()
+_index = None  # {(category_id, branch_id): [тарифы по effective_from DESC]}
+_index_version = -1
+_index_loaded_at = 0.0
+_version = 0  # увеличивается при каждом изменении тарифов
+_listener_started = False
+
+
+def invalidate_tariff_index():
+    """Помечает индекс тарифов устаревшим (перечитается при следующем поиске)"""
+    global _version
+    with _index_lock:
+        _version += 1
+
+
+def _start_listener():
+    global _listener_started
+    if _listener_started:
+        return
+    _listener_started = True
+    subscribe(TARIFFS_CHANNEL, lambda payload: invalidate_tariff_index())
+
+
+def _build_index(tariffs):
+    index = {}
+    for tariff in tariffs:
+        index.setdefault((tariff['category_id'], tariff['branch_id']), []).append(dict(tariff))
+    for bucket in index.values():
+        bucket.sort(key=lambda t: t['effective_from'], reverse=True)
+    return index
+
+
+def get_tariff_index():
+    """Возвращает индекс активных тарифов, перечитывая его при изменениях или по TTL"""
+    global _index, _index_version, _index_loaded_at
+
+    _start_listener()
+    ttl = current_app.config.get('TARIFF_CACHE_TTL', 300)
+
+    with _index_lock:
+        version = _version
+        if (_index is not None and _index_version == version
+                and time.monotonic() - _index_loaded_at < ttl):
+            return _index
+
+    tariffs = query_db('SELECT * FROM tariffs WHERE is_active = true')
+    index = _build_index(tariffs)
+
+    with _index_lock:
+        _index = index
+        _index_version = version
+        _index_loaded_at = time.monotonic()
+    return index
+
+
+def _is_effective(tariff, today):
+    return tariff['effective_from'] <= today and \
+        (tariff['effective_to'] is None or tariff['effective_to'] >= today)
+
+
+def _fits_amount(tariff, estimated_cost):
+    return (tariff['min_loan'] is None or tariff['min_loan'] <= estimated_cost) and \
+        (tariff['max_loan'] is None or tariff['max_loan'] >= estimated_cost)
 
 
 def find_tariff(category_id, branch_id, estimated_cost):
@@ -10,48 +90,26 @@ def find_tariff(category_id, branch_id, estimated_cost):
     4. Общий тариф
     """
     try:
+        index = get_tariff_index()
+        today = date.today()
+
         # Сначала ищем наиболее специфичный тариф
-        tariffs = query_db('''
-            SELECT * FROM tariffs 
-            WHERE is_active = true
-              AND effective_from <= CURRENT_DATE
-              AND (effective_to IS NULL OR effective_to >= CURRENT_DATE)
-              AND (category_id = %s OR category_id IS NULL)
-              AND (branch_id = %s OR branch_id IS NULL)
-              AND (min_loan IS NULL OR min_loan <= %s)
-              AND (max_loan IS NULL OR max_loan >= %s)
-            ORDER BY 
-              CASE 
-                WHEN category_id IS NOT NULL AND branch_id IS NOT NULL THEN 1
-                WHEN category_id IS NOT NULL AND branch_id IS NULL THEN 2
-                WHEN category_id IS NULL AND branch_id IS NOT NULL THEN 3
-                ELSE 4
-              END,
-              effective_from DESC
-            LIMIT 1
-        ''', (category_id, branch_id, estimated_cost, estimated_cost))
-
-        if tariffs:
-            return tariffs[0]
-
-        # Если не нашли, пробуем найти любой активный тариф без проверки суммы
-        fallback_tariff = query_db('''
-            SELECT * FROM tariffs 
-            WHERE is_active = true
-              AND effective_from <= CURRENT_DATE
-              AND (effective_to IS NULL OR effective_to >= CURRENT_DATE)
-            ORDER BY 
-              CASE 
-                WHEN category_id IS NOT NULL AND branch_id IS NOT NULL THEN 1
-                WHEN category_id IS NOT NULL AND branch_id IS NULL THEN 2
-                WHEN category_id IS NULL AND branch_id IS NOT NULL THEN 3
-                ELSE 4
-              END
-            LIMIT 1
-        ''', one=True)
-
-        return fallback_tariff
+        for key in _PRIORITY:
+            for tariff in index.get(key(category_id, branch_id), ()):
+                if _is_effective(tariff, today) and _fits_amount(tariff, estimated_cost):
+                    return dict(tariff)
+
+        # Если не нашли, берем любой действующий тариф без проверки суммы
+        fallback = [
+            t for bucket in index.values() for t in bucket if _is_effective(t, today)
+        ]
+        if not fallback:
+            return None
+
+        fallback.sort(key=lambda t: t['effective_from'], reverse=True)
+        fallback.sort(key=lambda t: (t['category_id'] is None, t['branch_id'] is None))
+        return dict(fallback[0])
 
     except Exception as e:
         print(f"Error in find_tariff: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -1,50 +1,178 @@
-from app.utils.database import get_db, query_db
+import json
+import threading
+import time
+from flask import current_app
+from app.utils.database import get_db, is_sqlite, query_db
 from datetime import datetime, date
 from decimal import Decimal
 
 
-def update_expired_tickets():
-    """Обновляет статус талонов, у которых истек срок"""
+def _expire_batch(cur, batch_size):
+    """Переводит пачку просроченных талонов в 'defaulted' с записью аудита; возвращает их число"""
+    if is_sqlite():
+        # В SQLite нет изменяющих CTE: UPDATE ... RETURNING и аудит отдельной вставкой
+        cur.execute('''
+            UPDATE pawn_tickets
+            SET status = 'defaulted', updated_at = NOW()
+            WHERE ticket_id IN (
+                SELECT ticket_id FROM pawn_tickets
+                WHERE status = 'issued' AND end_date < CURRENT_DATE
+                ORDER BY ticket_id
+                LIMIT %s
+            )
+            RETURNING ticket_id, ticket_number
+        ''', (batch_size,))
+        updated = cur.fetchall()
+        cur.executemany('''
+            INSERT INTO audit_logs (action_key, payload) VALUES ('ticket_expired_auto', %s)
+        ''', [(json.dumps({'ticket_id': t['ticket_id'], 'ticket_number': t['ticket_number']}),)
+              for t in updated])
+        return len(updated)
+
+    # Переводим пачку просроченных талонов в 'defaulted' и сразу
+    # пишем по строке аудита на каждый из них
+    cur.execute('''
+        WITH expired AS (
+            SELECT ticket_id FROM pawn_tickets
+            WHERE status = 'issued' AND end_date < CURRENT_DATE
+            ORDER BY ticket_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), updated AS (
+            UPDATE pawn_tickets pt
+            SET status = 'defaulted', updated_at = NOW()
+            FROM expired e
+            WHERE pt.ticket_id = e.ticket_id
+            RETURNING pt.ticket_id, pt.ticket_number
+        )
+        INSERT INTO audit_logs (action_key, payload)
+        SELECT 'ticket_expired_auto',
+               jsonb_build_object('ticket_id', ticket_id, 'ticket_number', ticket_number)
+        FROM updated
+    ''', (batch_size,))
+    return cur.rowcount
+
+
+def update_expired_tickets(batch_size=None):
+    """Обновляет статус талонов, у которых истек срок.
+
+    Талоны обрабатываются пачками по batch_size (EXPIRY_SWEEP_BATCH_SIZE),
+    каждая пачка - одна инструкция (UPDATE + INSERT в audit_logs) и отдельная
+    транзакция, чтобы не держать блокировки строк на все время обхода.
+    """
+    if batch_size is None:
+        batch_size = current_app.config.get('EXPIRY_SWEEP_BATCH_SIZE', 1000)
+
     conn = get_db()
     cur = conn.cursor()
+    total = 0
+    batch_no = 0
 
     try:
-        # Находим талоны с истекшим сроком и статусом 'issued'
-        cur.execute('''
-            UPDATE pawn_tickets 
-            SET status = 'defaulted', updated_at = NOW()
-            WHERE status = 'issued' AND end_date < CURRENT_DATE
-            RETURNING ticket_id, ticket_number
-        ''')
+        while True:
+            batch_no += 1
+            started = time.perf_counter()
 
-        updated_tickets = cur.fetchall()
+            count = _expire_batch(cur, batch_size)
+            conn.commit()
+            total += count
 
-        # Логируем действие для каждого просроченного талона
-        import json
-        for ticket in updated_tickets:
-            cur.execute('''
-                INSERT INTO audit_logs (action_key, payload)
-                VALUES (%s, %s)
-            ''', (
-                'ticket_expired_auto',
-                json.dumps({
-                    'ticket_id': ticket['ticket_id'],
-                    'ticket_number': ticket['ticket_number']
-                })
-            ))
+            if count:
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"Просроченные талоны: пачка {batch_no} - {count} шт. за {elapsed:.1f} мс")
 
-        conn.commit()
+            if count < batch_size:
+                break
 
-        if updated_tickets:
-            print(f"Автоматически обновлено {len(updated_tickets)} просроченных талонов")
+        if total:
+            print(f"Автоматически обновлено {total} просроченных талонов")
 
-        return len(updated_tickets)
+        return total
 
     except Exception as e:
         conn.rollback()
         print(f"Ошибка при обновлении просроченных талонов: {str(e)}")
+        return total
+
+
+# Ключ advisory-блокировки, под которой выполняется обход просроченных талонов
+EXPIRY_SWEEP_LOCK_KEY = 74100001
+EXPIRY_SWEEP_TASK = 'expiry_sweep'
+
+_sweep_lock = threading.Lock()
+_last_sweep_at = None
+
+
+def sweep_expired_tickets_if_due(force=False):
+    """Запускает update_expired_tickets не чаще раза в EXPIRY_SWEEP_INTERVAL секунд.
+
+    В пределах процесса интервал отслеживается в памяти, между процессами -
+    через advisory-блокировку и отметку о последнем запуске в maintenance_runs.
+    Страницы при этом сами определяют просрочку по end_date (см. is_expired
+    в запросах), так что пропущенный обход не влияет на отображение.
+    Возвращает количество переведенных в 'defaulted' талонов.
+    """
+    global _last_sweep_at
+
+    interval = current_app.config.get('EXPIRY_SWEEP_INTERVAL', 300)
+
+    def is_due():
+        return force or _last_sweep_at is None or time.monotonic() - _last_sweep_at >= interval
+
+    if not is_due() or not _sweep_lock.acquire(blocking=False):
+        return 0
+
+    conn = get_db()
+    cur = conn.cursor()
+    locked = False
+
+    try:
+        if not is_due():
+            return 0
+        _last_sweep_at = time.monotonic()
+
+        cur.execute('SELECT pg_try_advisory_lock(%s) AS locked', (EXPIRY_SWEEP_LOCK_KEY,))
+        locked = cur.fetchone()['locked']
+        if not locked:
+            # Обход уже выполняет другой процесс
+            conn.rollback()
+            return 0
+
+        if not force:
+            cur.execute('''
+                SELECT last_run_at > NOW() - %s * INTERVAL '1 second' AS fresh
+                FROM maintenance_runs WHERE task_key = %s
+            ''', (interval, EXPIRY_SWEEP_TASK))
+            row = cur.fetchone()
+            conn.rollback()
+            if row and row['fresh']:
+                return 0
+
+        count = update_expired_tickets()
+
+        cur.execute('''
+            INSERT INTO maintenance_runs (task_key, last_run_at) VALUES (%s, NOW())
+            ON CONFLICT (task_key) DO UPDATE SET last_run_at = EXCLUDED.last_run_at
+        ''', (EXPIRY_SWEEP_TASK,))
+        conn.commit()
+
+        return count
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при плановом обходе просроченных талонов: {str(e)}")
         return 0
 
+    finally:
+        if locked:
+            try:
+                cur.execute('SELECT pg_advisory_unlock(%s)', (EXPIRY_SWEEP_LOCK_KEY,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+        cur.close()
+        _sweep_lock.release()
+
 
 def calculate_loan_amount(estimated_cost, tariff):
     """Рассчитывает сумму займа на основе тарифа"""
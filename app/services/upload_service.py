@@ -0,0 +1,388 @@
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from app.utils.database import get_db
+from app.utils.file_utils import file_sha256, store_file
+from app.utils.image_utils import generate_derivatives
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow файлы сохраняются как есть
+    Image = None
+
+# Допустимые форматы изображений: расширение -> формат Pillow
+IMAGE_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'gif': 'GIF',
+}
+
+EXIF_ORIENTATION = 0x0112
+
+# Захват заданий: новые, ожидающие повтора (после паузы) и зависшие (процесс упал
+# во время обработки), пока не исчерпаны попытки
+CLAIM_JOBS = '''
+    UPDATE upload_jobs
+    SET status = 'processing', attempts = attempts + 1, started_at = now()
+    WHERE job_id IN (
+        SELECT job_id FROM upload_jobs
+        WHERE attempts < %s
+          AND ((status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= now()))
+               OR (status = 'processing' AND started_at < now() - make_interval(secs => %s)))
+        ORDER BY job_id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+'''
+
+# Зависшие задания, исчерпавшие попытки (например, файл каждый раз роняет процесс)
+FAIL_STALE_JOBS = '''
+    UPDATE upload_jobs
+    SET status = 'failed', finished_at = now(),
+        last_error = COALESCE(last_error, 'Обработка прервана, попытки исчерпаны')
+    WHERE status = 'processing' AND attempts >= %s
+      AND started_at < now() - make_interval(secs => %s)
+    RETURNING staged_name
+'''
+
+# Ближайшие моменты, когда в журнале появится работа: повтор после паузы
+# и истечение срока обработки (задание станет зависшим)
+NEXT_JOB_TIMES = '''
+    SELECT MIN(CASE WHEN status = 'pending' THEN next_attempt_at END) AS retry_at,
+           MIN(CASE WHEN status = 'processing' THEN started_at END) AS started_at
+    FROM upload_jobs
+    WHERE (status = 'pending' AND attempts < %s) OR status = 'processing'
+'''
+
+
+class UploadRejected(Exception):
+    """Файл не прошел проверку и не будет обработан повторно"""
+
+
+def enqueue_upload_jobs(cur, request_id, user_id, staged_files, subfolder='requests'):
+    """Ставит обработку загруженных файлов в журнал заданий (в транзакции заявки)"""
+    for staged in staged_files:
+        cur.execute('''
+            INSERT INTO upload_jobs
+            (request_id, uploaded_by, subfolder, staged_name, file_name, mime_type, file_size)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', (
+            request_id,
+            user_id,
+            subfolder,
+            staged['staged_name'],
+            staged['file_name'],
+            staged['mime_type'],
+            staged['file_size']
+        ))
+
+
+def _scan(path):
+    """Проверка внешним антивирусом (UPLOAD_SCAN_COMMAND, например 'clamdscan --no-summary')"""
+    command = current_app.config.get('UPLOAD_SCAN_COMMAND')
+    if not command:
+        return
+
+    result = subprocess.run(shlex.split(command) + [path], capture_output=True, text=True, timeout=120)
+    if result.returncode == 1:
+        raise UploadRejected(f"Антивирус: {result.stdout.strip() or 'угроза обнаружена'}")
+    if result.returncode != 0:
+        raise RuntimeError(f"Ошибка антивируса ({result.returncode}): {result.stderr.strip()}")
+
+
+def _validate_image(path, file_ext):
+    """Проверяет, что файл действительно изображение заявленного формата"""
+    if Image is None:
+        return
+
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            image.verify()
+    except Exception as e:
+        raise UploadRejected(f"Файл не является изображением: {e}")
+
+    if image_format != IMAGE_FORMATS.get(file_ext):
+        raise UploadRejected(f"Формат {image_format} не соответствует расширению .{file_ext}")
+
+
+def _strip_metadata(path, folder):
+    """Сохраняет копию изображения без EXIF (геометка, модель камеры и т.п.).
+
+    Ориентация из EXIF применяется к пикселям, иначе фото повернется.
+    Возвращает путь к временному файлу или исходный путь, если очищать нечего.
+    """
+    if Image is None:
+        return path
+
+    with Image.open(path) as image:
+        image_format = image.format
+        # GIF не содержит EXIF, а пересохранение потеряло бы анимацию
+        if image_format == 'GIF':
+            return path
+
+        options = {}
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+
+        if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+            if image_format == 'JPEG':
+                options['quality'] = 95
+        elif image_format == 'JPEG':
+            # Без повторного сжатия с потерей качества
+            options['quality'] = 'keep'
+            options['subsampling'] = 'keep'
+
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.clean')
+        os.close(fd)
+        try:
+            image.save(tmp_path, image_format, **options)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    return tmp_path
+
+
+def _link_copy(path, folder):
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.link')
+    os.close(fd)
+    os.remove(tmp_path)
+    try:
+        os.link(path, tmp_path)
+    except OSError:
+        shutil.copyfile(path, tmp_path)
+    return tmp_path
+
+
+def _process_job(cur, job):
+    """Проверяет файл, очищает метаданные, сохраняет его и создает вложение"""
+    staging_dir = current_app.config['UPLOAD_STAGING_DIR']
+    staged_path = os.path.join(staging_dir, job['staged_name'])
+    file_ext = job['staged_name'].rsplit('.', 1)[1]
+
+    if not os.path.exists(staged_path):
+        raise UploadRejected('Временный файл не найден')
+
+    _scan(staged_path)
+    _validate_image(staged_path, file_ext)
+
+    prepared_path = _strip_metadata(staged_path, staging_dir)
+    digest = file_sha256(prepared_path)
+    file_size = os.path.getsize(prepared_path)
+    if prepared_path == staged_path:
+        # Исходник нужен до фиксации транзакции (для повтора задания),
+        # поэтому в хранилище переносится его жесткая ссылка
+        prepared_path = _link_copy(staged_path, staging_dir)
+    # store_file сразу фиксирует отметку файла - записей задания в транзакции еще нет
+    relative_path, _ = store_file(prepared_path, digest, file_ext, job['subfolder'])
+
+    generate_derivatives(relative_path)
+
+    cur.execute('''
+        INSERT INTO attachments
+        (request_id, file_path, file_name, mime_type, content_hash, file_size, uploaded_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING attachment_id
+    ''', (
+        job['request_id'],
+        relative_path,
+        job['file_name'],
+        job['mime_type'],
+        digest,
+        file_size,
+        job['uploaded_by']
+    ))
+    attachment_id = cur.fetchone()['attachment_id']
+
+    cur.execute('''
+        UPDATE upload_jobs
+        SET status = 'done', attachment_id = %s, finished_at = now(), last_error = NULL
+        WHERE job_id = %s
+    ''', (attachment_id, job['job_id']))
+
+
+def process_pending_upload_jobs(limit=None):
+    """Обрабатывает очередную порцию заданий из журнала upload_jobs.
+
+    Каждое задание выполняется в своей транзакции. Временные ошибки
+    возвращают задание в очередь с паузой UPLOAD_JOB_RETRY_DELAY, удваивающейся
+    с каждой попыткой (до UPLOAD_JOB_MAX_ATTEMPTS попыток), отклоненные файлы
+    помечаются 'rejected' и удаляются.
+    Возвращает число обработанных заданий.
+    """
+    cfg = current_app.config
+    if limit is None:
+        limit = cfg.get('UPLOAD_JOB_BATCH', 20)
+    max_attempts = cfg.get('UPLOAD_JOB_MAX_ATTEMPTS', 3)
+    retry_delay = cfg.get('UPLOAD_JOB_RETRY_DELAY', 60)
+    stale_after = cfg.get('UPLOAD_JOB_STALE_AFTER', 600)
+
+    conn = get_db()
+    cur = conn.cursor()
+    processed = 0
+
+    try:
+        cur.execute(FAIL_STALE_JOBS, (max_attempts, stale_after))
+        abandoned = cur.fetchall()
+        cur.execute(CLAIM_JOBS, (max_attempts, stale_after, limit))
+        jobs = cur.fetchall()
+        conn.commit()
+
+        for job in abandoned:
+            _count('failed')
+            staged_path = os.path.join(cfg['UPLOAD_STAGING_DIR'], job['staged_name'])
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+
+        for job in jobs:
+            staged_path = os.path.join(cfg['UPLOAD_STAGING_DIR'], job['staged_name'])
+            try:
+                _process_job(cur, job)
+                conn.commit()
+                os.remove(staged_path)
+                processed += 1
+                _count('done')
+            except Exception as e:
+                conn.rollback()
+                rejected = isinstance(e, UploadRejected)
+                final = rejected or job['attempts'] >= max_attempts
+                next_attempt_at = None if final else (
+                    datetime.now(timezone.utc) + timedelta(seconds=retry_delay * 2 ** (job['attempts'] - 1))
+                )
+                cur.execute('''
+                    UPDATE upload_jobs
+                    SET status = %s, last_error = %s, finished_at = CASE WHEN %s THEN now() END,
+                        next_attempt_at = %s
+                    WHERE job_id = %s
+                ''', ('rejected' if rejected else 'failed' if final else 'pending',
+                      str(e), final, next_attempt_at, job['job_id']))
+                conn.commit()
+                _count('rejected' if rejected else 'failed' if final else 'retried')
+                print(f"Ошибка обработки загрузки {job['job_id']} ({job['file_name']}): {e}")
+                if final and os.path.exists(staged_path):
+                    os.remove(staged_path)
+
+        return processed
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при обработке заданий загрузки: {str(e)}")
+        return processed
+    finally:
+        cur.close()
+
+
+_stats = {'done': 0, 'retried': 0, 'failed': 0, 'rejected': 0, 'batches': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _seconds_until(moment):
+    # Встроенная база хранит время в UTC без часового пояса
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - datetime.now(timezone.utc)).total_seconds()
+
+
+def next_upload_job_delay():
+    """Через сколько секунд в журнале появится задание для обработки (None - не появится)"""
+    cfg = current_app.config
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute(NEXT_JOB_TIMES, (cfg.get('UPLOAD_JOB_MAX_ATTEMPTS', 3),))
+        row = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+
+    delays = []
+    if row['retry_at'] is not None:
+        delays.append(_seconds_until(row['retry_at']))
+    if row['started_at'] is not None:
+        delays.append(_seconds_until(row['started_at']) + cfg.get('UPLOAD_JOB_STALE_AFTER', 600))
+    # Не чаще раза в секунду: CURRENT_TIMESTAMP встроенной базы точен до секунды,
+    # и только что наступивший повтор может еще не захватиться
+    return max(1, min(delays)) if delays else None
+
+
+class UploadProcessor:
+    """Пул потоков, обрабатывающий журнал заданий загрузки вне HTTP-запросов.
+
+    Разобрав журнал, обработчик сам просыпается к ближайшему повтору
+    (next_attempt_at) или к моменту, когда задание станет зависшим.
+    """
+
+    def __init__(self, app, workers=2):
+        self.app = app
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-jobs')
+        self._timer = None
+        self._timer_lock = threading.Lock()
+
+    def kick(self):
+        """Запускает обработку накопившихся заданий в фоне"""
+        self._executor.submit(self._run)
+
+    def _wake_after(self, delay):
+        """Переставляет будильник на delay секунд (None - отменяет)"""
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if delay is not None:
+                self._timer = threading.Timer(delay, self.kick)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self.app.app_context():
+            with _stats_lock:
+                _stats['batches'] += 1
+            # Дорабатываем, пока в журнале есть задания
+            while process_pending_upload_jobs():
+                pass
+
+            try:
+                delay = next_upload_job_delay()
+            except Exception as e:
+                print(f"Ошибка при планировании заданий загрузки: {str(e)}")
+                delay = self.app.config.get('UPLOAD_JOB_RETRY_DELAY', 60)
+            self._wake_after(delay)
+
+
+_processor = None
+_processor_pid = None
+_processor_lock = threading.Lock()
+
+
+def get_upload_processor(app=None):
+    """Возвращает обработчик загрузок текущего процесса, запуская его при первом обращении"""
+    global _processor, _processor_pid
+    if _processor is None or _processor_pid != os.getpid():
+        with _processor_lock:
+            if _processor is None or _processor_pid != os.getpid():
+                app = app or current_app._get_current_object()
+                _processor = UploadProcessor(app, workers=app.config.get('UPLOAD_WORKERS', 2))
+                _processor_pid = os.getpid()
+                # Задания, оставшиеся после перезапуска
+                _processor.kick()
+    return _processor
+
+
+def get_upload_job_stats():
+    """Счетчики обработчика загрузок текущего процесса"""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,142 @@
+import gzip
+import os
+import re
+from datetime import date
+from flask import current_app
+from app.utils.database import get_db, is_sqlite
+
+PARTITION_NAME = re.compile(r'^audit_logs_(\d{4})(\d{2})$')
+
+
+def _add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _is_partitioned(cur):
+    # Во встроенной базе журнал аудита - обычная таблица
+    if is_sqlite():
+        return False
+    cur.execute('''
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'audit_logs'::regclass
+        ) AS partitioned
+    ''')
+    return cur.fetchone()['partitioned']
+
+
+def ensure_audit_partitions(months_ahead=None):
+    """Создает секции audit_logs на текущий и следующие months_ahead месяцев"""
+    if months_ahead is None:
+        months_ahead = current_app.config.get('AUDIT_PARTITION_MONTHS_AHEAD', 3)
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        if not _is_partitioned(cur):
+            conn.rollback()
+            return []
+
+        first_month = date.today().replace(day=1)
+        created = []
+        for month in range(months_ahead + 1):
+            cur.execute('SELECT lombard_create_audit_partition(%s) AS name',
+                        (_add_months(first_month, month),))
+            created.append(cur.fetchone()['name'])
+        conn.commit()
+
+        return created
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при создании секций audit_logs: {str(e)}")
+        return []
+    finally:
+        cur.close()
+
+
+def archive_old_audit_partitions(retention_months=None, archive_dir=None):
+    """Отсоединяет секции audit_logs старше срока хранения и архивирует их.
+
+    Каждая секция выгружается в CSV, сжатый gzip (<archive_dir>/audit_logs_YYYYMM.csv.gz),
+    после чего удаляется. Отсоединенные, но не заархивированные ранее секции
+    (например, после сбоя) подбираются при следующем запуске. Старые строки из
+    секции по умолчанию сначала переносятся в помесячные секции и архивируются с ними.
+    """
+    cfg = current_app.config
+    if retention_months is None:
+        retention_months = cfg.get('AUDIT_RETENTION_MONTHS', 24)
+    if archive_dir is None:
+        archive_dir = cfg['AUDIT_ARCHIVE_DIR']
+
+    conn = get_db()
+    cur = conn.cursor()
+    archived = []
+
+    try:
+        if not _is_partitioned(cur):
+            conn.rollback()
+            return archived
+
+        cutoff = _add_months(date.today().replace(day=1), -retention_months)
+
+        # Месяцы без своей секции (например, до включения секционирования) лежат
+        # в секции по умолчанию - выделяем их, чтобы заархивировать ниже
+        cur.execute('''
+            SELECT DISTINCT date_trunc('month', action_time)::date AS month
+            FROM audit_logs_default
+            WHERE action_time < %s
+        ''', (cutoff,))
+        for row in cur.fetchall():
+            cur.execute('SELECT lombard_create_audit_partition(%s)', (row['month'],))
+            conn.commit()
+
+        # Все помесячные секции схемы, включая уже отсоединенные
+        cur.execute('''
+            SELECT c.relname,
+                   EXISTS (
+                       SELECT 1 FROM pg_inherits i
+                       WHERE i.inhrelid = c.oid AND i.inhparent = 'audit_logs'::regclass
+                   ) AS attached
+            FROM pg_class c
+            WHERE c.relkind = 'r'
+              AND c.relnamespace = current_schema()::regnamespace
+              AND c.relname ~ '^audit_logs_[0-9]{6}$'
+            ORDER BY c.relname
+        ''')
+        partitions = cur.fetchall()
+        conn.commit()
+
+        os.makedirs(archive_dir, exist_ok=True)
+
+        for partition in partitions:
+            name = partition['relname']
+            match = PARTITION_NAME.match(name)
+            if not match or date(int(match.group(1)), int(match.group(2)), 1) >= cutoff:
+                continue
+
+            if partition['attached']:
+                cur.execute(f'ALTER TABLE audit_logs DETACH PARTITION {name}')
+                conn.commit()
+
+            # Пишем во временный файл, чтобы не оставить обрезанный архив
+            path = os.path.join(archive_dir, f'{name}.csv.gz')
+            with gzip.open(path + '.tmp', 'wb') as archive:
+                cur.copy_expert(f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+            os.replace(path + '.tmp', path)
+
+            cur.execute(f'DROP TABLE {name}')
+            conn.commit()
+
+            archived.append(path)
+            print(f"Секция {name} заархивирована в {path}")
+
+        return archived
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при архивировании секций audit_logs: {str(e)}")
+        return archived
+    finally:
+        cur.close()
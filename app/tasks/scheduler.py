@@ -1,16 +1,41 @@
 import schedule
 import time
-from app.services.ticket_service import update_expired_tickets
-from app.utils.database import get_db
+from app.services.ticket_service import sweep_expired_tickets_if_due
+from app.tasks.audit_partitions import ensure_audit_partitions, archive_old_audit_partitions
+from app.utils.file_utils import purge_unreferenced_files
+from app.services.upload_service import process_pending_upload_jobs
 
 
-def run_scheduler():
+def _in_app_context(app, job):
+    """Оборачивает задачу, чтобы она выполнялась в контексте приложения"""
+    def wrapper():
+        with app.app_context():
+            return job()
+    return wrapper
+
+
+def run_scheduler(app):
     """Запускает планировщик для автоматических задач"""
     # Ежедневная проверка просроченных талонов в 00:01
-    schedule.every().day.at("00:01").do(update_expired_tickets)
+    schedule.every().day.at("00:01").do(
+        _in_app_context(app, lambda: sweep_expired_tickets_if_due(force=True))
+    )
+
+    # Секции audit_logs: создание будущих и архивирование старых
+    schedule.every().day.at("00:05").do(_in_app_context(app, ensure_audit_partitions))
+    schedule.every().day.at("03:00").do(_in_app_context(app, archive_old_audit_partitions))
+
+    # Файлы вложений, на которые не осталось ссылок
+    schedule.every().day.at("04:00").do(_in_app_context(app, purge_unreferenced_files))
+
+    # Подбираем задания загрузки, брошенные упавшими процессами
+    schedule.every(5).minutes.do(_in_app_context(app, process_pending_upload_jobs))
+
+    # Секции нужны сразу, не дожидаясь ночи
+    _in_app_context(app, ensure_audit_partitions)()
 
     print("Планировщик запущен...")
 
     while True:
         schedule.run_pending()
-        time.sleep(60)
\ No newline at end of file
+        time.sleep(60)
@@ -1,6 +1,34 @@
 import hashlib
-from flask import session
+import threading
+import time
+from flask import session, current_app, g, has_app_context
 from app.utils.database import query_db
+from app.utils.notifications import subscribe
+
+# Канал уведомлений об изменении привязок администраторов к филиалам (см. init_db.py)
+USER_BRANCHES_CHANNEL = 'user_branches_changed'
+
+# Канал уведомлений об изменении пользователей; payload - user_id (см. init_db.py)
+USERS_CHANNEL = 'users_changed'
+
+# Поля пользователя, которые держит кэш (без хэша пароля)
+CURRENT_USER_FIELDS = 'user_id, email, first_name, last_name, phone, role_id, is_active'
+
+# Кэш пользователей: user_id -> (версия, время загрузки, запись)
+_users_lock = threading.Lock()
+_users = {}
+# Версии кэша пользователей, как у кэша филиалов ниже
+_users_generation = 0
+_users_versions = {}
+_users_subscribed = False
+
+# Кэш филиалов администраторов: user_id -> (версия, время загрузки, список филиалов)
+_branch_scope_lock = threading.Lock()
+_branch_scope = {}
+# Версии кэша филиалов увеличиваются при изменениях: общая (сброс всех) и по пользователям
+_branch_scope_generation = 0
+_branch_scope_versions = {}
+_branch_scope_subscribed = False
 
 
 def hash_password(password):
@@ -23,6 +51,8 @@ def login_user(email, password):
             session['user_email'] = user['email']
             session['user_role'] = user['role_id']
             session['user_name'] = f"{user['first_name']} {user['last_name']}"
+            # Следующие запросы прочитают свежую запись
+            invalidate_current_user(user['user_id'])
             return True
         return False
     except Exception as e:
@@ -30,17 +60,112 @@ def login_user(email, password):
         return False
 
 
+def invalidate_current_user(user_id=None):
+    """Сбрасывает кэш пользователя (или всех, если user_id не указан), например после изменения профиля"""
+    global _users_generation
+
+    with _users_lock:
+        if user_id is None:
+            _users_generation += 1
+            _users.clear()
+        else:
+            _users_versions[user_id] = _users_versions.get(user_id, 0) + 1
+            _users.pop(user_id, None)
+    if has_app_context() and g.get('current_user') and user_id in (None, g.current_user['user_id']):
+        g.pop('current_user')
+
+
+def _on_users_changed(payload):
+    invalidate_current_user(int(payload) if payload else None)
+
+
+def _load_user(user_id):
+    """Запись пользователя из кэша процесса (CURRENT_USER_TTL секунд) или из БД"""
+    global _users_subscribed
+
+    ttl = current_app.config.get('CURRENT_USER_TTL', 60)
+    if ttl > 0:
+        if not _users_subscribed:
+            _users_subscribed = True
+            subscribe(USERS_CHANNEL, _on_users_changed)
+
+        with _users_lock:
+            version = (_users_generation, _users_versions.get(user_id, 0))
+            cached = _users.get(user_id)
+            if cached and cached[0] == version and time.monotonic() - cached[1] < ttl:
+                return cached[2]
+
+    user = query_db(f'SELECT {CURRENT_USER_FIELDS} FROM users WHERE user_id = %s', [user_id], one=True)
+    if user is not None and ttl > 0:
+        user = dict(user)
+        with _users_lock:
+            _users[user_id] = (version, time.monotonic(), user)
+    return user
+
+
 def get_current_user():
-    """Получение текущего пользователя"""
-    if 'user_id' in session:
+    """Получение текущего пользователя.
+
+    Запоминается на время запроса в g.current_user, так что пользователь
+    читается не больше одного раза за запрос; без входа в систему запросов к БД нет.
+    """
+    if 'user_id' not in session:
+        return None
+
+    if 'current_user' not in g:
         try:
-            return query_db('SELECT * FROM users WHERE user_id = %s', [session['user_id']], one=True)
+            g.current_user = _load_user(session['user_id'])
         except Exception as e:
             print(f"Get current user error: {e}")
             return None
-    return None
+    return g.current_user
 
 
 def is_admin():
     """Проверка, является ли пользователь администратором"""
-    return session.get('user_role') == 1
\ No newline at end of file
+    return session.get('user_role') == 1
+
+
+def invalidate_branch_scope(user_id=None):
+    """Сбрасывает кэш филиалов администратора (или всех, если user_id не указан)"""
+    global _branch_scope_generation
+
+    with _branch_scope_lock:
+        if user_id is None:
+            _branch_scope_generation += 1
+            _branch_scope.clear()
+        else:
+            _branch_scope_versions[user_id] = _branch_scope_versions.get(user_id, 0) + 1
+            _branch_scope.pop(user_id, None)
+
+
+def _on_user_branches_changed(payload):
+    invalidate_branch_scope(int(payload) if payload else None)
+
+
+def get_admin_branches(user_id):
+    """Филиалы, к которым привязан администратор (кэшируются на BRANCH_SCOPE_TTL секунд)"""
+    global _branch_scope_subscribed
+
+    if not _branch_scope_subscribed:
+        _branch_scope_subscribed = True
+        subscribe(USER_BRANCHES_CHANNEL, _on_user_branches_changed)
+
+    ttl = current_app.config.get('BRANCH_SCOPE_TTL', 300)
+    with _branch_scope_lock:
+        # Сброс, пришедший во время запроса ниже, сменит версию - такой результат не будет использован
+        version = (_branch_scope_generation, _branch_scope_versions.get(user_id, 0))
+        cached = _branch_scope.get(user_id)
+        if cached and cached[0] == version and time.monotonic() - cached[1] < ttl:
+            return cached[2]
+
+    branches = [dict(b) for b in query_db('''
+        SELECT b.branch_id, b.name, ub.is_primary FROM user_branches ub
+        JOIN branches b ON ub.branch_id = b.branch_id
+        WHERE ub.user_id = %s
+        ORDER BY ub.is_primary DESC, b.name
+    ''', [user_id])]
+
+    with _branch_scope_lock:
+        _branch_scope[user_id] = (version, time.monotonic(), branches)
+    return branches
@@ -1,45 +1,826 @@
 import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
-from flask import g, current_app
-import os
+from flask import g, current_app, has_app_context, has_request_context, request, session
+from app.utils import sqlite_backend
 
+slow_query_logger = logging.getLogger('lombard.slow_query')
 
-def get_db():
-    if 'db' not in g:
-        db_type = current_app.config.get('DB_TYPE', 'postgresql')
 
-        if db_type == 'postgresql':
-            # Используем DATABASE_URL из конфигурации
-            g.db = psycopg2.connect(
-                current_app.config['DATABASE_URL'],
-                cursor_factory=RealDictCursor
-            )
-            # Устанавливаем схему поиска
-            cur = g.db.cursor()
-            schema = current_app.config.get('DB_SCHEMA', 'lombard')
-            cur.execute(f"SET search_path TO {schema}, public;")
+class ProfilingCursor(RealDictCursor):
+    """Курсор, замеряющий время выполнения каждого запроса (см. QUERY_PROFILING)"""
+
+    def execute(self, query, vars=None, profile_as=None):
+        """profile_as - (запрос, параметры), под которыми записать выполнение
+        (для EXECUTE подготовленного оператора - исходный текст запроса)"""
+        if not has_app_context():
+            return super().execute(query, vars)
+        if g.get('db') is self.connection:
+            _note_write(profile_as[0] if profile_as else query)
+        if not current_app.config.get('QUERY_PROFILING', True):
+            return super().execute(query, vars)
+
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_query(self, *(profile_as or (query, vars)), (time.perf_counter() - started) * 1000)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Соединение с кэшем подготовленных операторов (см. query_db).
+
+    statements - LRU: текст запроса -> имя оператора на сервере,
+    executions - сколько раз запрос выполнялся без подготовки,
+    unpreparable - запросы, которые не удалось подготовить,
+    stale - имена вытесненных и устаревших операторов, которые еще нужно освободить.
+    Кэш живет вместе с физическим соединением, поэтому после
+    переподключения операторы подготавливаются заново.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = OrderedDict()
+        self.executions = {}
+        self.unpreparable = set()
+        self.stale = []
+        self.statement_seq = 0
+
+
+def _call_site():
+    """Первый кадр стека вне слоя доступа к БД - место вызова запроса"""
+    frame = sys._getframe(3)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename not in (__file__, sqlite_backend.__file__) and 'psycopg2' not in filename:
+            return f"{os.path.relpath(filename, current_app.root_path)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _normalize_sql(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return ' '.join(str(query).split())
+
+
+def _record_query(cur, query, vars, elapsed_ms):
+    cfg = current_app.config
+    entry = {
+        'sql': _normalize_sql(query),
+        'ms': round(elapsed_ms, 3),
+        'rows': cur.rowcount,
+        'site': _call_site(),
+    }
+    g.setdefault('query_log', []).append(entry)
+
+    if elapsed_ms < cfg.get('SLOW_QUERY_MS', 200):
+        return
+
+    if has_request_context():
+        entry = dict(entry, endpoint=request.endpoint)
+
+    # Для части медленных SELECT снимаем план с фактическими показателями
+    if entry['sql'].upper().startswith('SELECT') and not is_sqlite() and random.random() < cfg.get('SLOW_QUERY_EXPLAIN_RATE', 0.0):
+        entry['plan'] = _explain(cur.connection, query, vars)
+
+    slow_query_logger.warning(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+def _profile_sqlite(cur, query, vars, elapsed_ms):
+    """Профилирование запросов встроенной базы (аналог ProfilingCursor)"""
+    if has_app_context() and current_app.config.get('QUERY_PROFILING', True):
+        _record_query(cur, query, vars, elapsed_ms)
+
+
+def _explain(conn, query, vars):
+    """EXPLAIN (ANALYZE, BUFFERS) в точке сохранения, чтобы не испортить транзакцию запроса"""
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cur.execute('SAVEPOINT profiler_explain')
+        try:
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, vars)
+            plan = [row[0] for row in cur.fetchall()]
+            cur.execute('RELEASE SAVEPOINT profiler_explain')
+            return plan
+        except Exception as e:
+            cur.execute('ROLLBACK TO SAVEPOINT profiler_explain')
+            return f"EXPLAIN failed: {e}"
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        cur.close()
+
+
+# Сводка по эндпоинтам: endpoint -> {'requests': n, 'samples': deque[(request_ms, db_ms, queries)]}
+_endpoint_stats = {}
+_endpoint_stats_lock = threading.Lock()
+
+
+def _start_request_profile():
+    g.request_started = time.perf_counter()
+
+
+def _finish_request_profile(response):
+    """Сохраняет показатели запроса и добавляет заголовок Server-Timing (см. SERVER_TIMING)"""
+    if not current_app.config.get('QUERY_PROFILING', True) or 'request_started' not in g:
+        return response
+
+    queries = g.get('query_log', [])
+    db_ms = sum(q['ms'] for q in queries)
+    request_ms = (time.perf_counter() - g.request_started) * 1000
+    endpoint = request.endpoint or 'unknown'
+
+    with _endpoint_stats_lock:
+        stats = _endpoint_stats.get(endpoint)
+        if stats is None:
+            stats = _endpoint_stats[endpoint] = {
+                'requests': 0,
+                'samples': deque(maxlen=current_app.config.get('QUERY_PROFILE_SAMPLES', 1000)),
+            }
+        stats['requests'] += 1
+        stats['samples'].append((request_ms, db_ms, len(queries)))
+
+    # Время и число запросов к БД выдают устройство приложения - не показываем их всем подряд
+    mode = current_app.config.get('SERVER_TIMING', 'admin')
+    if mode == 'all' or (mode == 'admin' and session.get('user_role') == 1):
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{len(queries)} queries", app;dur={request_ms:.1f}'
+        )
+    return response
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 2)
+
+
+def get_query_profile():
+    """Запросы, выполненные в рамках текущего запроса"""
+    return list(g.get('query_log', []))
+
+
+def get_endpoint_stats():
+    """Сводка по эндпоинтам: число запросов и p50/p95/p99 времени ответа, времени в БД и числа запросов к БД"""
+    with _endpoint_stats_lock:
+        snapshot = {endpoint: (stats['requests'], list(stats['samples']))
+                    for endpoint, stats in _endpoint_stats.items()}
+
+    summary = {}
+    for endpoint, (count, samples) in snapshot.items():
+        if not samples:
+            continue
+        summary[endpoint] = {'count': count}
+        for i, name in enumerate(('request_ms', 'db_ms', 'queries')):
+            values = [sample[i] for sample in samples]
+            summary[endpoint][name] = {
+                'p50': _percentile(values, 50),
+                'p95': _percentile(values, 95),
+                'p99': _percentile(values, 99),
+                'max': round(max(values), 2),
+            }
+    return summary
+
+
+def reset_endpoint_stats():
+    with _endpoint_stats_lock:
+        _endpoint_stats.clear()
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений PostgreSQL.
+
+    search_path устанавливается один раз при создании физического соединения,
+    при выдаче соединения проверяется его работоспособность, а при возврате
+    незавершенная транзакция откатывается.
+    """
+
+    def __init__(self, dsn, schema, minconn=1, maxconn=10, timeout=10, check_interval=30):
+        self.dsn = dsn
+        self.schema = schema
+        self.minconn = minconn
+        self.maxconn = max(maxconn, minconn, 1)
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        self._idle = []  # (соединение, время возврата в пул)
+        self._in_use = set()
+        # Места, занятые соединениями, которые сейчас открываются или проверяются
+        # (это делается вне блокировки, чтобы не задерживать остальные потоки)
+        self._reserved = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'returns': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'rollbacks_on_return': 0,
+            'max_in_use': 0,
+        }
+
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=PreparingConnection,
+                                cursor_factory=ProfilingCursor)
+        # Схему поиска задаем один раз на физическое соединение
+        cur = conn.cursor()
+        cur.execute(f"SET search_path TO {self.schema}, public;")
+        cur.close()
+        conn.commit()
+        self._count('created')
+        return conn
+
+    def _count(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        self._count('closed')
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+
+        # Долго простаивавшее соединение могло быть разорвано сервером
+        self._count('health_checks')
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
             cur.close()
-        elif db_type == 'sqlite':
-            db_path = current_app.config['DATABASE_URL'].replace('sqlite:///', '')
-            g.db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
-            g.db.row_factory = sqlite3.Row
+            conn.rollback()
+            return True
+        except Exception:
+            self._count('health_check_failures')
+            return False
+
+    def _reserve(self, deadline):
+        """Занимает место в пуле: (простаивающее соединение, время возврата)
+        или (None, None), если можно открыть новое"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._reserved += 1
+                    return self._idle.pop()
+
+                if len(self._in_use) + self._reserved < self.maxconn:
+                    self._reserved += 1
+                    return None, None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений в пуле (max={self.maxconn})"
+                    )
+                self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+    def getconn(self):
+        """Выдает соединение из пула, при необходимости ожидая освобождения.
+
+        Место занимается под блокировкой, а подключение и проверка соединения
+        выполняются вне ее.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, idle_since = self._reserve(deadline)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                elif not self._is_healthy(conn, idle_since):
+                    self._discard(conn)
+                    conn = None
+            except Exception:
+                with self._cond:
+                    self._reserved -= 1
+                    self._cond.notify()
+                raise
+
+            with self._cond:
+                self._reserved -= 1
+                if conn is not None:
+                    return self._checkout(conn)
+                # Разорванное соединение отброшено - место свободно, пробуем снова
+                self._cond.notify()
+
+    def _checkout(self, conn):
+        self._in_use.add(conn)
+        self._stats['checkouts'] += 1
+        self._stats['max_in_use'] = max(self._stats['max_in_use'], len(self._in_use))
+        return conn
+
+    def putconn(self, conn):
+        """Возвращает соединение в пул, откатывая незавершенную транзакцию"""
+        with self._cond:
+            self._in_use.discard(conn)
+            self._stats['returns'] += 1
+
+            keep = not conn.closed
+            if keep and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                self._stats['rollbacks_on_return'] += 1
+                try:
+                    conn.rollback()
+                except Exception:
+                    keep = False
+
+            if keep and len(self._idle) < self.maxconn:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats,
+                min_size=self.minconn,
+                max_size=self.maxconn,
+                in_use=len(self._in_use),
+                idle=len(self._idle),
+                reserved=self._reserved,
+            )
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def is_sqlite():
+    """Работает ли приложение на встроенной базе SQLite (DB_TYPE=sqlite)"""
+    return current_app.config.get('DB_TYPE', 'postgresql') == 'sqlite'
+
+
+def get_pool():
+    """Возвращает пул соединений текущего процесса, создавая его при первом обращении"""
+    global _pool, _pool_pid
+
+    # После fork соединения родителя использовать нельзя
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                cfg = current_app.config
+                if is_sqlite():
+                    _pool = sqlite_backend.SQLitePool(
+                        cfg['SQLITE_PATH'],
+                        timeout=cfg.get('SQLITE_TIMEOUT', 30),
+                        on_execute=_profile_sqlite,
+                    )
+                else:
+                    _pool = ConnectionPool(
+                        cfg['DATABASE_URL'],
+                        cfg.get('DB_SCHEMA', 'lombard'),
+                        minconn=cfg.get('DB_POOL_MIN', 1),
+                        maxconn=cfg.get('DB_POOL_MAX', 10),
+                        timeout=cfg.get('DB_POOL_TIMEOUT', 10),
+                        check_interval=cfg.get('DB_POOL_CHECK_INTERVAL', 30),
+                    )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def get_pool_stats():
+    """Статистика пула соединений (для подбора DB_POOL_MIN/DB_POOL_MAX)"""
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
+
+
+class ReplicaSet:
+    """Реплики для чтения (DB_REPLICA_URLS), у каждой свой пул соединений.
+
+    Реплика выбирается по кругу (round_robin) или с наименьшим числом занятых
+    соединений (least_connections). Отставание реплики проверяется не чаще раза
+    в lag_check_interval секунд; отстающая больше max_lag секунд или недоступная
+    реплика пропускается до следующей проверки, а если подходящих нет,
+    чтение идет в основную базу.
+    """
+
+    LAG_QUERY = '''
+        SELECT CASE
+                   WHEN NOT pg_is_in_recovery() THEN 0
+                   WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                   ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+               END AS lag
+    '''
+
+    def __init__(self, urls, schema, strategy='round_robin', max_lag=5, lag_check_interval=10,
+                 maxconn=10, timeout=10, check_interval=30):
+        if strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f"Неизвестная стратегия выбора реплики: {strategy}")
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._lock = threading.Lock()
+        self._next = 0
+        self._fallbacks = 0
+        self.replicas = []
+        for url in urls:
+            dsn = psycopg2.extensions.parse_dsn(url)
+            self.replicas.append({
+                # Без пароля - имя попадает в статистику
+                'name': f"{dsn.get('host', 'localhost')}:{dsn.get('port', '5432')}/{dsn.get('dbname', '')}",
+                # Соединения с репликой открываются по требованию
+                'pool': ConnectionPool(url, schema, minconn=0, maxconn=maxconn, timeout=timeout,
+                                       check_interval=check_interval),
+                'lag': None,
+                'checked_at': None,
+                'reads': 0,
+                'errors': 0,
+            })
+
+    def _candidates(self):
+        with self._lock:
+            if self.strategy == 'least_connections':
+                return sorted(self.replicas, key=lambda r: r['pool'].stats()['in_use'])
+            start = self._next % len(self.replicas)
+            self._next += 1
+            return self.replicas[start:] + self.replicas[:start]
+
+    def _check_lag(self, replica):
+        """Обновляет отставание реплики (None - реплика недоступна)"""
+        with self._lock:
+            checked_at = replica['checked_at']
+            if checked_at is not None and time.monotonic() - checked_at < self.lag_check_interval:
+                return
+            # Проверяет один поток, остальные пока пользуются прежним значением
+            replica['checked_at'] = time.monotonic()
+
+        try:
+            conn = replica['pool'].getconn()
+            try:
+                cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+                cur.execute(self.LAG_QUERY)
+                lag = float(cur.fetchone()[0])
+                cur.close()
+                conn.rollback()
+            finally:
+                replica['pool'].putconn(conn)
+        except (psycopg2.Error, PoolTimeoutError) as e:
+            print(f"Replica {replica['name']} lag check failed: {e}")
+            lag = None
+            with self._lock:
+                replica['errors'] += 1
+        replica['lag'] = lag
+
+    def acquire(self):
+        """Соединение с подходящей репликой: (реплика, соединение) или (None, None)"""
+        for replica in self._candidates():
+            self._check_lag(replica)
+            if replica['lag'] is None or replica['lag'] > self.max_lag:
+                continue
+            try:
+                conn = replica['pool'].getconn()
+            except (psycopg2.Error, PoolTimeoutError) as e:
+                print(f"Replica {replica['name']} unavailable: {e}")
+                with self._lock:
+                    replica['errors'] += 1
+                    # До следующей проверки отставания реплика пропускается
+                    replica['lag'] = None
+                continue
+            with self._lock:
+                replica['reads'] += 1
+            return replica, conn
+
+        with self._lock:
+            self._fallbacks += 1
+        return None, None
+
+    def release(self, replica, conn):
+        replica['pool'].putconn(conn)
+
+    def stats(self):
+        with self._lock:
+            replicas = [
+                {'name': r['name'], 'lag': r['lag'], 'reads': r['reads'], 'errors': r['errors']}
+                for r in self.replicas
+            ]
+            fallbacks = self._fallbacks
+        for info, replica in zip(replicas, self.replicas):
+            info['pool'] = replica['pool'].stats()
+        return {'strategy': self.strategy, 'max_lag': self.max_lag, 'fallbacks': fallbacks, 'replicas': replicas}
+
+
+_replicas = None
+_replicas_pid = None
+
+
+def get_replicas():
+    """Реплики для чтения текущего процесса (None, если DB_REPLICA_URLS не заданы)"""
+    global _replicas, _replicas_pid
+
+    cfg = current_app.config
+    if not cfg.get('DB_REPLICA_URLS') or is_sqlite():
+        return None
+
+    if _replicas is None or _replicas_pid != os.getpid():
+        with _pool_lock:
+            if _replicas is None or _replicas_pid != os.getpid():
+                _replicas = ReplicaSet(
+                    cfg['DB_REPLICA_URLS'],
+                    cfg.get('DB_SCHEMA', 'lombard'),
+                    strategy=cfg.get('DB_REPLICA_STRATEGY', 'round_robin'),
+                    max_lag=cfg.get('DB_REPLICA_MAX_LAG', 5),
+                    lag_check_interval=cfg.get('DB_REPLICA_LAG_CHECK_INTERVAL', 10),
+                    maxconn=cfg.get('DB_POOL_MAX', 10),
+                    timeout=cfg.get('DB_POOL_TIMEOUT', 10),
+                    check_interval=cfg.get('DB_POOL_CHECK_INTERVAL', 30),
+                )
+                _replicas_pid = os.getpid()
+    return _replicas
+
+
+def get_replica_stats():
+    """Статистика реплик: отставание, число чтений и переходов на основную базу"""
+    if _replicas is None or _replicas_pid != os.getpid():
+        return None
+    return _replicas.stats()
+
+
+# Запросы, которые не меняют данные (остальные включают чтение из основной базы)
+READ_STATEMENTS = ('SELECT', 'SHOW')
+
+
+def _note_write(query):
+    """Отмечает запись через соединение основной базы: дальше в этом запросе читаем из нее"""
+    if not g.get('db_wrote') and isinstance(query, str) and not query.lstrip().upper().startswith(READ_STATEMENTS):
+        g.db_wrote = True
+
+
+def _primary_required():
+    """Нужно ли читать из основной базы, чтобы увидеть свои же изменения.
+
+    Да, если это изменяющий запрос (POST и т.п.: решения в нем принимаются по
+    актуальным данным), если в этом запросе уже была запись, если на соединении
+    основной базы открыта транзакция (чтение должно видеть ее незафиксированные
+    изменения) или если пользователь писал в последние DB_REPLICA_STICKY_SECONDS секунд.
+    """
+    if g.get('db_wrote') or (has_request_context() and request.method not in ('GET', 'HEAD')):
+        return True
+    db = g.get('db')
+    if db is not None and db.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return True
+    return has_request_context() and session.get('db_primary_until', 0) > time.time()
+
+
+def get_read_db():
+    """Соединение для чтения: реплика, если она есть и подходит, иначе get_db()"""
+    replicas = get_replicas()
+    if replicas is None or _primary_required():
+        return get_db()
+
+    if 'read_db' not in g:
+        replica, conn = replicas.acquire()
+        if conn is None:
+            return get_db()
+        g.read_db, g.read_replica = conn, replica
+    return g.read_db
+
+
+@contextmanager
+def read_only():
+    """Блок только для чтения: query_db в нем считает любой запрос чтением (например,
+    WITH ... SELECT) и выполняет его на реплике, а as дает соединение для чтения"""
+    previous = g.get('read_only', False)
+    g.read_only = True
+    try:
+        yield get_read_db()
+    finally:
+        g.read_only = previous
+
+
+def _remember_write(response):
+    """После записи следующие запросы пользователя еще DB_REPLICA_STICKY_SECONDS секунд
+    читают из основной базы (например, страница после redirect видит новую заявку)"""
+    sticky = current_app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+    if g.get('db_wrote') and sticky > 0 and current_app.config.get('DB_REPLICA_URLS'):
+        session['db_primary_until'] = time.time() + sticky
+    return response
+
+
+def get_db():
+    if 'db' not in g:
+        # Берем соединение из пула вместо нового подключения на каждый запрос.
+        # В режиме sqlite это соединение с интерфейсом psycopg2 (см. sqlite_backend)
+        g.db = get_pool().getconn()
 
     return g.db
 
 
 def close_db(e=None):
+    read_db = g.pop('read_db', None)
+    if read_db is not None:
+        get_replicas().release(g.pop('read_replica'), read_db)
+
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().putconn(db)
 
 
 def init_db(app):
     app.teardown_appcontext(close_db)
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.after_request(_remember_write)
+
+
+# Счетчики кэша подготовленных операторов по всем соединениям процесса
+_prepared_stats = {'hits': 0, 'misses': 0, 'prepared': 0, 'failed': 0, 'evicted': 0, 'reprepared': 0}
+_prepared_stats_lock = threading.Lock()
+
+# Запросы, которые можно подготовить (PREPARE не принимает DDL и служебные команды)
+PREPARABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+_PLACEHOLDER = re.compile(r'%%|%s')
+
+
+def _count_prepared(key):
+    with _prepared_stats_lock:
+        _prepared_stats[key] += 1
+
+
+def get_prepared_stats():
+    """Попадания и промахи кэша подготовленных операторов"""
+    with _prepared_stats_lock:
+        return dict(_prepared_stats)
+
+
+def _to_server_placeholders(query):
+    """Заменяет %s на $1, $2, ... (и %% на %) для PREPARE; возвращает (текст, число параметров)"""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group() == '%%':
+            return '%'
+        count += 1
+        return f'${count}'
+
+    return _PLACEHOLDER.sub(replace, query), count
+
+
+def _in_savepoint(conn, commands):
+    """Выполняет служебные команды одним обращением к серверу в точке сохранения:
+    их ошибка не прерывает открытую транзакцию запроса"""
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cur.execute('; '.join(['SAVEPOINT lombard_prepare'] + commands + ['RELEASE SAVEPOINT lombard_prepare']))
+    except psycopg2.Error:
+        cur.execute('ROLLBACK TO SAVEPOINT lombard_prepare; RELEASE SAVEPOINT lombard_prepare')
+        raise
+    finally:
+        cur.close()
+
+
+def _prepared_name(conn, query):
+    """Имя подготовленного оператора для запроса или None, если выполнять его нужно как обычно.
+
+    Запрос подготавливается, когда выполнен на соединении DB_PREPARE_THRESHOLD раз;
+    на соединении держится не больше DB_PREPARED_CACHE_SIZE операторов (LRU).
+    Если подготовить запрос не удалось (например, тип параметра не выводится),
+    он выполняется как обычно и больше не подготавливается.
+    """
+    if not isinstance(conn, PreparingConnection):
+        return None
+
+    cfg = current_app.config
+    cache_size = cfg.get('DB_PREPARED_CACHE_SIZE', 64)
+    if cache_size <= 0:
+        return None
+
+    name = conn.statements.get(query)
+    if name is not None:
+        conn.statements.move_to_end(query)
+        return name
+
+    if '%(' in query or query in conn.unpreparable or not query.lstrip().upper().startswith(PREPARABLE):
+        return None
+    if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        return None
+
+    count = conn.executions.get(query, 0) + 1
+    if count < cfg.get('DB_PREPARE_THRESHOLD', 5):
+        if len(conn.executions) >= cache_size * 10:
+            # Не копим счетчики разовых запросов (например, с условиями из фильтров)
+            conn.executions.clear()
+        conn.executions[query] = count
+        return None
+    conn.executions.pop(query, None)
+
+    server_query, _ = _to_server_placeholders(query)
+    conn.statement_seq += 1
+    name = f'lombard_ps_{conn.statement_seq}'
+
+    # Заодно освобождаем операторы, вытесненные или устаревшие с прошлого раза
+    commands = [f'DEALLOCATE {stale}' for stale in conn.stale] + [f'PREPARE {name} AS {server_query}']
+    had_stale = bool(conn.stale)
+    conn.stale = []
+    try:
+        _in_savepoint(conn, commands)
+    except psycopg2.Error as e:
+        print(f"PREPARE failed, executing directly: {e}")
+        # Ошибка могла быть в DEALLOCATE - тогда запрос попробуем подготовить еще раз
+        if not had_stale:
+            _mark_unpreparable(conn, query)
+        _count_prepared('failed')
+        return None
+    _count_prepared('prepared')
+
+    conn.statements[query] = name
+    if len(conn.statements) > cache_size:
+        _, evicted = conn.statements.popitem(last=False)
+        conn.stale.append(evicted)
+        _count_prepared('evicted')
+    return name
+
+
+def _mark_unpreparable(conn, query):
+    if len(conn.unpreparable) >= current_app.config.get('DB_PREPARED_CACHE_SIZE', 64) * 10:
+        conn.unpreparable.clear()
+    conn.unpreparable.add(query)
+
+
+def _execute(conn, cur, query, args, retried=False):
+    """Выполняет запрос, для частых запросов - через подготовленный оператор.
+
+    Устаревший оператор готовится заново и запрос повторяется один раз (retried).
+    """
+    idle = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE \
+        if isinstance(conn, PreparingConnection) else False
+    name = _prepared_name(conn, query)
+
+    if name is None:
+        _count_prepared('misses')
+        cur.execute(query, args)
+        return
+
+    placeholders = ', '.join(['%s'] * len(args))
+    statement = f'EXECUTE {name} ({placeholders})' if args else f'EXECUTE {name}'
+    try:
+        cur.execute(statement, args, profile_as=(query, args))
+        _count_prepared('hits')
+    except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported) as e:
+        if isinstance(e, psycopg2.errors.InvalidSqlStatementName):
+            # Операторы сброшены на сервере (DISCARD ALL/DEALLOCATE ALL) - забываем их
+            conn.statements.clear()
+            conn.stale = []
+        else:
+            conn.statements.pop(query, None)
+            conn.stale.append(name)
+            # Таблица изменилась (ALTER TABLE), и план SELECT * отдает другие колонки -
+            # оператор готовится заново; прочие ошибки подготовкой не лечатся
+            if retried or 'cached plan must not change result type' not in str(e):
+                _mark_unpreparable(conn, query)
+                raise
+            conn.executions[query] = current_app.config.get('DB_PREPARE_THRESHOLD', 5)
+        _count_prepared('reprepared')
+        # Повторить можно, только если до запроса транзакция была пустой
+        if not idle or retried:
+            raise
+        conn.rollback()
+        _execute(conn, cur, query, args, retried=True)
 
 
 def query_db(query, args=(), one=False):
-    conn = get_db()
+    """Выполняет запрос; SELECT (и все запросы в блоке read_only) могут уйти на реплику"""
+    is_read = g.get('read_only') or query.strip().upper().startswith('SELECT')
+    conn = get_read_db() if is_read else get_db()
     cur = conn.cursor()
 
     # Преобразуем аргументы для корректной работы с JSON
@@ -50,13 +831,100 @@ def query_db(query, args=(), one=False):
         else:
             processed_args.append(arg)
 
-    cur.execute(query, processed_args)
+    _execute(conn, cur, query, processed_args)
 
-    if query.strip().upper().startswith('SELECT'):
+    if is_read:
         rv = cur.fetchall()
         cur.close()
         return (rv[0] if rv else None) if one else rv
     else:
         conn.commit()
         cur.close()
-        return cur.rowcount
\ No newline at end of file
+        return cur.rowcount
+
+
+# Классы строк с __slots__ для iter_query(row_type='slots'): набор колонок -> класс
+_row_classes = {}
+_row_classes_lock = threading.Lock()
+
+
+def _row_class(columns):
+    """Легкий класс строки: доступ к полям как row.name и row['name'], без словаря на каждую строку"""
+    with _row_classes_lock:
+        cls = _row_classes.get(columns)
+        if cls is None:
+            def __init__(self, values):
+                for name, value in zip(columns, values):
+                    object.__setattr__(self, name, value)
+
+            def __getitem__(self, key):
+                return getattr(self, key) if isinstance(key, str) else getattr(self, columns[key])
+
+            def __repr__(self):
+                fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in columns)
+                return f"Row({fields})"
+
+            cls = type('Row', (), {
+                '__slots__': columns,
+                '__init__': __init__,
+                '__getitem__': __getitem__,
+                '__iter__': lambda self: (getattr(self, name) for name in columns),
+                '__len__': lambda self: len(columns),
+                '__repr__': __repr__,
+                'keys': lambda self: columns,
+            })
+            _row_classes[columns] = cls
+    return cls
+
+
+def iter_query(query, args=(), itersize=None, row_type='dict'):
+    """Лениво выдает строки SELECT через именованный (серверный) курсор.
+
+    Строки читаются с сервера порциями по itersize (по умолчанию DB_ITERSIZE),
+    так что память не зависит от размера результата. row_type: 'dict' - словари,
+    'tuple' - кортежи (дешевле всего), 'slots' - объекты с __slots__ (row.name и row['name']).
+
+    Запрос идет на реплику, если она подходит (см. get_read_db). Курсор живет
+    в транзакции соединения для чтения: commit до окончания обхода закрывает его,
+    поэтому в цикле по строкам писать через это же соединение нельзя.
+    Транзакцию, открытую самим обходом, iter_query по окончании откатывает;
+    уже начатая транзакция запроса (например, с записями) остается как есть.
+    """
+    if row_type not in ('dict', 'tuple', 'slots'):
+        raise ValueError(f"Неизвестный row_type: {row_type}")
+
+    conn = get_read_db()
+    opened = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    cur = conn.cursor(name=f"iter_{uuid.uuid4().hex}", cursor_factory=psycopg2.extensions.cursor)
+    cur.itersize = itersize or current_app.config.get('DB_ITERSIZE', 2000)
+
+    profiling = current_app.config.get('QUERY_PROFILING', True)
+    started = time.perf_counter()
+    try:
+        cur.execute(query, list(args))
+        make_row = None
+        for values in cur:
+            if make_row is None:
+                columns = tuple(column[0] for column in cur.description)
+                if row_type == 'dict':
+                    make_row = lambda values: dict(zip(columns, values))
+                elif row_type == 'slots':
+                    make_row = _row_class(columns)
+                else:
+                    make_row = tuple
+            yield make_row(values)
+    finally:
+        if profiling and has_app_context():
+            # Время обхода целиком, включая обработку строк вызывающим кодом,
+            # поэтому в журнал медленных запросов такие запросы не попадают
+            g.setdefault('query_log', []).append({
+                'sql': _normalize_sql(query),
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+                'rows': cur.rowcount,
+                'site': None,
+                'streamed': True,
+            })
+        cur.close()
+        if opened:
+            # Только читали - транзакцию, начатую обходом, можно просто завершить
+            conn.rollback()
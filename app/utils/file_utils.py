@@ -1,8 +1,15 @@
+import hashlib
 import os
-import uuid
+import shutil
+import tempfile
 from werkzeug.utils import secure_filename
 from flask import current_app
 from datetime import datetime
+from app.utils.database import get_db, query_db
+from app.utils.image_utils import delete_derivatives, remember_content_hash
+
+# Размер блока при потоковой записи загрузок на диск
+CHUNK_SIZE = 64 * 1024
 
 
 def allowed_file(filename, allowed_extensions=None):
@@ -12,42 +19,167 @@ def allowed_file(filename, allowed_extensions=None):
         filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 
-def save_uploaded_files(files, subfolder='attachments'):
-    """Сохраняет загруженные файлы и возвращает список путей"""
-    saved_files = []
+def _stream_to_temp(file, upload_folder):
+    """Пишет загрузку во временный файл блоками, попутно считая SHA-256"""
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return tmp_path, digest.hexdigest(), size
+
+
+def file_sha256(path):
+    """SHA-256 файла на диске"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    # Создаем папку для загрузок если её нет
+
+def _claim_blob(relative_path, digest, file_size):
+    """Отмечает файл в attachment_blobs до его появления или повторного использования.
+
+    Файл без ссылок получает новое время освобождения, так что purge_unreferenced_files
+    не тронет его в течение UPLOAD_PURGE_GRACE, а если вложение так и не будет создано,
+    удалит. Отметка фиксируется сразу (вызывать до записей в транзакции вызывающего).
+    """
+    query_db('''
+        INSERT INTO attachment_blobs (file_path, content_hash, file_size, ref_count, released_at)
+        VALUES (%s, %s, %s, 0, now())
+        ON CONFLICT (file_path) DO UPDATE
+        SET released_at = CASE WHEN attachment_blobs.ref_count <= 0 THEN now() END
+    ''', [relative_path, digest, file_size])
+
+
+def store_file(tmp_path, digest, file_ext, subfolder):
+    """Переносит подготовленный файл в uploads/<subfolder>/<sha256>.<ext>.
+
+    Если файл с таким содержимым уже есть, временный файл просто удаляется.
+    Файл сначала отмечается в attachment_blobs (см. _claim_blob), поэтому не теряется,
+    даже если вложение потом не создастся или файл параллельно удаляется как неиспользуемый.
+    Возвращает (относительный путь, признак дубликата).
+    """
     upload_folder = os.path.join(current_app.root_path, 'static', 'uploads', subfolder)
     os.makedirs(upload_folder, exist_ok=True)
 
-    for file in files:
-        if file and file.filename and allowed_file(file.filename):
-            # Генерируем уникальное имя файла
-            file_ext = file.filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
+    # Имя файла - хэш содержимого
+    stored_filename = f"{digest}.{file_ext}"
+    file_path = os.path.join(upload_folder, stored_filename)
+    relative_path = f"uploads/{subfolder}/{stored_filename}"
+
+    # Проверять наличие файла можно только после отметки: удаление, начатое раньше,
+    # к этому моменту уже завершено
+    _claim_blob(relative_path, digest, os.path.getsize(tmp_path))
+
+    duplicate = os.path.exists(file_path)
+    if duplicate:
+        os.remove(tmp_path)
+    else:
+        # mkstemp создает файл с правами 0600, а отдавать его может и веб-сервер
+        os.chmod(tmp_path, 0o644)
+        shutil.move(tmp_path, file_path)
 
-            # Сохраняем файл
-            file_path = os.path.join(upload_folder, unique_filename)
-            file.save(file_path)
+    remember_content_hash(relative_path, digest)
+    return relative_path, duplicate
 
-            # Сохраняем относительный путь для БД
-            relative_path = f"uploads/{subfolder}/{unique_filename}"
-            saved_files.append({
-                'file_path': relative_path,
-                'file_name': secure_filename(file.filename),
-                'original_name': file.filename
-            })
 
-    return saved_files
+def stage_uploaded_files(files):
+    """Переносит загрузки во временный каталог для фоновой обработки (см. upload_service).
 
+    Возвращает список файлов с именами во временном каталоге.
+    """
+    staging_dir = current_app.config['UPLOAD_STAGING_DIR']
+    os.makedirs(staging_dir, exist_ok=True)
 
-def delete_file(file_path):
-    """Удаляет файл с диска"""
+    staged_files = []
     try:
-        full_path = os.path.join(current_app.root_path, 'static', file_path)
-        if os.path.exists(full_path):
-            os.remove(full_path)
-            return True
+        for file in files:
+            if file and file.filename and allowed_file(file.filename):
+                file_ext = file.filename.rsplit('.', 1)[1].lower()
+                tmp_path, _, size = _stream_to_temp(file, staging_dir)
+
+                # Расширение нужно обработчику для выбора формата
+                staged_name = f"{os.path.basename(tmp_path)}.{file_ext}"
+                os.replace(tmp_path, os.path.join(staging_dir, staged_name))
+
+                staged_files.append({
+                    'staged_name': staged_name,
+                    'file_name': secure_filename(file.filename),
+                    'mime_type': file.mimetype,
+                    'file_size': size
+                })
     except Exception:
-        pass
-    return False
\ No newline at end of file
+        discard_staged_files(staged_files)
+        raise
+
+    return staged_files
+
+
+def discard_staged_files(staged_files):
+    """Удаляет файлы из временного каталога (например, если заявка не сохранилась)"""
+    staging_dir = current_app.config['UPLOAD_STAGING_DIR']
+    for staged in staged_files:
+        path = os.path.join(staging_dir, staged['staged_name'])
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _remove_blob(file_path):
+    full_path = os.path.join(current_app.root_path, 'static', file_path)
+    if not os.path.exists(full_path):
+        return False
+    delete_derivatives(file_path)
+    os.remove(full_path)
+    return True
+
+
+def purge_unreferenced_files(grace_seconds=None):
+    """Удаляет файлы вложений, на которые не осталось ссылок (например, после удаления заявок).
+
+    Файл удаляется только через grace_seconds после освобождения последней ссылки
+    или последней загрузки того же содержимого (store_file). Строка attachment_blobs
+    удаляется вместе с файлом под блокировкой: параллельная загрузка дождется
+    фиксации и положит файл заново.
+    """
+    if grace_seconds is None:
+        grace_seconds = current_app.config.get('UPLOAD_PURGE_GRACE', 3600)
+
+    blobs = query_db('''
+        SELECT file_path FROM attachment_blobs
+        WHERE ref_count <= 0 AND released_at < now() - make_interval(secs => %s)
+    ''', [grace_seconds])
+
+    conn = get_db()
+    cur = conn.cursor()
+    removed = 0
+    for blob in blobs:
+        try:
+            # Повторная проверка: вложение или загрузка могли появиться после выборки
+            cur.execute('''
+                DELETE FROM attachment_blobs
+                WHERE file_path = %s AND ref_count <= 0
+                  AND released_at < now() - make_interval(secs => %s)
+                RETURNING file_path
+            ''', (blob['file_path'], grace_seconds))
+            if cur.fetchone() and _remove_blob(blob['file_path']):
+                removed += 1
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Ошибка при удалении файла {blob['file_path']}: {e}")
+    cur.close()
+
+    if removed:
+        print(f"Удалено неиспользуемых файлов вложений: {removed}")
+    return removed
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import threading
+from flask import current_app
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow показываем оригиналы
+    Image = None
+
+# Производные изображения: имя -> максимальный размер стороны
+DERIVATIVES = {
+    'thumb': 400,
+    'medium': 1280,
+}
+
+# Форматы производных: расширение -> (формат Pillow, параметры сохранения)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DERIVED_FOLDER = 'derived'
+
+# Кэш хэшей содержимого оригиналов: путь -> (mtime, sha256)
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+
+def _static_path(file_path):
+    return os.path.join(current_app.root_path, 'static', file_path)
+
+
+def content_hash(file_path):
+    """SHA-256 содержимого файла (кэшируется по времени изменения)"""
+    full_path = _static_path(file_path)
+    mtime = os.path.getmtime(full_path)
+
+    with _hash_lock:
+        cached = _hash_cache.get(file_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _hash_lock:
+        _hash_cache[file_path] = (mtime, value)
+    return value
+
+
+def remember_content_hash(file_path, digest):
+    """Запоминает хэш, уже посчитанный при загрузке, чтобы не читать файл повторно"""
+    mtime = os.path.getmtime(_static_path(file_path))
+    with _hash_lock:
+        _hash_cache[file_path] = (mtime, digest)
+
+
+def derivative_path(file_path, digest, variant, ext):
+    """Путь производного изображения рядом с оригиналом: <папка>/derived/<sha256>_<вариант>.<ext>"""
+    folder = os.path.dirname(file_path)
+    return f"{folder}/{DERIVED_FOLDER}/{digest}_{variant}.{ext}"
+
+
+def generate_derivatives(file_path):
+    """Создает недостающие уменьшенные копии изображения во всех вариантах и форматах.
+
+    Вызывается при загрузке и лениво при показе (для старых вложений).
+    Возвращает {вариант: {расширение: относительный путь}} или None,
+    если Pillow недоступен или файл не удалось прочитать как изображение.
+    """
+    if Image is None:
+        return None
+
+    try:
+        digest = content_hash(file_path)
+        result = {}
+        missing = []
+        for variant in DERIVATIVES:
+            result[variant] = {}
+            for ext in FORMATS:
+                path = derivative_path(file_path, digest, variant, ext)
+                result[variant][ext] = path
+                if not os.path.exists(_static_path(path)):
+                    missing.append((variant, ext, path))
+
+        if not missing:
+            return result
+
+        os.makedirs(os.path.dirname(_static_path(missing[0][2])), exist_ok=True)
+
+        with Image.open(_static_path(file_path)) as original:
+            # Учитываем ориентацию из EXIF, для GIF берется первый кадр
+            image = ImageOps.exif_transpose(original)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # Прозрачные области заливаем белым
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            resized = {}
+            for variant, ext, path in missing:
+                if variant not in resized:
+                    size = DERIVATIVES[variant]
+                    copy = image.copy()
+                    copy.thumbnail((size, size), Image.LANCZOS)
+                    resized[variant] = copy
+
+                pil_format, options = FORMATS[ext]
+                # Запись через временный файл, чтобы параллельный запрос не увидел обрезанный файл
+                tmp_path = f"{_static_path(path)}.{os.getpid()}.{threading.get_ident()}.tmp"
+                resized[variant].save(tmp_path, pil_format, **options)
+                os.replace(tmp_path, _static_path(path))
+
+        return result
+
+    except Exception as e:
+        print(f"Ошибка при создании превью {file_path}: {e}")
+        return None
+
+
+def delete_derivatives(file_path):
+    """Удаляет производные изображения оригинала"""
+    try:
+        digest = content_hash(file_path)
+    except OSError:
+        return
+    for variant in DERIVATIVES:
+        for ext in FORMATS:
+            path = _static_path(derivative_path(file_path, digest, variant, ext))
+            if os.path.exists(path):
+                os.remove(path)
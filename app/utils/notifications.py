@@ -0,0 +1,69 @@
+import select
+import threading
+import time
+import psycopg2
+from flask import current_app
+
+# Подписки на каналы LISTEN/NOTIFY: канал -> [callback(payload)].
+# payload = None означает, что уведомления могли быть пропущены
+# (например, при переподключении) и кэш нужно сбросить целиком.
+_handlers = {}
+_lock = threading.Lock()
+_listener_started = False
+
+
+def subscribe(channel, callback):
+    """Подписывает callback на уведомления канала и запускает слушатель процесса"""
+    global _listener_started
+
+    with _lock:
+        _handlers.setdefault(channel, []).append(callback)
+        if _listener_started or current_app.config.get('DB_TYPE', 'postgresql') != 'postgresql':
+            return
+        _listener_started = True
+
+    thread = threading.Thread(
+        target=_listen,
+        args=(current_app.config['DATABASE_URL'],),
+        daemon=True
+    )
+    thread.start()
+
+
+def _dispatch(channel, payload):
+    with _lock:
+        callbacks = list(_handlers.get(channel, ()))
+    for callback in callbacks:
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"Notification handler error ({channel}): {e}")
+
+
+def _listen(dsn):
+    """Слушает все каналы с подписками на отдельном соединении"""
+    while True:
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.autocommit = True
+            cur = conn.cursor()
+            listening = set()
+
+            while True:
+                with _lock:
+                    channels = set(_handlers) - listening
+                for channel in channels:
+                    cur.execute(f"LISTEN {channel};")
+                    listening.add(channel)
+                    # Изменения могли произойти, пока канал не слушался
+                    _dispatch(channel, None)
+
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    _dispatch(notify.channel, notify.payload or None)
+        except Exception as e:
+            print(f"Notification listener error: {e}")
+            time.sleep(5)
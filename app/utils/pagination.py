@@ -0,0 +1,55 @@
+from datetime import datetime
+from app.utils.database import query_db
+
+
+def encode_cursor(created_at, row_id):
+    """Курсор страницы: "<время ISO>|<id>" последней (или первой) строки"""
+    return f"{created_at.isoformat()}|{row_id}"
+
+
+def decode_cursor(value):
+    try:
+        created_at, row_id = value.split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_page(query, params, time_column, id_column, per_page, cursor=None, direction='next'):
+    """Выбирает страницу по ключу (time_column, id_column) в порядке убывания вместо OFFSET.
+
+    query должен заканчиваться условием WHERE (к нему добавляется AND),
+    а строки результата - содержать поля с именами колонок ключа без префикса.
+    cursor - строка из encode_cursor, direction - 'next' (старше) или 'prev' (новее).
+    Возвращает (строки, курсор предыдущей страницы, курсор следующей страницы).
+    """
+    key = decode_cursor(cursor) if cursor else None
+    page_params = list(params)
+
+    if key and direction == 'prev':
+        query += f' AND ({time_column}, {id_column}) > (%s, %s)'
+        query += f' ORDER BY {time_column} ASC, {id_column} ASC LIMIT %s'
+    else:
+        if key:
+            query += f' AND ({time_column}, {id_column}) < (%s, %s)'
+        query += f' ORDER BY {time_column} DESC, {id_column} DESC LIMIT %s'
+    if key:
+        page_params.extend(key)
+    page_params.append(per_page + 1)
+
+    rows = query_db(query, page_params)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if key and direction == 'prev':
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = key is not None, has_more
+
+    time_field = time_column.rsplit('.', 1)[-1]
+    id_field = id_column.rsplit('.', 1)[-1]
+    prev_cursor = encode_cursor(rows[0][time_field], rows[0][id_field]) if rows and has_prev else None
+    next_cursor = encode_cursor(rows[-1][time_field], rows[-1][id_field]) if rows and has_next else None
+
+    return rows, prev_cursor, next_cursor
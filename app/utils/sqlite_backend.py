@@ -0,0 +1,292 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.extras import RealDictCursor
+
+# Встроенный режим SQLite (DB_TYPE=sqlite): соединение и курсор с интерфейсом
+# psycopg2 (строки-словари, %s-параметры, commit/rollback), а запросы
+# переводятся с диалекта PostgreSQL на лету (см. translate).
+
+# Значения Python -> SQLite. Время с часовым поясом хранится в UTC, как CURRENT_TIMESTAMP
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: (
+    value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+).isoformat(' '))
+sqlite3.register_adapter(dict, json.dumps)
+
+# SQLite -> Python по объявленному типу колонки (схема init_db.py, SQLITE_SCHEMA)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('NUMERIC', lambda value: Decimal(value.decode()))
+sqlite3.register_converter('BOOLEAN', lambda value: value not in (b'0', b''))
+sqlite3.register_converter('JSONB', lambda value: json.loads(value))
+
+# Вычисляемые колонки (UNION, CTE с NULL в первой ветке) типа не имеют -
+# даты и время в них распознаются по имени колонки и формату значения
+_TEMPORAL_COLUMN = re.compile(r'(_at|_date|_time|_from|_to)$')
+_ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}')
+
+# Конструкции PostgreSQL, которые переводятся или отбрасываются. Строковые
+# литералы распознаются первыми, чтобы не трогать их содержимое.
+_TOKEN = re.compile(r"""
+      (?P<string>'(?:[^']|'')*')
+    | (?P<any>=\s*ANY\s*\(\s*%s\s*\))
+    | (?P<all>(?:<>|!=)\s*ALL\s*\(\s*%s\s*\))
+    | (?P<ago>\bnow\s*\(\s*\)\s*-\s*(?:make_interval\s*\(\s*secs\s*=>\s*%s\s*\)
+                                    |%s\s*\*\s*INTERVAL\s*'1\s+seconds?'))
+    | (?P<now>\bnow\s*\(\s*\))
+    | (?P<escaped>%%)
+    | (?P<param>%s)
+    | (?P<cast>::\s*[a-z_]+(?:\s*\[\])?)
+    | (?P<lock>\bFOR\s+UPDATE(?:\s+SKIP\s+LOCKED)?)
+    | (?P<func>\b(?:GREATEST|LEAST|ILIKE|jsonb_build_object|pg_try_advisory_lock|pg_advisory_unlock)\b)
+""", re.IGNORECASE | re.VERBOSE)
+
+_FUNCTIONS = {
+    'greatest': 'MAX',
+    'least': 'MIN',
+    'ilike': 'LIKE',
+    'jsonb_build_object': 'json_object',
+    # Узел SQLite - это один файл базы: межпроцессную блокировку обхода заменяет
+    # сериализация записи в SQLite, функция просто возвращает истину (ключ блокировки)
+    'pg_try_advisory_lock': 'abs',
+    'pg_advisory_unlock': 'abs',
+}
+
+# Команды сеанса PostgreSQL (SET search_path и т.п.) в SQLite не нужны
+_SESSION_COMMAND = re.compile(r'^\s*SET\s', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _compile(query, with_params):
+    """Разбирает запрос на куски текста и места параметров: (куски, виды параметров).
+
+    Как и в psycopg2, %s и %% обрабатываются только при переданных параметрах.
+    """
+    pieces = []
+    kinds = []
+    text = []
+    position = 0
+
+    for match in _TOKEN.finditer(query):
+        text.append(query[position:match.start()])
+        position = match.end()
+        kind = match.lastgroup
+        token = match.group()
+
+        if kind == 'string':
+            text.append(token.replace('%%', '%') if with_params else token)
+        elif kind == 'now':
+            text.append('CURRENT_TIMESTAMP')
+        elif kind == 'escaped':
+            text.append('%' if with_params else token)
+        elif kind == 'cast':
+            pass
+        elif kind == 'lock':
+            pass
+        elif kind == 'func':
+            text.append(_FUNCTIONS[token.lower()])
+        elif not with_params:
+            text.append(token)
+        else:
+            # any/all/ago/param - место параметра
+            pieces.append(''.join(text))
+            text = []
+            kinds.append(kind)
+
+    text.append(query[position:])
+    pieces.append(''.join(text))
+    return tuple(pieces), tuple(kinds)
+
+
+def translate(query, args=None):
+    """Переводит запрос PostgreSQL с параметрами %s в запрос SQLite с параметрами ?.
+
+    = ANY(%s) и <> ALL(%s) раскрываются в IN (...) / NOT IN (...) по длине списка,
+    now() - make_interval(secs => %s) и now() - %s * INTERVAL '1 second' - в datetime(),
+    приведения типов (::text) и FOR UPDATE [SKIP LOCKED] отбрасываются.
+    Возвращает (запрос, список параметров).
+    """
+    pieces, kinds = _compile(query, args is not None)
+    if not kinds:
+        return pieces[0], []
+    if len(args) != len(kinds):
+        raise IndexError(f'Ожидалось параметров: {len(kinds)}, передано: {len(args)}')
+
+    parts = [pieces[0]]
+    params = []
+    for kind, value, piece in zip(kinds, args, pieces[1:]):
+        if kind in ('any', 'all'):
+            values = list(value)
+            placeholders = ', '.join('?' * len(values))
+            parts.append(f"{'NOT ' if kind == 'all' else ''}IN ({placeholders})")
+            params.extend(values)
+        elif kind == 'ago':
+            parts.append("datetime('now', '-' || ? || ' seconds')")
+            params.append(value)
+        else:
+            parts.append('?')
+            params.append(value)
+        parts.append(piece)
+    return ''.join(parts), params
+
+
+def _convert_value(column, value):
+    if isinstance(value, str) and _TEMPORAL_COLUMN.search(column):
+        try:
+            if _ISO_DATE.match(value):
+                return date.fromisoformat(value)
+            if _ISO_DATETIME.match(value):
+                return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _dict_row(cursor, row):
+    return {column[0]: _convert_value(column[0], value) for column, value in zip(cursor.description, row)}
+
+
+def _tuple_row(cursor, row):
+    return tuple(_convert_value(column[0], value) for column, value in zip(cursor.description, row))
+
+
+class SQLiteCursor:
+    """Курсор с интерфейсом psycopg2: строки-словари (или кортежи), параметры %s"""
+
+    def __init__(self, connection, tuple_rows=False, profile=True):
+        self.connection = connection
+        self.profile = profile
+        self._cur = connection.raw.cursor()
+        self._cur.row_factory = _tuple_row if tuple_rows else _dict_row
+        self.itersize = 2000
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def execute(self, query, vars=None, profile_as=None):
+        if _SESSION_COMMAND.match(query):
+            return
+        sql, params = translate(query, None if vars is None else list(vars))
+
+        started = time.perf_counter()
+        try:
+            self._cur.execute(sql, params)
+        finally:
+            on_execute = self.connection.on_execute
+            if self.profile and on_execute is not None:
+                on_execute(self, *(profile_as or (query, vars)), (time.perf_counter() - started) * 1000)
+
+    def executemany(self, query, vars_list):
+        rows = [list(vars) for vars in vars_list]
+        if not rows:
+            return
+        sql, _ = translate(query, rows[0])
+        self._cur.executemany(sql, [translate(query, row)[1] for row in rows])
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cur.fetchmany(size or self.itersize)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteConnection:
+    """Соединение SQLite в режиме WAL с интерфейсом соединения psycopg2.
+
+    on_execute(cursor, query, vars, elapsed_ms) вызывается после каждого запроса
+    курсора по умолчанию (профилирование, см. app.utils.database); служебные курсоры
+    с явным cursor_factory, как и в psycopg2, не профилируются.
+    """
+
+    def __init__(self, path, timeout=30, on_execute=None):
+        self.raw = sqlite3.connect(path, timeout=timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False)
+        self.raw.execute('PRAGMA journal_mode = WAL')
+        self.raw.execute('PRAGMA synchronous = NORMAL')
+        self.raw.execute('PRAGMA foreign_keys = ON')
+        self.on_execute = on_execute
+        self.closed = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        """name (серверный курсор) не нужен: SQLite и так читает строки порциями"""
+        tuple_rows = cursor_factory is not None and not issubclass(cursor_factory, RealDictCursor)
+        return SQLiteCursor(self, tuple_rows=tuple_rows, profile=cursor_factory is None)
+
+    def get_transaction_status(self):
+        """Как в psycopg2: есть ли незавершенная транзакция (SELECT ее в SQLite не начинает)"""
+        return TRANSACTION_STATUS_INTRANS if self.raw.in_transaction else TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+            self.closed = 1
+
+
+class SQLitePool:
+    """Аналог ConnectionPool для SQLite: открыть файл базы дешевле, чем держать соединения"""
+
+    def __init__(self, path, timeout=30, on_execute=None):
+        self.path = path
+        self.timeout = timeout
+        self.on_execute = on_execute
+        self._lock = threading.Lock()
+        self._stats = {'backend': 'sqlite', 'path': path, 'opened': 0, 'in_use': 0}
+
+    def getconn(self):
+        conn = SQLiteConnection(self.path, timeout=self.timeout, on_execute=self.on_execute)
+        with self._lock:
+            self._stats['opened'] += 1
+            self._stats['in_use'] += 1
+        return conn
+
+    def putconn(self, conn):
+        try:
+            # Незавершенная транзакция не должна держать блокировку записи
+            conn.rollback()
+        finally:
+            conn.close()
+            with self._lock:
+                self._stats['in_use'] -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,180 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # без brotli готовим только gzip
+    brotli = None
+
+# Файлы, для которых заранее готовятся сжатые копии
+COMPRESSIBLE = {'.css', '.js', '.svg'}
+
+# Кодировки в порядке предпочтения: (Content-Encoding, суффикс файла)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Имя с отпечатком содержимого: css/style.<12 hex>.css
+FINGERPRINTED = re.compile(r'^(?P<base>.+)\.(?P<fp>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$')
+
+# Загруженные файлы хранятся под хэшем содержимого и никогда не меняются
+UPLOADS_PREFIX = 'uploads/'
+
+# Кэш отпечатков: путь -> (mtime, отпечаток)
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def _static_path(filename):
+    path = safe_join(current_app.static_folder, filename)
+    if path is None:
+        raise NotFound()
+    return path
+
+
+def fingerprint(filename):
+    """Короткий SHA-256 содержимого статического файла (кэшируется по времени изменения)"""
+    path = _static_path(filename)
+    mtime = os.path.getmtime(path)
+
+    with _fingerprints_lock:
+        cached = _fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        value = hashlib.sha256(f.read()).hexdigest()[:12]
+
+    with _fingerprints_lock:
+        _fingerprints[filename] = (mtime, value)
+    return value
+
+
+def asset_url(filename):
+    """URL ресурса с отпечатком в имени файла, чтобы его можно было кэшировать навсегда"""
+    try:
+        value = fingerprint(filename)
+    except OSError:
+        return url_for('static', filename=filename)
+    base, ext = os.path.splitext(filename)
+    return url_for('static', filename=f"{base}.{value}{ext}")
+
+
+def send_static(filename):
+    """Отдача статики вместо стандартного обработчика Flask.
+
+    Загрузки и ресурсы с отпечатком отдаются с Cache-Control: immutable
+    и сильным ETag по содержимому; для текстовых ресурсов отдается
+    заранее сжатая копия (.br/.gz), если клиент ее принимает.
+    """
+    immutable = False
+    etag = True
+
+    match = FINGERPRINTED.match(filename)
+    if match and not os.path.isfile(_static_path(filename)):
+        filename = match['base'] + match['ext']
+        try:
+            current = fingerprint(filename)
+        except OSError:
+            raise NotFound()
+        # Устаревший отпечаток (страница из кэша) - отдаем текущий файл без долгого кэширования
+        immutable = match['fp'] == current
+        etag = current
+    elif filename.startswith(UPLOADS_PREFIX):
+        immutable = True
+        # Имя файла (и превью) - хэш содержимого
+        etag = os.path.splitext(os.path.basename(filename))[0]
+
+    served = filename
+    encoding = None
+    compressible = os.path.splitext(filename)[1] in COMPRESSIBLE
+    if compressible:
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(_static_path(filename + suffix)):
+                served, encoding = filename + suffix, name
+                break
+
+    if encoding and isinstance(etag, str):
+        etag = f"{etag}-{encoding}"
+
+    if immutable:
+        max_age = current_app.config.get('STATIC_IMMUTABLE_MAX_AGE', 31536000)
+    else:
+        max_age = current_app.get_send_file_max_age(filename)
+
+    response = send_from_directory(
+        current_app.static_folder,
+        served,
+        etag=etag,
+        mimetype=mimetypes.guess_type(filename)[0] if encoding else None,
+        download_name=os.path.basename(filename),
+        max_age=max_age,
+    )
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+def _compress(path, suffix, data):
+    target = path + suffix
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return False
+
+    if suffix == '.gz':
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    else:
+        compressed = brotli.compress(data, quality=11)
+
+    # Сжатая копия не нужна, если она не меньше оригинала
+    if len(compressed) >= len(data):
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+
+    with open(target + '.tmp', 'wb') as f:
+        f.write(compressed)
+    os.replace(target + '.tmp', target)
+    return True
+
+
+def precompress_assets(static_folder):
+    """Готовит .gz и .br копии текстовых ресурсов (кроме загрузок), если они устарели"""
+    suffixes = ['.gz'] + (['.br'] if brotli is not None else [])
+    created = 0
+
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d != 'uploads']
+
+        for name in files:
+            if os.path.splitext(name)[1] not in COMPRESSIBLE:
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            for suffix in suffixes:
+                created += _compress(path, suffix, data)
+
+    return created
+
+
+def init_static_assets(app):
+    """Подключает отдачу статики с долгим кэшированием и функцию asset_url в шаблонах"""
+    app.view_functions['static'] = send_static
+    app.jinja_env.globals['asset_url'] = asset_url
+
+    if app.config.get('PRECOMPRESS_STATIC', True):
+        try:
+            precompress_assets(app.static_folder)
+        except OSError as e:
+            print(f"Не удалось подготовить сжатые копии статики: {e}")
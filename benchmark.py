@@ -0,0 +1,461 @@
+import os
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сценарии нагрузки: (метка, метод, путь, вес). Поля в фигурных скобках
+# подставляются из пулов идентификаторов (см. ID_POOLS).
+USER_WORKLOAD = [
+    ('user.dashboard', 'GET', '/user/dashboard', 5),
+    ('user.my_requests', 'GET', '/user/requests', 3),
+    ('user.tickets', 'GET', '/user/tickets', 3),
+]
+
+ADMIN_WORKLOAD = [
+    ('admin.requests', 'GET', '/admin/requests', 3),
+    ('admin.requests[approved]', 'GET', '/admin/requests?status=approved', 1),
+    ('admin.tickets', 'GET', '/admin/tickets', 3),
+    ('admin.tickets[overdue]', 'GET', '/admin/tickets?status=defaulted', 1),
+    ('admin.reports', 'GET', '/admin/reports', 1),
+    ('admin.audit_logs', 'GET', '/admin/audit-logs', 2),
+    ('admin.request_detail', 'GET', '/admin/request/{request_id}', 2),
+    ('admin.approve_request', 'POST', '/admin/request/{submitted_request_id}/approve', 1),
+    ('admin.redeem_ticket', 'POST', '/admin/ticket/{issued_ticket_id}/redeem', 1),
+]
+
+# Пулы идентификаторов для сценариев: имя -> (запрос, расходуется ли идентификатор).
+# Одобрить заявку и выкупить талон можно один раз, поэтому такие идентификаторы не повторяются.
+ID_POOLS = {
+    'request_id': ('''
+        SELECT r.request_id AS id FROM requests r
+        WHERE r.branch_id IN (SELECT branch_id FROM user_branches WHERE user_id = %s)
+        ORDER BY r.request_id DESC LIMIT %s
+    ''', False),
+    'submitted_request_id': ('''
+        SELECT r.request_id AS id FROM requests r
+        WHERE r.status = 'submitted'
+          AND r.branch_id IN (SELECT branch_id FROM user_branches WHERE user_id = %s)
+        ORDER BY r.request_id LIMIT %s
+    ''', True),
+    'issued_ticket_id': ('''
+        SELECT pt.ticket_id AS id FROM pawn_tickets pt
+        WHERE pt.status = 'issued'
+          AND pt.branch_id IN (SELECT branch_id FROM user_branches WHERE user_id = %s)
+        ORDER BY pt.ticket_id LIMIT %s
+    ''', True),
+}
+
+WRITE_LABELS = {'admin.approve_request', 'admin.redeem_ticket'}
+
+SERVER_TIMING = re.compile(r'db;dur=(?P<db>[\d.]+);desc="(?P<queries>\d+) queries", app;dur=(?P<app>[\d.]+)')
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Редиректы не выполняются: замеряется только сам запрос (например, POST одобрения)"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class BenchClient:
+    """HTTP-клиент одного виртуального пользователя со своей сессией"""
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        """Возвращает (статус, заголовки, тело, время в мс)"""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                content = response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            content = e.read()
+            status, headers = e.code, e.headers
+        return status, headers, content, (time.perf_counter() - started) * 1000
+
+    def login(self, email, password):
+        _, _, content, _ = self.request('GET', '/auth/login')
+        match = CSRF_TOKEN.search(content.decode('utf-8', 'replace'))
+        form = {'email': email, 'password': password}
+        if match:
+            form['csrf_token'] = match.group(1)
+        status, _, _, _ = self.request('POST', '/auth/login', form)
+        # При успешном входе - редирект на главную
+        return status in (301, 302, 303)
+
+
+class IdPool:
+    """Потокобезопасный источник идентификаторов для подстановки в пути"""
+
+    def __init__(self, ids, consumable, rng):
+        self.ids = list(ids)
+        self.consumable = consumable
+        self.rng = rng
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if not self.ids:
+                return None
+            if self.consumable:
+                return self.ids.pop()
+            return self.rng.choice(self.ids)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 2)
+
+
+class Worker(threading.Thread):
+    """Виртуальный пользователь: входит в систему и выполняет шаги сценария по весам"""
+
+    def __init__(self, name, base_url, email, password, workload, pools, seed, deadline, samples):
+        super().__init__(name=name, daemon=True)
+        self.client = BenchClient(base_url)
+        self.email = email
+        self.password = password
+        self.workload = workload
+        self.pools = pools
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.samples = samples
+        self.error = None
+
+    def _pick(self):
+        total = sum(weight for *_, weight in self.workload)
+        roll = self.rng.uniform(0, total)
+        for step in self.workload:
+            roll -= step[3]
+            if roll <= 0:
+                return step
+        return self.workload[-1]
+
+    def _resolve(self, path):
+        """Подставляет идентификаторы из пулов; None, если они закончились"""
+        values = {}
+        for name in re.findall(r'\{(\w+)\}', path):
+            pool = self.pools.get(name)
+            values[name] = pool.take() if pool else None
+            if values[name] is None:
+                return None
+        return path.format(**values)
+
+    def run(self):
+        if not self.client.login(self.email, self.password):
+            self.error = f"не удалось войти как {self.email}"
+            return
+
+        while time.monotonic() < self.deadline:
+            label, method, path, _ = self._pick()
+            url = self._resolve(path)
+            if url is None:
+                # Идентификаторы для шага закончились - он больше не выбирается
+                self.workload = [step for step in self.workload if step[0] != label]
+                if not self.workload:
+                    return
+                continue
+
+            status, headers, _, elapsed = self.client.request(method, url, {} if method == 'POST' else None)
+            timing = SERVER_TIMING.search(headers.get('Server-Timing', ''))
+            self.samples.append({
+                'label': label,
+                'at': time.monotonic(),
+                'ok': status < 400,
+                'ms': elapsed,
+                'db_ms': float(timing['db']) if timing else None,
+                'app_ms': float(timing['app']) if timing else None,
+                'queries': int(timing['queries']) if timing else None,
+            })
+
+
+def summarize(samples, duration):
+    """Сводка по меткам: пропускная способность, перцентили задержки, запросы к БД на запрос"""
+    by_label = {}
+    for sample in samples:
+        by_label.setdefault(sample['label'], []).append(sample)
+
+    summary = {}
+    for label in sorted(by_label):
+        rows = by_label[label]
+        latencies = [row['ms'] for row in rows]
+        queries = [row['queries'] for row in rows if row['queries'] is not None]
+        db_ms = [row['db_ms'] for row in rows if row['db_ms'] is not None]
+        summary[label] = {
+            'count': len(rows),
+            'errors': sum(1 for row in rows if not row['ok']),
+            'rps': round(len(rows) / duration, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': round(max(latencies), 2),
+            },
+            'queries': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            } if queries else None,
+            'db_ms': {
+                'p50': percentile(db_ms, 50),
+                'p95': percentile(db_ms, 95),
+            } if db_ms else None,
+        }
+    return summary
+
+
+def compare(current, baseline, threshold):
+    """Сравнение с базовым прогоном: изменение p50/p95 в процентах и числа запросов к БД.
+
+    Регрессия - рост p95 больше чем на threshold процентов (и больше чем на 1 мс)
+    или рост среднего числа запросов к БД больше чем на 0.5.
+    """
+    report = {}
+    regressions = []
+    for label, stats in current.items():
+        base = baseline.get(label)
+        if not base:
+            continue
+        row = {}
+        for pct in ('p50', 'p95'):
+            was, now = base['latency_ms'][pct], stats['latency_ms'][pct]
+            row[pct] = round((now - was) / was * 100, 1) if was else None
+        was_p95, now_p95 = base['latency_ms']['p95'], stats['latency_ms']['p95']
+        if was_p95 and now_p95 - was_p95 > max(1.0, was_p95 * threshold / 100):
+            regressions.append(f"{label}: p95 {was_p95} -> {now_p95} мс")
+
+        if stats.get('queries') and base.get('queries'):
+            row['queries'] = round(stats['queries']['mean'] - base['queries']['mean'], 2)
+            if row['queries'] > 0.5:
+                regressions.append(f"{label}: запросов к БД {base['queries']['mean']} -> {stats['queries']['mean']}")
+        report[label] = row
+    return report, regressions
+
+
+def print_report(summary, comparison=None):
+    header = f"{'эндпоинт':<28}{'n':>7}{'ош.':>5}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'запр.':>7}{'БД p50':>9}"
+    if comparison is not None:
+        header += f"{'Δp50%':>8}{'Δp95%':>8}{'Δзапр.':>8}"
+    print(header)
+    print('-' * len(header))
+
+    for label, stats in summary.items():
+        latency = stats['latency_ms']
+        queries = stats['queries']['mean'] if stats['queries'] else '-'
+        db_p50 = stats['db_ms']['p50'] if stats['db_ms'] else '-'
+        line = (f"{label:<28}{stats['count']:>7}{stats['errors']:>5}{stats['rps']:>8}"
+                f"{latency['p50']:>9}{latency['p95']:>9}{latency['p99']:>9}{queries:>7}{db_p50:>9}")
+        if comparison is not None:
+            delta = comparison.get(label, {})
+            line += ''.join(f"{'-' if delta.get(key) is None else delta[key]:>8}"
+                            for key in ('p50', 'p95', 'queries'))
+        print(line)
+
+
+def load_id_pools(app, admin_email, size, rng):
+    """Идентификаторы заявок и талонов из филиалов администратора"""
+    from app.utils.database import query_db
+
+    with app.app_context():
+        admin = query_db('SELECT user_id FROM users WHERE email = %s', [admin_email], one=True)
+        if not admin:
+            return {}
+        pools = {}
+        for name, (query, consumable) in ID_POOLS.items():
+            rows = query_db(query, [admin['user_id'], size])
+            pools[name] = IdPool([row['id'] for row in rows], consumable, rng)
+        return pools
+
+
+def load_client_emails(app, count):
+    """Клиенты с наибольшим числом заявок (самые тяжелые кабинеты)"""
+    from app.utils.database import query_db
+
+    with app.app_context():
+        rows = query_db('''
+            SELECT u.email FROM users u
+            JOIN roles ro ON ro.role_id = u.role_id AND ro.role_name = 'user'
+            WHERE u.is_active = true
+            ORDER BY (SELECT COUNT(*) FROM requests r WHERE r.user_id = u.user_id) DESC, u.user_id
+            LIMIT %s
+        ''', [count])
+    return [row['email'] for row in rows]
+
+
+def start_server(app):
+    """Запускает приложение в многопоточном сервере werkzeug на свободном порту"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_benchmark(options):
+    # Пул соединений создается при импорте конфигурации - он должен вместить все потоки
+    os.environ.setdefault('DB_POOL_MAX', str(options.clients + options.admins + 2))
+    from app import create_app
+    from app.utils.database import get_endpoint_stats, reset_endpoint_stats
+
+    app = create_app(options.config)
+    app.config['QUERY_PROFILING'] = True
+    app.config['SERVER_TIMING'] = 'all'
+
+    if options.populate:
+        from populate_test_data import parse_args as populate_args, populate_bulk_data
+        populate_bulk_data(populate_args([
+            '--bulk', '--requests', str(options.populate), '--users', str(max(100, options.populate // 10)),
+            '--seed', str(options.seed),
+        ]))
+
+    rng = random.Random(options.seed)
+    admin_emails = options.admin_email
+    client_emails = load_client_emails(app, options.clients)
+    if options.clients and not client_emails:
+        print("В базе нет клиентов, запустите populate_test_data.py")
+        return 1
+
+    pools = load_id_pools(app, admin_emails[0], options.pool_size, rng)
+    admin_workload = ADMIN_WORKLOAD
+    if options.read_only:
+        admin_workload = [step for step in ADMIN_WORKLOAD if step[0] not in WRITE_LABELS]
+
+    server = None
+    base_url = options.url
+    if not base_url:
+        server, base_url = start_server(app)
+    reset_endpoint_stats()
+
+    samples = []
+    started = time.monotonic()
+    deadline = started + options.warmup + options.duration
+    workers = []
+    for index in range(options.clients):
+        workers.append(Worker(f"client-{index}", base_url, client_emails[index % len(client_emails)],
+                              options.password, USER_WORKLOAD, pools, options.seed + index, deadline, samples))
+    for index in range(options.admins):
+        workers.append(Worker(f"admin-{index}", base_url, admin_emails[index % len(admin_emails)],
+                              options.password, admin_workload, pools, options.seed + 1000 + index,
+                              deadline, samples))
+
+    print(f"Нагрузка на {base_url}: {options.clients} клиентов, {options.admins} администраторов, "
+          f"прогрев {options.warmup} с, замер {options.duration} с")
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for worker in workers:
+        if worker.error:
+            print(f"{worker.name}: {worker.error}")
+
+    if server is not None:
+        server.shutdown()
+
+    # Запросы периода прогрева в замер не входят
+    measured = [sample for sample in samples if sample['at'] >= started + options.warmup]
+    summary = summarize(measured, options.duration)
+    result = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'url': options.url or 'in-process',
+            'config': options.config,
+            'clients': options.clients,
+            'admins': options.admins,
+            'duration': options.duration,
+            'warmup': options.warmup,
+            'seed': options.seed,
+            'read_only': options.read_only,
+        },
+        'endpoints': summary,
+    }
+    if server is not None:
+        # Сводка самого приложения (перцентили времени в БД и числа запросов по эндпоинтам)
+        result['server'] = get_endpoint_stats()
+
+    comparison = regressions = None
+    if options.baseline and os.path.exists(options.baseline):
+        with open(options.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparison, regressions = compare(summary, baseline['endpoints'], options.threshold)
+        result['comparison'] = comparison
+
+    print()
+    print_report(summary, comparison)
+
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {options.output}")
+    if options.save_baseline:
+        with open(options.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Базовый прогон сохранен в {options.save_baseline}")
+
+    if regressions:
+        print("\nРегрессии относительно базового прогона:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1 if options.fail_on_regression else 0
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон маршрутов приложения')
+    parser.add_argument('--url', help='адрес уже запущенного приложения (по умолчанию приложение '
+                                      'запускается в этом процессе)')
+    parser.add_argument('--config', default='default', help='конфигурация приложения')
+    parser.add_argument('--clients', type=int, default=8, help='одновременных клиентов')
+    parser.add_argument('--admins', type=int, default=2, help='одновременных администраторов')
+    parser.add_argument('--duration', type=float, default=30, help='длительность замера, с')
+    parser.add_argument('--warmup', type=float, default=5, help='прогрев перед замером, с')
+    parser.add_argument('--seed', type=int, default=42, help='зерно выбора шагов сценария')
+    parser.add_argument('--admin-email', action='append',
+                        help='администратор для сценария (можно несколько), по умолчанию admin@lombard.by')
+    parser.add_argument('--password', default='123456', help='пароль тестовых аккаунтов')
+    parser.add_argument('--pool-size', type=int, default=5000,
+                        help='сколько идентификаторов заявок и талонов подготовить для сценариев')
+    parser.add_argument('--read-only', action='store_true', help='без одобрения заявок и выкупа талонов')
+    parser.add_argument('--populate', type=int, metavar='REQUESTS',
+                        help='перед прогоном добавить столько заявок генератором populate_test_data.py --bulk')
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='JSON базового прогона для сравнения')
+    parser.add_argument('--save-baseline', help='сохранить результаты как базовый прогон')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='допустимый рост p95 относительно базового прогона, %%')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='код возврата 1 при регрессиях (для CI)')
+    options = parser.parse_args(argv)
+    if not options.admin_email:
+        options.admin_email = ['admin@lombard.by']
+    if options.clients < 0 or options.admins < 0 or options.clients + options.admins == 0:
+        parser.error('нужен хотя бы один клиент или администратор')
+    return options
+
+
+if __name__ == '__main__':
+    raise SystemExit(run_benchmark(parse_args()))
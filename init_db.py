@@ -1,9 +1,373 @@
 import os
+import sqlite3
 import psycopg2
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Помесячное секционирование audit_logs по action_time (только для новой таблицы)
+AUDIT_PARTITIONING = os.getenv('AUDIT_PARTITIONING', 'False').lower() == 'true'
+# На сколько месяцев вперед создавать секции
+AUDIT_PARTITION_MONTHS_AHEAD = int(os.getenv('AUDIT_PARTITION_MONTHS_AHEAD', '3'))
+
+AUDIT_LOGS_DDL = """
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            log_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+            user_id BIGINT, -- nullable для system actions
+            action_key VARCHAR(100) NOT NULL,
+            action_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            ip_address INET,
+            user_agent TEXT,
+            payload JSONB,
+            CONSTRAINT fk_audit_user FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
+        );
+"""
+
+# Ключ секционирования должен входить в первичный ключ
+AUDIT_LOGS_PARTITIONED_DDL = """
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            log_id BIGINT GENERATED ALWAYS AS IDENTITY,
+            user_id BIGINT, -- nullable для system actions
+            action_key VARCHAR(100) NOT NULL,
+            action_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            ip_address INET,
+            user_agent TEXT,
+            payload JSONB,
+            CONSTRAINT pk_audit_logs PRIMARY KEY (log_id, action_time),
+            CONSTRAINT fk_audit_user FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
+        ) PARTITION BY RANGE (action_time);
+        
+        -- Секция для строк вне созданных диапазонов, чтобы вставка не падала
+        CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT;
+"""
+
+
+# Схема встроенной базы (DB_TYPE=sqlite): те же таблицы и индексы, счетчики
+# branch_stats и attachment_blobs ведутся триггерами SQLite. Уведомлений
+# (LISTEN/NOTIFY) и секций audit_logs нет - кэши приложения живут по TTL.
+# Типы DATE, TIMESTAMP, NUMERIC, BOOLEAN и JSONB распознает app.utils.sqlite_backend.
+SQLITE_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS roles (
+            role_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            role_name VARCHAR(50) NOT NULL UNIQUE,
+            description TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS branches (
+            branch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(150) NOT NULL UNIQUE,
+            address TEXT,
+            phone VARCHAR(30),
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email VARCHAR(255) NOT NULL UNIQUE,
+            password_hash VARCHAR(255) NOT NULL,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            phone VARCHAR(30),
+            role_id INTEGER NOT NULL REFERENCES roles(role_id) ON DELETE RESTRICT,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS item_categories (
+            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(120) NOT NULL UNIQUE,
+            description TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS requests (
+            request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_number VARCHAR(60) NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            branch_id INTEGER NOT NULL REFERENCES branches(branch_id) ON DELETE RESTRICT,
+            category_id INTEGER NOT NULL REFERENCES item_categories(category_id) ON DELETE RESTRICT,
+            item_name VARCHAR(200) NOT NULL,
+            item_description TEXT,
+            estimated_cost NUMERIC(12,2) NOT NULL CHECK (estimated_cost >= 0),
+            status VARCHAR(50) NOT NULL DEFAULT 'submitted',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            branch_id INTEGER REFERENCES branches(branch_id) ON DELETE SET NULL,
+            category_id INTEGER NOT NULL REFERENCES item_categories(category_id) ON DELETE RESTRICT,
+            name VARCHAR(200) NOT NULL,
+            description TEXT,
+            estimated_cost NUMERIC(12,2) NOT NULL CHECK (estimated_cost >= 0),
+            declared_characteristics JSONB,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS tariffs (
+            tariff_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(150) NOT NULL,
+            category_id INTEGER REFERENCES item_categories(category_id) ON DELETE SET NULL,
+            branch_id INTEGER REFERENCES branches(branch_id) ON DELETE SET NULL,
+            loan_percent NUMERIC(6,3) NOT NULL CHECK (loan_percent >= 0 AND loan_percent <= 100),
+            interest_rate NUMERIC(6,3) NOT NULL CHECK (interest_rate >= 0),
+            min_loan NUMERIC(12,2) DEFAULT 0,
+            max_loan NUMERIC(12,2),
+            effective_from DATE NOT NULL,
+            effective_to DATE,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE,
+            description TEXT,
+            CHECK (effective_to IS NULL OR effective_to > effective_from)
+        );
+
+        CREATE TABLE IF NOT EXISTS pawn_tickets (
+            ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_number VARCHAR(60) NOT NULL UNIQUE,
+            request_id INTEGER REFERENCES requests(request_id) ON DELETE RESTRICT,
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE RESTRICT,
+            item_id INTEGER NOT NULL REFERENCES items(item_id) ON DELETE RESTRICT,
+            branch_id INTEGER NOT NULL REFERENCES branches(branch_id) ON DELETE RESTRICT,
+            admission_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            loan_amount NUMERIC(12,2) NOT NULL CHECK (loan_amount >= 0),
+            ransom_amount NUMERIC(12,2) NOT NULL CHECK (ransom_amount >= 0),
+            tariff_id INTEGER NOT NULL REFERENCES tariffs(tariff_id) ON DELETE RESTRICT,
+            status VARCHAR(50) NOT NULL,
+            created_by INTEGER REFERENCES users(user_id) ON DELETE SET NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL REFERENCES pawn_tickets(ticket_id) ON DELETE CASCADE,
+            amount NUMERIC(12,2) NOT NULL CHECK (amount >= 0),
+            payment_type VARCHAR(50) NOT NULL,
+            payment_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            processed_by INTEGER REFERENCES users(user_id) ON DELETE SET NULL,
+            note TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS attachments (
+            attachment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER REFERENCES items(item_id) ON DELETE CASCADE,
+            request_id INTEGER REFERENCES requests(request_id) ON DELETE CASCADE,
+            ticket_id INTEGER REFERENCES pawn_tickets(ticket_id) ON DELETE CASCADE,
+            file_path TEXT NOT NULL,
+            file_name VARCHAR(255) NOT NULL,
+            mime_type VARCHAR(100),
+            content_hash CHAR(64),
+            file_size INTEGER,
+            uploaded_by INTEGER REFERENCES users(user_id) ON DELETE SET NULL,
+            uploaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            CHECK (
+                (CASE WHEN item_id IS NOT NULL THEN 1 ELSE 0 END)
+                + (CASE WHEN request_id IS NOT NULL THEN 1 ELSE 0 END)
+                + (CASE WHEN ticket_id IS NOT NULL THEN 1 ELSE 0 END)
+                = 1
+            )
+        );
+
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(user_id) ON DELETE SET NULL,
+            action_key VARCHAR(100) NOT NULL,
+            action_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            ip_address TEXT,
+            user_agent TEXT,
+            payload JSONB
+        );
+
+        CREATE TABLE IF NOT EXISTS user_branches (
+            user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            branch_id INTEGER NOT NULL REFERENCES branches(branch_id) ON DELETE CASCADE,
+            is_primary BOOLEAN NOT NULL DEFAULT FALSE,
+            assigned_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, branch_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task_key VARCHAR(100) PRIMARY KEY,
+            last_run_at TIMESTAMP NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS branch_stats (
+            branch_id INTEGER NOT NULL REFERENCES branches(branch_id) ON DELETE CASCADE,
+            entity VARCHAR(20) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            loan_total NUMERIC(14,2) NOT NULL DEFAULT 0,
+            ransom_total NUMERIC(14,2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (branch_id, entity, status)
+        );
+
+        CREATE TABLE IF NOT EXISTS attachment_blobs (
+            file_path TEXT PRIMARY KEY,
+            content_hash CHAR(64),
+            file_size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            released_at TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER NOT NULL REFERENCES requests(request_id) ON DELETE CASCADE,
+            uploaded_by INTEGER REFERENCES users(user_id) ON DELETE SET NULL,
+            subfolder VARCHAR(50) NOT NULL,
+            staged_name VARCHAR(255) NOT NULL,
+            file_name VARCHAR(255) NOT NULL,
+            mime_type VARCHAR(100),
+            file_size INTEGER,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending'
+                CHECK (status IN ('pending', 'processing', 'done', 'failed', 'rejected')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP,
+            last_error TEXT,
+            attachment_id INTEGER REFERENCES attachments(attachment_id) ON DELETE SET NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+
+        -- ================= Индексы =================
+        CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
+        CREATE INDEX IF NOT EXISTS idx_requests_user ON requests(user_id);
+        CREATE INDEX IF NOT EXISTS idx_requests_branch ON requests(branch_id);
+        CREATE INDEX IF NOT EXISTS idx_items_owner ON items(owner_user_id);
+        CREATE INDEX IF NOT EXISTS idx_tickets_status ON pawn_tickets(status);
+        CREATE INDEX IF NOT EXISTS idx_tickets_user ON pawn_tickets(user_id);
+        CREATE INDEX IF NOT EXISTS idx_tickets_issued_end ON pawn_tickets(end_date) WHERE status = 'issued';
+        CREATE INDEX IF NOT EXISTS idx_requests_user_created ON requests(user_id, created_at, request_id);
+        CREATE INDEX IF NOT EXISTS idx_tickets_user_created ON pawn_tickets(user_id, created_at, ticket_id);
+        CREATE INDEX IF NOT EXISTS idx_payments_ticket ON payments(ticket_id);
+        CREATE INDEX IF NOT EXISTS idx_attachments_request ON attachments(request_id);
+        CREATE INDEX IF NOT EXISTS idx_upload_jobs_open ON upload_jobs(job_id) WHERE status IN ('pending', 'processing');
+        CREATE INDEX IF NOT EXISTS idx_upload_jobs_request ON upload_jobs(request_id);
+        CREATE INDEX IF NOT EXISTS idx_attachment_blobs_released ON attachment_blobs(released_at) WHERE ref_count <= 0;
+        CREATE INDEX IF NOT EXISTS idx_audit_time_id ON audit_logs(action_time, log_id);
+        CREATE INDEX IF NOT EXISTS idx_audit_action_time ON audit_logs(action_key, action_time, log_id);
+        CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_logs(user_id);
+        CREATE INDEX IF NOT EXISTS idx_tariffs_active ON tariffs(is_active, effective_from, effective_to);
+        CREATE INDEX IF NOT EXISTS idx_tariffs_category_branch ON tariffs(category_id, branch_id);
+
+        -- ================ Триггеры для updated_at =================
+        -- Рекурсивные триггеры в SQLite выключены, вложенный UPDATE их не запускает
+        CREATE TRIGGER IF NOT EXISTS trg_users_updated_at AFTER UPDATE ON users
+        BEGIN
+            UPDATE users SET updated_at = CURRENT_TIMESTAMP WHERE user_id = NEW.user_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_requests_updated_at AFTER UPDATE ON requests
+        BEGIN
+            UPDATE requests SET updated_at = CURRENT_TIMESTAMP WHERE request_id = NEW.request_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_updated_at AFTER UPDATE ON pawn_tickets
+        BEGIN
+            UPDATE pawn_tickets SET updated_at = CURRENT_TIMESTAMP WHERE ticket_id = NEW.ticket_id;
+        END;
+
+        -- ================ Статистика по филиалам =================
+        CREATE TRIGGER IF NOT EXISTS trg_requests_branch_stats_insert AFTER INSERT ON requests
+        BEGIN
+            INSERT INTO branch_stats (branch_id, entity, status, item_count)
+            VALUES (NEW.branch_id, 'request', NEW.status, 1)
+            ON CONFLICT (branch_id, entity, status) DO UPDATE SET item_count = item_count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_requests_branch_stats_update AFTER UPDATE OF branch_id, status ON requests
+        WHEN OLD.branch_id IS NOT NEW.branch_id OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE branch_stats SET item_count = item_count - 1
+            WHERE branch_id = OLD.branch_id AND entity = 'request' AND status = OLD.status;
+            INSERT INTO branch_stats (branch_id, entity, status, item_count)
+            VALUES (NEW.branch_id, 'request', NEW.status, 1)
+            ON CONFLICT (branch_id, entity, status) DO UPDATE SET item_count = item_count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_requests_branch_stats_delete AFTER DELETE ON requests
+        BEGIN
+            UPDATE branch_stats SET item_count = item_count - 1
+            WHERE branch_id = OLD.branch_id AND entity = 'request' AND status = OLD.status;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_branch_stats_insert AFTER INSERT ON pawn_tickets
+        BEGIN
+            INSERT INTO branch_stats (branch_id, entity, status, item_count, loan_total, ransom_total)
+            VALUES (NEW.branch_id, 'ticket', NEW.status, 1, NEW.loan_amount, NEW.ransom_amount)
+            ON CONFLICT (branch_id, entity, status) DO UPDATE
+            SET item_count = item_count + 1,
+                loan_total = loan_total + excluded.loan_total,
+                ransom_total = ransom_total + excluded.ransom_total;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_branch_stats_update
+        AFTER UPDATE OF branch_id, status, loan_amount, ransom_amount ON pawn_tickets
+        WHEN OLD.branch_id IS NOT NEW.branch_id OR OLD.status IS NOT NEW.status
+          OR OLD.loan_amount IS NOT NEW.loan_amount OR OLD.ransom_amount IS NOT NEW.ransom_amount
+        BEGIN
+            UPDATE branch_stats
+            SET item_count = item_count - 1,
+                loan_total = loan_total - OLD.loan_amount,
+                ransom_total = ransom_total - OLD.ransom_amount
+            WHERE branch_id = OLD.branch_id AND entity = 'ticket' AND status = OLD.status;
+            INSERT INTO branch_stats (branch_id, entity, status, item_count, loan_total, ransom_total)
+            VALUES (NEW.branch_id, 'ticket', NEW.status, 1, NEW.loan_amount, NEW.ransom_amount)
+            ON CONFLICT (branch_id, entity, status) DO UPDATE
+            SET item_count = item_count + 1,
+                loan_total = loan_total + excluded.loan_total,
+                ransom_total = ransom_total + excluded.ransom_total;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_branch_stats_delete AFTER DELETE ON pawn_tickets
+        BEGIN
+            UPDATE branch_stats
+            SET item_count = item_count - 1,
+                loan_total = loan_total - OLD.loan_amount,
+                ransom_total = ransom_total - OLD.ransom_amount
+            WHERE branch_id = OLD.branch_id AND entity = 'ticket' AND status = OLD.status;
+        END;
+
+        -- Полный пересчет (при первой установке и для сверки)
+        DELETE FROM branch_stats;
+        INSERT INTO branch_stats (branch_id, entity, status, item_count, loan_total, ransom_total)
+        SELECT branch_id, 'request', status, COUNT(*), 0, 0
+        FROM requests GROUP BY branch_id, status
+        UNION ALL
+        SELECT branch_id, 'ticket', status, COUNT(*),
+               COALESCE(SUM(loan_amount), 0), COALESCE(SUM(ransom_amount), 0)
+        FROM pawn_tickets GROUP BY branch_id, status;
+
+        -- ================ Счетчики ссылок на файлы вложений =================
+        CREATE TRIGGER IF NOT EXISTS trg_attachment_blob_refs_insert AFTER INSERT ON attachments
+        BEGIN
+            INSERT INTO attachment_blobs (file_path, content_hash, file_size, ref_count)
+            VALUES (NEW.file_path, NEW.content_hash, NEW.file_size, 1)
+            ON CONFLICT (file_path) DO UPDATE
+            SET ref_count = ref_count + 1,
+                content_hash = COALESCE(content_hash, excluded.content_hash),
+                file_size = COALESCE(file_size, excluded.file_size),
+                released_at = NULL;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_attachment_blob_refs_delete AFTER DELETE ON attachments
+        BEGIN
+            UPDATE attachment_blobs
+            SET ref_count = ref_count - 1,
+                released_at = CASE WHEN ref_count <= 1 THEN CURRENT_TIMESTAMP END
+            WHERE file_path = OLD.file_path;
+        END;
+
+        -- Сверка счетчиков с вложениями
+        INSERT INTO attachment_blobs (file_path, content_hash, file_size, ref_count)
+        SELECT file_path, MAX(content_hash), MAX(file_size), COUNT(*)
+        FROM attachments WHERE true GROUP BY file_path
+        ON CONFLICT (file_path) DO UPDATE
+        SET ref_count = excluded.ref_count, released_at = NULL;
+"""
+
 
 def init_database():
     """Создает все таблицы в базе данных"""
@@ -173,6 +537,8 @@ def init_database():
             file_path TEXT NOT NULL,
             file_name VARCHAR(255) NOT NULL,
             mime_type VARCHAR(100),
+            content_hash CHAR(64), -- SHA-256 содержимого, файл хранится как <sha256>.<ext>
+            file_size BIGINT,
             uploaded_by BIGINT,
             uploaded_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
             CONSTRAINT fk_attach_item FOREIGN KEY (item_id) REFERENCES items(item_id) ON DELETE CASCADE,
@@ -187,17 +553,11 @@ def init_database():
             )
         );
         
+        ALTER TABLE attachments ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+        ALTER TABLE attachments ADD COLUMN IF NOT EXISTS file_size BIGINT;
+        
         -- 11. audit_logs
-        CREATE TABLE IF NOT EXISTS audit_logs (
-            log_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-            user_id BIGINT, -- nullable для system actions
-            action_key VARCHAR(100) NOT NULL,
-            action_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
-            ip_address INET,
-            user_agent TEXT,
-            payload JSONB,
-            CONSTRAINT fk_audit_user FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
-        );
+        -- {AUDIT_LOGS_DDL}
         
         -- 12. user_branches (новая таблица для связи админов с филиалами)
         CREATE TABLE IF NOT EXISTS user_branches (
@@ -210,6 +570,58 @@ def init_database():
             CONSTRAINT fk_ub_branch FOREIGN KEY (branch_id) REFERENCES branches(branch_id) ON DELETE CASCADE
         );
         
+        -- 13. maintenance_runs (отметки о последнем запуске фоновых задач)
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task_key VARCHAR(100) PRIMARY KEY,
+            last_run_at TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+        
+        -- 14. branch_stats (сводная статистика по филиалам, ведется триггерами)
+        CREATE TABLE IF NOT EXISTS branch_stats (
+            branch_id INT NOT NULL,
+            entity VARCHAR(20) NOT NULL, -- 'request' или 'ticket'
+            status VARCHAR(50) NOT NULL,
+            item_count BIGINT NOT NULL DEFAULT 0,
+            loan_total NUMERIC(14,2) NOT NULL DEFAULT 0,
+            ransom_total NUMERIC(14,2) NOT NULL DEFAULT 0,
+            CONSTRAINT pk_branch_stats PRIMARY KEY (branch_id, entity, status),
+            CONSTRAINT fk_branch_stats_branch FOREIGN KEY (branch_id) REFERENCES branches(branch_id) ON DELETE CASCADE
+        );
+        
+        -- 15. attachment_blobs (файлы вложений и число ссылок на них, ведется триггером)
+        CREATE TABLE IF NOT EXISTS attachment_blobs (
+            file_path TEXT PRIMARY KEY,
+            content_hash CHAR(64),
+            file_size BIGINT,
+            ref_count INT NOT NULL DEFAULT 0,
+            released_at TIMESTAMP WITH TIME ZONE -- когда число ссылок стало нулевым
+        );
+        
+        -- 16. upload_jobs (журнал фоновой обработки загруженных фотографий)
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            job_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+            request_id BIGINT NOT NULL,
+            uploaded_by BIGINT,
+            subfolder VARCHAR(50) NOT NULL,
+            staged_name VARCHAR(255) NOT NULL, -- имя файла во временном каталоге UPLOAD_STAGING_DIR
+            file_name VARCHAR(255) NOT NULL,
+            mime_type VARCHAR(100),
+            file_size BIGINT,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending'
+                CHECK (status IN ('pending', 'processing', 'done', 'failed', 'rejected')),
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP WITH TIME ZONE, -- повтор после ошибки не раньше этого времени
+            last_error TEXT,
+            attachment_id BIGINT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            started_at TIMESTAMP WITH TIME ZONE,
+            finished_at TIMESTAMP WITH TIME ZONE,
+            CONSTRAINT fk_upload_jobs_request FOREIGN KEY (request_id) REFERENCES requests(request_id) ON DELETE CASCADE,
+            CONSTRAINT fk_upload_jobs_user FOREIGN KEY (uploaded_by) REFERENCES users(user_id) ON DELETE SET NULL,
+            CONSTRAINT fk_upload_jobs_attachment FOREIGN KEY (attachment_id) REFERENCES attachments(attachment_id) ON DELETE SET NULL
+        );
+        ALTER TABLE upload_jobs ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE;
+        
         -- ================= Индексы =================
         CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
         CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
@@ -218,8 +630,18 @@ def init_database():
         CREATE INDEX IF NOT EXISTS idx_items_owner ON items(owner_user_id);
         CREATE INDEX IF NOT EXISTS idx_tickets_status ON pawn_tickets(status);
         CREATE INDEX IF NOT EXISTS idx_tickets_user ON pawn_tickets(user_id);
+        CREATE INDEX IF NOT EXISTS idx_tickets_issued_end ON pawn_tickets(end_date) WHERE status = 'issued';
+        CREATE INDEX IF NOT EXISTS idx_requests_user_created ON requests(user_id, created_at, request_id);
+        CREATE INDEX IF NOT EXISTS idx_tickets_user_created ON pawn_tickets(user_id, created_at, ticket_id);
         CREATE INDEX IF NOT EXISTS idx_payments_ticket ON payments(ticket_id);
-        CREATE INDEX IF NOT EXISTS idx_audit_time ON audit_logs(action_time);
+        CREATE INDEX IF NOT EXISTS idx_attachments_request ON attachments(request_id);
+        CREATE INDEX IF NOT EXISTS idx_upload_jobs_open ON upload_jobs(job_id) WHERE status IN ('pending', 'processing');
+        CREATE INDEX IF NOT EXISTS idx_upload_jobs_request ON upload_jobs(request_id);
+        CREATE INDEX IF NOT EXISTS idx_attachment_blobs_released ON attachment_blobs(released_at) WHERE ref_count <= 0;
+        -- Ключ постраничного вывода журнала аудита (action_time, log_id)
+        DROP INDEX IF EXISTS idx_audit_time;
+        CREATE INDEX IF NOT EXISTS idx_audit_time_id ON audit_logs(action_time, log_id);
+        CREATE INDEX IF NOT EXISTS idx_audit_action_time ON audit_logs(action_key, action_time, log_id);
         CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_logs(user_id);
         CREATE INDEX IF NOT EXISTS idx_tariffs_active ON tariffs(is_active, effective_from, effective_to);
         CREATE INDEX IF NOT EXISTS idx_tariffs_category_branch ON tariffs(category_id, branch_id);
@@ -245,6 +667,236 @@ def init_database():
             BEFORE UPDATE ON pawn_tickets
             FOR EACH ROW EXECUTE PROCEDURE lombard_set_updated_at();
         
+        -- ================ Уведомления об изменении тарифов =================
+        -- Приложение держит индекс тарифов в памяти и сбрасывает его по этому каналу
+        CREATE OR REPLACE FUNCTION lombard_notify_tariffs_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('tariffs_changed', TG_OP);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_tariffs_notify ON tariffs;
+        CREATE TRIGGER trg_tariffs_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tariffs
+            FOR EACH STATEMENT EXECUTE PROCEDURE lombard_notify_tariffs_changed();
+        
+        
+        -- ================ Уведомления об изменении привязок к филиалам =================
+        -- Приложение кэширует филиалы администраторов; payload - user_id или пусто (сбросить всё)
+        CREATE OR REPLACE FUNCTION lombard_notify_user_branches_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_TABLE_NAME = 'user_branches' THEN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM pg_notify('user_branches_changed', OLD.user_id::text);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM pg_notify('user_branches_changed', NEW.user_id::text);
+                END IF;
+            ELSE
+                PERFORM pg_notify('user_branches_changed', '');
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_user_branches_notify ON user_branches;
+        CREATE TRIGGER trg_user_branches_notify
+            AFTER INSERT OR UPDATE OR DELETE ON user_branches
+            FOR EACH ROW EXECUTE PROCEDURE lombard_notify_user_branches_changed();
+        
+        DROP TRIGGER IF EXISTS trg_branches_notify ON branches;
+        CREATE TRIGGER trg_branches_notify
+            AFTER UPDATE OR DELETE ON branches
+            FOR EACH STATEMENT EXECUTE PROCEDURE lombard_notify_user_branches_changed();
+        
+        
+        -- ================ Уведомления об изменении пользователей =================
+        -- Приложение кэширует записи пользователей для get_current_user; payload - user_id
+        CREATE OR REPLACE FUNCTION lombard_notify_users_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('users_changed', OLD.user_id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_users_notify ON users;
+        CREATE TRIGGER trg_users_notify
+            AFTER UPDATE OR DELETE ON users
+            FOR EACH ROW EXECUTE PROCEDURE lombard_notify_users_changed();
+        
+        
+        -- ================ Уведомления об изменении справочников =================
+        -- Приложение кэширует филиалы и категории; payload - имя таблицы
+        CREATE OR REPLACE FUNCTION lombard_notify_reference_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('reference_data_changed', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_branches_reference_notify ON branches;
+        CREATE TRIGGER trg_branches_reference_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON branches
+            FOR EACH STATEMENT EXECUTE PROCEDURE lombard_notify_reference_changed();
+        
+        DROP TRIGGER IF EXISTS trg_item_categories_reference_notify ON item_categories;
+        CREATE TRIGGER trg_item_categories_reference_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON item_categories
+            FOR EACH STATEMENT EXECUTE PROCEDURE lombard_notify_reference_changed();
+        
+        DROP TRIGGER IF EXISTS trg_roles_reference_notify ON roles;
+        
+        
+        -- ================ Статистика по филиалам =================
+        CREATE OR REPLACE FUNCTION lombard_branch_stats_apply(
+            p_branch_id INT, p_entity VARCHAR, p_status VARCHAR,
+            p_count BIGINT, p_loan NUMERIC, p_ransom NUMERIC
+        ) RETURNS VOID AS $$
+        BEGIN
+            INSERT INTO branch_stats (branch_id, entity, status, item_count, loan_total, ransom_total)
+            VALUES (p_branch_id, p_entity, p_status, p_count, COALESCE(p_loan, 0), COALESCE(p_ransom, 0))
+            ON CONFLICT (branch_id, entity, status) DO UPDATE
+            SET item_count = branch_stats.item_count + EXCLUDED.item_count,
+                loan_total = branch_stats.loan_total + EXCLUDED.loan_total,
+                ransom_total = branch_stats.ransom_total + EXCLUDED.ransom_total;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        CREATE OR REPLACE FUNCTION lombard_requests_branch_stats()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                IF TG_OP = 'UPDATE' AND OLD.branch_id = NEW.branch_id AND OLD.status = NEW.status THEN
+                    RETURN NULL;
+                END IF;
+                PERFORM lombard_branch_stats_apply(OLD.branch_id, 'request', OLD.status, -1, 0, 0);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM lombard_branch_stats_apply(NEW.branch_id, 'request', NEW.status, 1, 0, 0);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        CREATE OR REPLACE FUNCTION lombard_tickets_branch_stats()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                IF TG_OP = 'UPDATE' AND OLD.branch_id = NEW.branch_id AND OLD.status = NEW.status
+                   AND OLD.loan_amount = NEW.loan_amount AND OLD.ransom_amount = NEW.ransom_amount THEN
+                    RETURN NULL;
+                END IF;
+                PERFORM lombard_branch_stats_apply(OLD.branch_id, 'ticket', OLD.status,
+                                                   -1, -OLD.loan_amount, -OLD.ransom_amount);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM lombard_branch_stats_apply(NEW.branch_id, 'ticket', NEW.status,
+                                                   1, NEW.loan_amount, NEW.ransom_amount);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        -- Полный пересчет (при первой установке и для сверки)
+        CREATE OR REPLACE FUNCTION lombard_rebuild_branch_stats()
+        RETURNS VOID AS $$
+        BEGIN
+            LOCK TABLE requests, pawn_tickets IN SHARE MODE;
+            DELETE FROM branch_stats;
+            INSERT INTO branch_stats (branch_id, entity, status, item_count, loan_total, ransom_total)
+            SELECT branch_id, 'request', status, COUNT(*), 0, 0
+            FROM requests GROUP BY branch_id, status
+            UNION ALL
+            SELECT branch_id, 'ticket', status, COUNT(*),
+                   COALESCE(SUM(loan_amount), 0), COALESCE(SUM(ransom_amount), 0)
+            FROM pawn_tickets GROUP BY branch_id, status;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_requests_branch_stats ON requests;
+        CREATE TRIGGER trg_requests_branch_stats
+            AFTER INSERT OR UPDATE OR DELETE ON requests
+            FOR EACH ROW EXECUTE PROCEDURE lombard_requests_branch_stats();
+        
+        DROP TRIGGER IF EXISTS trg_tickets_branch_stats ON pawn_tickets;
+        CREATE TRIGGER trg_tickets_branch_stats
+            AFTER INSERT OR UPDATE OR DELETE ON pawn_tickets
+            FOR EACH ROW EXECUTE PROCEDURE lombard_tickets_branch_stats();
+        
+        SELECT lombard_rebuild_branch_stats();
+        
+        
+        -- ================ Счетчики ссылок на файлы вложений =================
+        CREATE OR REPLACE FUNCTION lombard_attachment_blob_refs()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO attachment_blobs (file_path, content_hash, file_size, ref_count)
+                VALUES (NEW.file_path, NEW.content_hash, NEW.file_size, 1)
+                ON CONFLICT (file_path) DO UPDATE
+                SET ref_count = attachment_blobs.ref_count + 1,
+                    content_hash = COALESCE(attachment_blobs.content_hash, EXCLUDED.content_hash),
+                    file_size = COALESCE(attachment_blobs.file_size, EXCLUDED.file_size),
+                    released_at = NULL;
+            ELSE
+                UPDATE attachment_blobs
+                SET ref_count = ref_count - 1,
+                    released_at = CASE WHEN ref_count <= 1 THEN now() END
+                WHERE file_path = OLD.file_path;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_attachment_blob_refs ON attachments;
+        CREATE TRIGGER trg_attachment_blob_refs
+            AFTER INSERT OR DELETE ON attachments
+            FOR EACH ROW EXECUTE PROCEDURE lombard_attachment_blob_refs();
+        
+        -- Сверка счетчиков с вложениями (в том числе загруженными до появления таблицы)
+        INSERT INTO attachment_blobs (file_path, content_hash, file_size, ref_count)
+        SELECT file_path, MAX(content_hash), MAX(file_size), COUNT(*)
+        FROM attachments GROUP BY file_path
+        ON CONFLICT (file_path) DO UPDATE
+        SET ref_count = EXCLUDED.ref_count, released_at = NULL;
+        
+        
+        -- ================ Секции audit_logs =================
+        -- Создает помесячную секцию audit_logs_YYYYMM, если ее еще нет.
+        -- Строки этого месяца, попавшие в секцию по умолчанию, переносятся в новую
+        -- секцию (иначе ее нельзя присоединить, а секция по умолчанию растет без предела)
+        CREATE OR REPLACE FUNCTION lombard_create_audit_partition(p_month DATE)
+        RETURNS TEXT AS $$
+        DECLARE
+            v_from DATE := date_trunc('month', p_month)::date;
+            v_to DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+            v_name TEXT := 'audit_logs_' || to_char(p_month, 'YYYYMM');
+        BEGIN
+            IF to_regclass(v_name) IS NOT NULL THEN
+                RETURN v_name;
+            END IF;
+        
+            -- Новые строки этого месяца не должны попасть в секцию по умолчанию до присоединения
+            LOCK TABLE audit_logs_default IN SHARE ROW EXCLUSIVE MODE;
+        
+            EXECUTE format('CREATE TABLE %I (LIKE audit_logs INCLUDING DEFAULTS)', v_name);
+            EXECUTE format(
+                'INSERT INTO %I SELECT * FROM audit_logs_default WHERE action_time >= %L AND action_time < %L',
+                v_name, v_from, v_to
+            );
+            DELETE FROM audit_logs_default WHERE action_time >= v_from AND action_time < v_to;
+            EXECUTE format(
+                'ALTER TABLE audit_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_from, v_to
+            );
+            RETURN v_name;
+        END;
+        $$ LANGUAGE plpgsql;
         
         
         -- Функция для выбора подходящего тарифа
@@ -281,9 +933,17 @@ def init_database():
         $$ LANGUAGE plpgsql;
         """
 
+        sql_script = sql_script.replace(
+            '-- {AUDIT_LOGS_DDL}',
+            AUDIT_LOGS_PARTITIONED_DDL if AUDIT_PARTITIONING else AUDIT_LOGS_DDL
+        )
+
         # Выполняем SQL скрипт
         cur.execute(sql_script)
 
+        if AUDIT_PARTITIONING:
+            create_audit_partitions(cur)
+
         print("Таблицы успешно созданы!")
 
     except Exception as e:
@@ -293,5 +953,54 @@ def init_database():
         conn.close()
 
 
+def init_sqlite_database():
+    """Создает таблицы встроенной базы SQLite (DB_TYPE=sqlite)"""
+    path = os.getenv('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lombard.db'))
+    conn = sqlite3.connect(path)
+
+    try:
+        # Режим WAL сохраняется в файле базы: читатели не блокируют запись
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA foreign_keys = ON')
+
+        print(f"Создание таблиц в {path}...")
+        conn.executescript(SQLITE_SCHEMA)
+
+        # Колонки, добавленные после создания таблиц (ADD COLUMN IF NOT EXISTS в SQLite нет)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(upload_jobs)')}
+        if 'next_attempt_at' not in columns:
+            conn.execute('ALTER TABLE upload_jobs ADD COLUMN next_attempt_at TIMESTAMP')
+        conn.commit()
+
+        print("Таблицы успешно созданы!")
+
+    except Exception as e:
+        print(f"Ошибка при создании таблиц: {e}")
+    finally:
+        conn.close()
+
+
+def create_audit_partitions(cur):
+    """Создает секции audit_logs на текущий и следующие месяцы"""
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'audit_logs'::regclass
+        ) AS partitioned
+    """)
+    if not cur.fetchone()[0]:
+        print("audit_logs уже существует без секционирования, секции не создаются")
+        return
+
+    for month in range(AUDIT_PARTITION_MONTHS_AHEAD + 1):
+        cur.execute(
+            "SELECT lombard_create_audit_partition((date_trunc('month', CURRENT_DATE) + %s * INTERVAL '1 month')::date)",
+            (month,)
+        )
+        print(f"Секция {cur.fetchone()[0]} готова")
+
+
 if __name__ == '__main__':
-    init_database()
\ No newline at end of file
+    if os.getenv('DB_TYPE', 'postgresql') == 'sqlite':
+        init_sqlite_database()
+    else:
+        init_database()
\ No newline at end of file
@@ -1,6 +1,11 @@
 import os
+import json
 import random
 import hashlib
+import argparse
+import tempfile
+import time
+from datetime import date, datetime, timedelta
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
@@ -12,15 +17,25 @@ def hash_password(password):
     return hashlib.md5(password.encode()).hexdigest()
 
 
-def populate_test_data():
+def connect():
+    # Встроенная база: соединение с интерфейсом psycopg2 (SET search_path пропускается)
+    if os.getenv('DB_TYPE', 'postgresql') == 'sqlite':
+        from app.utils.sqlite_backend import SQLiteConnection
+        return SQLiteConnection(os.getenv('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                      'lombard.db')))
+
     # Подключаемся к БД используя настройки из .env
-    conn = psycopg2.connect(
+    return psycopg2.connect(
         host=os.getenv('DB_HOST', 'localhost'),
         port=os.getenv('DB_PORT', '5432'),
         database=os.getenv('DB_NAME', 'flask_pawn_shop_db'),
         user=os.getenv('DB_USER', 'lombard_user'),
         password=os.getenv('DB_PASSWORD', '123456')
     )
+
+
+def populate_test_data():
+    conn = connect()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
     # Устанавливаем схему
@@ -233,6 +248,495 @@ def populate_test_data():
         conn.close()
 
 
+# ================= Генерация больших объемов данных (COPY) =================
+
+MALE_NAMES = ['Александр', 'Дмитрий', 'Сергей', 'Андрей', 'Алексей', 'Иван', 'Максим', 'Павел']
+FEMALE_NAMES = ['Мария', 'Ольга', 'Анна', 'Екатерина', 'Наталья', 'Елена', 'Татьяна', 'Ирина']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Козлов', 'Смирнов', 'Ковалев', 'Новиков', 'Морозов',
+              'Волков', 'Лебедев', 'Соколов', 'Попов', 'Кузнецов', 'Васильев', 'Зайцев', 'Павлов']
+CITIES = ['Минск', 'Гомель', 'Брест', 'Гродно', 'Витебск', 'Могилев', 'Бобруйск', 'Барановичи']
+STREETS = ['Немига', 'Кальварийская', 'Чкалова', 'Ленина', 'Советская', 'Притыцкого', 'Богдановича']
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_2 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 Version/17.2 Safari/605.1.15',
+]
+# Вещи по категориям базовых данных: (название, описание, типичная стоимость)
+ITEM_TEMPLATES = {
+    'Электроника': [('iPhone 13 Pro', 'Смартфон в отличном состоянии', 1500),
+                    ('Ноутбук Dell', 'Core i5, 8GB RAM', 1200),
+                    ('Фотоаппарат Canon', 'Зеркальный, с объективом', 900)],
+    'Ювелирные изделия': [('Золотое кольцо', '585 проба, с камнем', 800),
+                          ('Серебряная цепочка', '925 проба', 150),
+                          ('Часы Omega', 'Механические, с документами', 4000)],
+    'Бытовая техника': [('Телевизор Samsung', '55 дюймов, 4K', 1800),
+                        ('Стиральная машина LG', 'Загрузка 7 кг', 700)],
+    'Антиквариат': [('Икона XIX века', 'В окладе', 3000),
+                    ('Фарфоровая ваза', 'Клеймо ЛФЗ', 500)],
+    'Музыкальные инструменты': [('Гитара Fender', 'Акустическая, классика', 600),
+                                ('Синтезатор Yamaha', '61 клавиша', 450)],
+}
+DEFAULT_ITEMS = [('Вещь', 'Без описания', 300)]
+
+# Действия журнала аудита и их доли
+AUDIT_ACTIONS = [('create_request', 40), ('approve_request', 25), ('reject_request', 15),
+                 ('redeem_ticket', 15), ('export_data', 5)]
+
+# Таблицы, в которые ключи пишутся явно (чтобы сразу ссылаться на них из дочерних строк)
+EXPLICIT_ID_COLUMNS = [('branches', 'branch_id'), ('users', 'user_id'), ('requests', 'request_id'),
+                       ('items', 'item_id'), ('pawn_tickets', 'ticket_id')]
+
+# Триггеры статистики филиалов на время загрузки отключаются, статистика пересчитывается в конце
+BULK_DISABLED_TRIGGERS = [('requests', 'trg_requests_branch_stats'),
+                          ('pawn_tickets', 'trg_tickets_branch_stats')]
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class CopySource:
+    """Файлоподобный источник для COPY FROM STDIN: строки берутся из генератора по мере чтения"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ''
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+
+        data = ''.join(chunks)
+        if size < 0 or len(data) <= size:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_line(*values):
+    """Строка в текстовом формате COPY.
+
+    Сгенерированные значения не содержат табуляций, переводов строк и обратных слэшей,
+    поэтому экранируется только NULL.
+    """
+    return '\t'.join('\\N' if value is None else str(value) for value in values) + '\n'
+
+
+def copy_rows(cur, table, columns, lines):
+    """Загружает строки в таблицу через COPY FROM STDIN, не накапливая их в памяти"""
+    started = time.perf_counter()
+    source = CopySource(lines)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", source, size=COPY_BUFFER_SIZE)
+    print(f"  {table}: {source.rows} строк за {time.perf_counter() - started:.1f} с")
+    return source.rows
+
+
+def money(value):
+    return f"{value:.2f}"
+
+
+def spread(index, total, rng, start, span):
+    """Момент времени для index-й из total строк: по возрастанию, с ростом плотности к концу периода"""
+    return start + span * (((index + rng.random()) / total) ** 0.7)
+
+
+def has_ticket(index, requests, tickets):
+    """Равномерно распределяет tickets талонов по requests заявкам (ровно tickets штук)"""
+    return (index + 1) * tickets // requests - index * tickets // requests == 1
+
+
+class BulkGenerator:
+    """Детерминированный генератор данных: одинаковые параметры и seed дают одинаковую базу.
+
+    Все строки берутся из одного random.Random(seed) в фиксированном порядке;
+    ключи новых строк продолжают существующие (MAX(id) + 1).
+    """
+
+    def __init__(self, cur, options):
+        self.cur = cur
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.end = datetime.combine(options.end_date, datetime.min.time())
+        self.span = timedelta(days=options.days)
+        self.start = self.end - self.span
+        self.password_hash = hash_password('123456')
+        self.counts = {}
+
+        self._load_reference_data()
+
+    def _load_reference_data(self):
+        cur = self.cur
+        cur.execute("SELECT role_id, role_name FROM roles")
+        roles = {row['role_name']: row['role_id'] for row in cur.fetchall()}
+        self.user_role_id = roles.get('user')
+
+        cur.execute("SELECT category_id, name FROM item_categories ORDER BY category_id")
+        self.categories = [(row['category_id'], ITEM_TEMPLATES.get(row['name'], DEFAULT_ITEMS))
+                           for row in cur.fetchall()]
+
+        cur.execute('''
+            SELECT tariff_id, category_id, branch_id, loan_percent, interest_rate, max_loan
+            FROM tariffs WHERE is_active = true ORDER BY tariff_id
+        ''')
+        self.tariffs = cur.fetchall()
+        self._tariff_cache = {}
+
+        cur.execute("SELECT user_id FROM users WHERE role_id = %s ORDER BY user_id", (roles.get('admin'),))
+        self.admin_ids = [row['user_id'] for row in cur.fetchall()]
+
+        cur.execute("SELECT branch_id FROM branches ORDER BY branch_id")
+        self.existing_branch_ids = [row['branch_id'] for row in cur.fetchall()]
+
+        self.first_ids = {}
+        for table, column in EXPLICIT_ID_COLUMNS:
+            cur.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 AS next_id FROM {table}")
+            self.first_ids[table] = cur.fetchone()['next_id']
+
+    def missing_reference_data(self):
+        """Что из базовых данных отсутствует (их создает запуск без --bulk)"""
+        missing = []
+        if self.user_role_id is None:
+            missing.append('роль user')
+        if not self.categories:
+            missing.append('категории')
+        if not self.tariffs:
+            missing.append('тарифы')
+        if not self.admin_ids:
+            missing.append('администраторы')
+        return missing
+
+    def tariff_for(self, category_id, branch_id):
+        """Тариф в порядке приоритета find_tariff: категория+филиал -> категория -> филиал -> общий"""
+        key = (category_id, branch_id)
+        if key not in self._tariff_cache:
+            ranked = sorted(
+                (t for t in self.tariffs
+                 if t['category_id'] in (category_id, None) and t['branch_id'] in (branch_id, None)),
+                key=lambda t: (t['category_id'] is None, t['branch_id'] is None)
+            )
+            self._tariff_cache[key] = ranked[0] if ranked else self.tariffs[0]
+        return self._tariff_cache[key]
+
+    # ---------- генераторы строк ----------
+
+    def branch_rows(self):
+        rng = self.rng
+        first_id = self.first_ids['branches']
+        for branch_id in range(first_id, first_id + self.options.branches):
+            yield copy_line(
+                branch_id,
+                f"Филиал №{branch_id}",
+                f"г. {rng.choice(CITIES)}, ул. {rng.choice(STREETS)}, {rng.randint(1, 150)}",
+                f"+375 (17) {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+                self.start
+            )
+
+    def user_branch_rows(self):
+        """Новые филиалы распределяются между администраторами по кругу"""
+        first_id = self.first_ids['branches']
+        for index, branch_id in enumerate(range(first_id, first_id + self.options.branches)):
+            yield copy_line(self.admin_ids[index % len(self.admin_ids)], branch_id, 'false')
+
+    def user_rows(self):
+        rng = self.rng
+        total = self.options.users
+        first_id = self.first_ids['users']
+        for index in range(total):
+            user_id = first_id + index
+            created_at = spread(index, total, rng, self.start, self.span).replace(microsecond=0)
+            female = rng.random() < 0.5
+            yield copy_line(
+                user_id,
+                f"user{user_id}@bench.lombard.by",
+                self.password_hash,
+                rng.choice(FEMALE_NAMES if female else MALE_NAMES),
+                rng.choice(LAST_NAMES) + ('а' if female else ''),
+                f"+375 (29) {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+                self.user_role_id,
+                created_at,
+                created_at
+            )
+
+    def request_rows(self, items_out, tickets_out, payments_out):
+        """Заявки; для одобренных заявок вещи, талоны и платежи пишутся в items_out/tickets_out/payments_out"""
+        rng = self.rng
+        opts = self.options
+        total = opts.requests
+        first_id = self.first_ids['requests']
+        next_item_id = self.first_ids['items']
+        next_ticket_id = self.first_ids['pawn_tickets']
+        first_user_id = self.first_ids['users']
+        today = opts.end_date
+
+        # Крупные филиалы получают больше заявок
+        branch_ids = self.existing_branch_ids + list(
+            range(self.first_ids['branches'], self.first_ids['branches'] + opts.branches))
+        branch_weights = []
+        acc = 0.0
+        for rank in range(len(branch_ids)):
+            acc += 1 / (rank + 1) ** 0.8
+            branch_weights.append(acc)
+
+        tickets_done = 0
+        payments_done = 0
+        counts = {'items': 0, 'pawn_tickets': 0, 'payments': 0}
+
+        for index in range(total):
+            request_id = first_id + index
+            created_at = spread(index, total, rng, self.start, self.span).replace(microsecond=0)
+            # Активность клиентов неравномерна: небольшая часть подает большинство заявок
+            user_id = first_user_id + int(opts.users * rng.random() ** 2)
+            branch_id = rng.choices(branch_ids, cum_weights=branch_weights)[0]
+            category_id, templates = rng.choice(self.categories)
+            item_name, item_description, base_price = rng.choice(templates)
+            estimated_cost = base_price * rng.uniform(0.6, 1.4)
+
+            if has_ticket(index, total, opts.tickets):
+                status = 'approved'
+            elif self.end - created_at < timedelta(days=14):
+                status = 'submitted' if rng.random() < 0.8 else 'cancelled'
+            else:
+                status = 'rejected' if rng.random() < 0.55 else 'cancelled'
+            updated_at = created_at if status == 'submitted' else \
+                created_at + timedelta(minutes=rng.randint(10, 72 * 60))
+
+            yield copy_line(request_id, f"BENCH-REQ-{request_id}", user_id, branch_id, category_id,
+                            item_name, item_description, money(estimated_cost), status,
+                            created_at, updated_at)
+
+            if status != 'approved':
+                continue
+
+            item_id, ticket_id = next_item_id, next_ticket_id
+            next_item_id += 1
+            next_ticket_id += 1
+            items_out.write(copy_line(item_id, user_id, branch_id, category_id, item_name,
+                                      item_description, money(estimated_cost), updated_at))
+            counts['items'] += 1
+
+            tariff = self.tariff_for(category_id, branch_id)
+            term_days = rng.choice((30, 30, 60, 90))
+            admission_date = updated_at.date()
+            end_date = admission_date + timedelta(days=term_days)
+            loan_amount = estimated_cost * float(tariff['loan_percent']) / 100
+            if tariff['max_loan'] is not None:
+                loan_amount = min(loan_amount, float(tariff['max_loan']))
+            interest = loan_amount * float(tariff['interest_rate']) / 100
+            ransom_amount = loan_amount + interest * term_days / 30
+
+            if end_date >= today:
+                ticket_status = 'issued'
+            else:
+                roll = rng.random()
+                ticket_status = 'redeemed' if roll < 0.7 else 'issued' if roll < 0.85 else \
+                    'defaulted' if roll < 0.95 else 'archived'
+
+            tickets_out.write(copy_line(
+                ticket_id, f"BENCH-T-{ticket_id}", request_id, user_id, item_id, branch_id,
+                admission_date, end_date, money(loan_amount), money(ransom_amount),
+                tariff['tariff_id'], ticket_status, rng.choice(self.admin_ids), updated_at, updated_at
+            ))
+            counts['pawn_tickets'] += 1
+
+            # Ровно opts.payments платежей, распределенных по талонам равномерно
+            tickets_done += 1
+            payment_count = tickets_done * opts.payments // opts.tickets - payments_done
+            payments_done += payment_count
+            period = max(0, (min(end_date, today) - admission_date).days) * 86400
+            for number in range(payment_count):
+                payment_date = datetime.combine(admission_date, datetime.min.time()) + \
+                    timedelta(seconds=9 * 3600 + rng.randint(0, period))
+                if ticket_status == 'redeemed' and number == payment_count - 1:
+                    payment_type, amount = 'ransom', ransom_amount
+                elif ticket_status != 'redeemed' and end_date < today and rng.random() < 0.5:
+                    payment_type, amount = 'penalty', interest * 0.1
+                else:
+                    payment_type, amount = rng.choice((('extension', interest), ('fee', interest * 0.05)))
+                payments_out.write(copy_line(ticket_id, money(amount), payment_type, payment_date,
+                                             rng.choice(self.admin_ids)))
+            counts['payments'] += payment_count
+
+        self.counts.update(counts)
+
+    def audit_rows(self):
+        rng = self.rng
+        opts = self.options
+        total = opts.audit
+        actions = [key for key, _ in AUDIT_ACTIONS]
+        weights = []
+        acc = 0
+        for _, weight in AUDIT_ACTIONS:
+            acc += weight
+            weights.append(acc)
+
+        first_request_id = self.first_ids['requests']
+        first_ticket_id = self.first_ids['pawn_tickets']
+        for index in range(total):
+            action = rng.choices(actions, cum_weights=weights)[0]
+            action_time = spread(index, total, rng, self.start, self.span)
+            if action == 'create_request':
+                user_id = self.first_ids['users'] + int(opts.users * rng.random() ** 2)
+            else:
+                user_id = rng.choice(self.admin_ids)
+
+            if action == 'redeem_ticket' and opts.tickets:
+                payload = {'ticket_id': first_ticket_id + rng.randrange(opts.tickets)}
+            elif action == 'export_data':
+                payload = {'export': rng.choice(('tickets', 'requests', 'payments')), 'format': 'csv'}
+            else:
+                payload = {'request_id': first_request_id + rng.randrange(opts.requests)}
+
+            yield copy_line(user_id, action, action_time,
+                            f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+                            rng.choice(USER_AGENTS), json.dumps(payload))
+
+    # ---------- загрузка ----------
+
+    def run(self):
+        cur = self.cur
+
+        for table, column in EXPLICIT_ID_COLUMNS:
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET GENERATED BY DEFAULT")
+        for table, trigger in BULK_DISABLED_TRIGGERS:
+            cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER {trigger}")
+
+        self.counts['branches'] = copy_rows(cur, 'branches', [
+            'branch_id', 'name', 'address', 'phone', 'created_at'
+        ], self.branch_rows())
+        copy_rows(cur, 'user_branches', ['user_id', 'branch_id', 'is_primary'], self.user_branch_rows())
+        self.counts['users'] = copy_rows(cur, 'users', [
+            'user_id', 'email', 'password_hash', 'first_name', 'last_name', 'phone', 'role_id',
+            'created_at', 'updated_at'
+        ], self.user_rows())
+
+        # Дочерние строки заявок копятся во временных файлах и загружаются после заявок
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as items_out, \
+                tempfile.TemporaryFile('w+', encoding='utf-8') as tickets_out, \
+                tempfile.TemporaryFile('w+', encoding='utf-8') as payments_out:
+            self.counts['requests'] = copy_rows(cur, 'requests', [
+                'request_id', 'request_number', 'user_id', 'branch_id', 'category_id', 'item_name',
+                'item_description', 'estimated_cost', 'status', 'created_at', 'updated_at'
+            ], self.request_rows(items_out, tickets_out, payments_out))
+
+            for spool in (items_out, tickets_out, payments_out):
+                spool.seek(0)
+            copy_rows(cur, 'items', [
+                'item_id', 'owner_user_id', 'branch_id', 'category_id', 'name', 'description',
+                'estimated_cost', 'created_at'
+            ], items_out)
+            copy_rows(cur, 'pawn_tickets', [
+                'ticket_id', 'ticket_number', 'request_id', 'user_id', 'item_id', 'branch_id',
+                'admission_date', 'end_date', 'loan_amount', 'ransom_amount', 'tariff_id', 'status',
+                'created_by', 'created_at', 'updated_at'
+            ], tickets_out)
+            copy_rows(cur, 'payments', [
+                'ticket_id', 'amount', 'payment_type', 'payment_date', 'processed_by'
+            ], payments_out)
+
+        self.counts['audit_logs'] = copy_rows(cur, 'audit_logs', [
+            'user_id', 'action_key', 'action_time', 'ip_address', 'user_agent', 'payload'
+        ], self.audit_rows())
+
+        for table, column in EXPLICIT_ID_COLUMNS:
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET GENERATED ALWAYS")
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                        f"(SELECT COALESCE(MAX({column}), 1) FROM {table}))")
+        for table, trigger in BULK_DISABLED_TRIGGERS:
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER {trigger}")
+
+        print("Пересчет статистики филиалов...")
+        cur.execute("SELECT lombard_rebuild_branch_stats()")
+
+
+def populate_bulk_data(options):
+    """Заполняет базу большим объемом данных для нагрузочных тестов (одной транзакцией)"""
+    conn = connect()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    schema = os.getenv('DB_SCHEMA', 'lombard')
+    cur.execute(f"SET search_path TO {schema}, public;")
+    # Потеря последних транзакций при сбое не важна для тестовой базы
+    cur.execute("SET synchronous_commit TO off")
+
+    started = time.perf_counter()
+    try:
+        generator = BulkGenerator(cur, options)
+        missing = generator.missing_reference_data()
+        if missing:
+            print(f"Нет базовых данных ({', '.join(missing)}), сначала запустите populate_test_data.py без --bulk")
+            return
+
+        print(f"Генерация данных (seed={options.seed}, период {generator.start:%Y-%m-%d} - {options.end_date})...")
+        generator.run()
+        conn.commit()
+
+        conn.autocommit = True
+        print("Обновление статистики планировщика (ANALYZE)...")
+        for table in ('branches', 'users', 'user_branches', 'requests', 'items', 'pawn_tickets',
+                      'payments', 'audit_logs', 'branch_stats'):
+            cur.execute(f"ANALYZE {table}")
+
+        print("\n=== Добавлено ===")
+        for table, count in generator.counts.items():
+            print(f"{table}: {count}")
+        print(f"\nГотово за {time.perf_counter() - started:.1f} с")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Заполнение базы тестовыми данными')
+    parser.add_argument('--bulk', action='store_true',
+                        help='сгенерировать большой объем данных через COPY (нужны базовые данные)')
+    parser.add_argument('--seed', type=int, default=42, help='зерно генератора')
+    parser.add_argument('--branches', type=int, default=20, help='новых филиалов')
+    parser.add_argument('--users', type=int, default=10000, help='новых клиентов')
+    parser.add_argument('--requests', type=int, default=100000, help='заявок')
+    parser.add_argument('--tickets', type=int, help='талонов (одобренных заявок), по умолчанию 60%% заявок')
+    parser.add_argument('--payments', type=int, help='платежей, по умолчанию 1.5 на талон')
+    parser.add_argument('--audit', type=int, help='записей журнала аудита, по умолчанию 2 на заявку')
+    parser.add_argument('--days', type=int, default=730, help='период данных в днях')
+    parser.add_argument('--end-date', type=date.fromisoformat, default=date.today(),
+                        help='последний день периода (YYYY-MM-DD); задайте, чтобы база совпадала между запусками')
+    options = parser.parse_args(argv)
+
+    if options.tickets is None:
+        options.tickets = options.requests * 6 // 10
+    if options.payments is None:
+        options.payments = options.tickets * 3 // 2
+    if options.audit is None:
+        options.audit = options.requests * 2
+
+    if options.bulk:
+        if options.users <= 0 or options.requests <= 0 or options.days <= 0:
+            parser.error('--users, --requests и --days должны быть больше нуля')
+        if not 0 <= options.tickets <= options.requests:
+            parser.error('--tickets должно быть от 0 до --requests')
+        if options.payments and not options.tickets:
+            parser.error('платежи без талонов невозможны, задайте --payments 0')
+    return options
+
+
 if __name__ == '__main__':
-    populate_test_data()
+    args = parse_args()
+    if args.bulk and os.getenv('DB_TYPE', 'postgresql') == 'sqlite':
+        print("--bulk использует COPY и работает только с PostgreSQL")
+    elif args.bulk:
+        populate_bulk_data(args)
+    else:
+        populate_test_data()
 
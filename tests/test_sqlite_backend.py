@@ -0,0 +1,123 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2.extensions
+import pytest
+
+from app.utils.sqlite_backend import SQLiteConnection, translate
+
+
+def test_params_become_question_marks():
+    assert translate('SELECT * FROM users WHERE user_id = %s AND email = %s', [1, 'a@b.c']) == (
+        'SELECT * FROM users WHERE user_id = ? AND email = ?', [1, 'a@b.c'])
+
+
+def test_no_args_leaves_percent_signs_alone():
+    assert translate("SELECT 'x%%' LIKE '%s'") == ("SELECT 'x%%' LIKE '%s'", [])
+
+
+def test_escaped_percent_is_unescaped_with_args():
+    assert translate("SELECT 'x%%' WHERE a = %s AND b LIKE 'y%%'", [1]) == (
+        "SELECT 'x%' WHERE a = ? AND b LIKE 'y%'", [1])
+
+
+def test_string_literals_are_not_rewritten():
+    sql, params = translate("SELECT 'now() ::text FOR UPDATE = ANY(%s)' WHERE a = %s", [5])
+    assert sql == "SELECT 'now() ::text FOR UPDATE = ANY(%s)' WHERE a = ?"
+    assert params == [5]
+
+
+def test_any_and_all_expand_to_in_lists():
+    assert translate('SELECT 1 WHERE a = ANY(%s) AND b <> ALL(%s)', [[1, 2, 3], (4,)]) == (
+        'SELECT 1 WHERE a IN (?, ?, ?) AND b NOT IN (?)', [1, 2, 3, 4])
+
+
+def test_any_with_empty_list_matches_nothing():
+    sql, params = translate('SELECT 1 WHERE a = ANY(%s)', [[]])
+    assert sql == 'SELECT 1 WHERE a IN ()'
+    assert params == []
+
+
+@pytest.mark.parametrize('expression', [
+    'now() - make_interval(secs => %s)',
+    "now() - %s * INTERVAL '1 second'",
+    "now() - %s * INTERVAL '1 seconds'",
+])
+def test_intervals_become_datetime_modifiers(expression):
+    assert translate(f'SELECT 1 WHERE t < {expression}', [30]) == (
+        "SELECT 1 WHERE t < datetime('now', '-' || ? || ' seconds')", [30])
+
+
+def test_casts_locks_and_now_are_translated():
+    sql, _ = translate('SELECT a::text, b::int[], now() FROM t WHERE c = %s FOR UPDATE SKIP LOCKED', [1])
+    assert sql == 'SELECT a, b, CURRENT_TIMESTAMP FROM t WHERE c = ? '
+
+
+def test_functions_are_mapped():
+    sql, _ = translate('SELECT GREATEST(a, 0), least(b, 1), jsonb_build_object(%s, c), '
+                       'pg_try_advisory_lock(%s), pg_advisory_unlock(%s) FROM t WHERE d ILIKE %s',
+                       ['k', 42, 42, 'x%'])
+    assert sql == ('SELECT MAX(a, 0), MIN(b, 1), json_object(?, c), '
+                   'abs(?), abs(?) FROM t WHERE d LIKE ?')
+
+
+def test_parameter_count_mismatch_raises():
+    with pytest.raises(IndexError):
+        translate('SELECT %s, %s', [1])
+
+
+@pytest.fixture
+def conn():
+    connection = SQLiteConnection(':memory:')
+    connection.raw.executescript('''
+        CREATE TABLE t (
+            id INTEGER PRIMARY KEY,
+            amount NUMERIC,
+            day DATE,
+            created_at TIMESTAMP,
+            active BOOLEAN
+        );
+    ''')
+    yield connection
+    connection.close()
+
+
+def test_advisory_lock_mapping_returns_true(conn):
+    cur = conn.cursor()
+    cur.execute('SELECT pg_try_advisory_lock(%s) AS locked', [715001])
+    assert cur.fetchone()['locked']
+    cur.execute('SELECT pg_advisory_unlock(%s) AS unlocked', [715001])
+    assert cur.fetchone()['unlocked']
+
+
+def test_declared_types_are_converted(conn):
+    cur = conn.cursor()
+    cur.execute('INSERT INTO t (amount, day, created_at, active) VALUES (%s, %s, %s, %s) RETURNING id',
+                [Decimal('12.50'), date(2024, 3, 1), datetime(2024, 3, 1, 10, 30), True])
+    row_id = cur.fetchone()['id']
+    cur.execute('SELECT amount, day, created_at, active FROM t WHERE id = ANY(%s)', [[row_id]])
+    assert cur.fetchone() == {
+        'amount': Decimal('12.50'),
+        'day': date(2024, 3, 1),
+        'created_at': datetime(2024, 3, 1, 10, 30),
+        'active': True,
+    }
+
+
+def test_untyped_columns_are_converted_by_name(conn):
+    cur = conn.cursor()
+    cur.execute('INSERT INTO t (day, created_at) VALUES (%s, %s)', [date(2024, 1, 2), datetime(2024, 1, 2, 3, 4)])
+    cur.execute('SELECT MIN(created_at) AS oldest_created_at, MAX(day) AS last_date, '
+                'MIN(created_at) AS oldest FROM t')
+    row = cur.fetchone()
+    assert row['oldest_created_at'] == datetime(2024, 1, 2, 3, 4)
+    assert row['last_date'] == date(2024, 1, 2)
+    # Имя без суффикса даты не распознается - такие колонки нужно называть *_at/*_date
+    assert row['oldest'] == '2024-01-02 03:04:00'
+
+
+def test_tuple_cursor_and_session_commands(conn):
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    cur.execute('SET search_path TO lombard, public')
+    cur.execute('SELECT %s + 1', [1])
+    assert cur.fetchone() == (2,)